@@ -0,0 +1,147 @@
+# accounts/authentication.py
+import threading
+import time
+from functools import cache
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from books.metrics import record_cache
+
+VERSION_PREFIX = 'auth_principal:version:'
+ENTRY_PREFIX = 'auth_principal:entry:'
+
+
+@cache
+def principal_fields():
+    """
+    Все поля пользователя, кроме пароля, в порядке модели (его ждёт
+    Model.from_db). Пароль в кэш не попадает: у экземпляра это отложенное
+    поле, и save() его не перезапишет.
+    """
+    return tuple(field.attname for field in get_user_model()._meta.concrete_fields if field.attname != 'password')
+
+
+class PrincipalCache:
+    """
+    Пользователь по id без SQL на каждый запрос: в памяти процесса
+    (AUTH_PRINCIPAL_LOCAL_TTL секунд) и в Redis (AUTH_PRINCIPAL_CACHE_TTL).
+    Запись в Redis хранит версию пользователя, прочитанную до запроса к БД;
+    bump() увеличивает версию, и все записи о пользователе разом устаревают.
+    Копии в памяти других процессов живут не дольше LOCAL_TTL — это верхняя
+    граница, через которую отключённый или удалённый пользователь перестаёт
+    проходить аутентификацию.
+
+    Хранятся значения полей, а не объект: каждый запрос получает свой
+    экземпляр и может менять и сохранять его.
+    """
+
+    def __init__(self, alias='default', max_local=10000):
+        self.alias = alias
+        self.max_local = max_local
+        self._local = {}  # user_id -> (истекает, значения | None)
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, user_id):
+        """
+        Экземпляр пользователя или None, если его нет в БД.
+        """
+        values = self._values(user_id)
+        if values is None:
+            return None
+        return get_user_model().from_db(DEFAULT_DB_ALIAS, principal_fields(), values)
+
+    def bump(self, user_id):
+        with self._lock:
+            self._local.pop(user_id, None)
+        key = f'{VERSION_PREFIX}{user_id}'
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            if not self.cache.add(key, time.time_ns(), timeout=None):
+                self.cache.incr(key)
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def _values(self, user_id):
+        local_ttl = settings.AUTH_PRINCIPAL_LOCAL_TTL
+        now = time.monotonic()
+        if local_ttl > 0:
+            local = self._local.get(user_id)
+            if local is not None and local[0] > now:
+                record_cache('auth_principal_local', hits=1)
+                return local[1]
+            record_cache('auth_principal_local', misses=1)
+
+        version_key, entry_key = f'{VERSION_PREFIX}{user_id}', f'{ENTRY_PREFIX}{user_id}'
+        found = self.cache.get_many([version_key, entry_key])
+        version = found.get(version_key)
+        if version is None:
+            # Как у тегов response_cache: новая версия из time_ns не совпадёт со старыми записями
+            self.cache.add(version_key, time.time_ns(), timeout=None)
+            version = self.cache.get(version_key)
+        entry = found.get(entry_key)
+        if entry is not None and entry[0] == version:
+            record_cache('auth_principal', hits=1)
+            values = entry[1]
+        else:
+            record_cache('auth_principal', misses=1)
+            # Удалённого пользователя тоже кэшируем (None): просроченные токены не будут ходить в БД
+            values = get_user_model()._default_manager.filter(
+                **{api_settings.USER_ID_FIELD: user_id}
+            ).values_list(*principal_fields()).first()
+            self.cache.set(entry_key, (version, values), timeout=settings.AUTH_PRINCIPAL_CACHE_TTL)
+
+        if local_ttl > 0:
+            with self._lock:
+                if len(self._local) >= self.max_local:
+                    self._local.clear()
+                self._local[user_id] = (now + local_ttl, values)
+        return values
+
+
+principal_cache = PrincipalCache()
+
+
+def bump_on_commit(user_id):
+    """
+    Новая версия после коммита: иначе параллельный запрос успеет закэшировать
+    ещё не закоммиченное состояние под новой версией.
+    """
+    transaction.on_commit(lambda: principal_cache.bump(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication с пользователем из principal_cache вместо SELECT на
+    каждый запрос. Ошибки те же, что у simplejwt (user_not_found,
+    user_inactive). С CHECK_REVOKE_TOKEN нужен хэш пароля, которого в кэше
+    нет, — тогда пользователь читается из БД, как в simplejwt.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = principal_cache.get(user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
@@ -0,0 +1,77 @@
+import time
+from contextlib import ExitStack
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client, RequestFactory, override_settings
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.authentication import CachedJWTAuthentication, principal_cache
+from accounts.models import User
+from books.benchmarks import count_queries, measure, summarize
+from books.management.commands.bench_endpoints import bench_cache
+
+COLUMNS = ('case', 'auth', 'requests', 'rps', 'queries', 'p50_ms', 'p95_ms')
+# (имя, класс аутентификации, AUTH_PRINCIPAL_LOCAL_TTL; None — как в настройках)
+AUTH_MODES = (
+    ('jwt', JWTAuthentication, None),
+    ('cached_redis', CachedJWTAuthentication, 0),
+    ('cached', CachedJWTAuthentication, None),
+)
+CASES = (
+    # Ответ из кэша ответов: кроме аутентификации, SQL нет
+    ('search_cached', '/api/books/search/?query=bench_auth'),
+    ('exchanges_list', '/api/exchange-requests/list/'),
+)
+
+
+class Command(BaseCommand):
+    help = ('Пропускная способность с JWTAuthentication из simplejwt и с CachedJWTAuthentication '
+            '(только Redis и Redis + память процесса): голый authenticate() и запросы через Client. '
+            'Печатает TSV: case, auth, requests, rps, queries, p50_ms, p95_ms')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help='Запросов на случай')
+
+    def handle(self, *args, **options):
+        self.stdout.write('\t'.join(COLUMNS))
+        with ExitStack() as stack:
+            stack.enter_context(mock.patch.object(APIView, 'get_throttles', return_value=[]))
+            stack.enter_context(bench_cache('warm'))
+            stack.enter_context(transaction.atomic())
+            user = User.objects.create(username='bench_auth', email='bench_auth@example.com')
+            token = str(AccessToken.for_user(user))
+            try:
+                for mode, authentication_class, local_ttl in AUTH_MODES:
+                    self._bench_mode(mode, authentication_class, local_ttl, token, options['requests'])
+            finally:
+                principal_cache.clear_local()
+                transaction.set_rollback(True)
+
+    def _bench_mode(self, mode, authentication_class, local_ttl, token, requests):
+        overrides = {} if local_ttl is None else {'AUTH_PRINCIPAL_LOCAL_TTL': local_ttl}
+        with override_settings(**overrides), \
+                mock.patch.object(APIView, 'authentication_classes', [authentication_class]):
+            principal_cache.clear_local()
+            request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+            authenticator = authentication_class()
+            self._row('authenticate', mode, requests, lambda: authenticator.authenticate(request))
+
+            client = Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+            for name, url in CASES:
+                self._row(name, mode, requests, lambda: client.get(url))
+
+    def _row(self, case, mode, requests, func):
+        func()  # прогрев: кэш пользователя и кэш ответов
+        with count_queries() as queries:
+            func()
+        started = time.perf_counter()
+        samples = measure(func, repeat=requests, warmup=0)
+        rps = requests / (time.perf_counter() - started)
+        stats = summarize(samples)
+        self.stdout.write('\t'.join(str(value) for value in (
+            case, mode, requests, round(rps), queries[0], stats['p50_ms'], stats['p95_ms']
+        )))
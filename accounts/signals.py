@@ -0,0 +1,21 @@
+# accounts/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from accounts.authentication import bump_on_commit
+from accounts.models import User
+
+
+# Любое сохранение (UserUpdateView, PasswordResetConfirmView, админка) и
+# удаление (UserDeleteView) сбрасывает закэшированного пользователя.
+# QuerySet.update() сигналов не шлёт — после него нужен principal_cache.bump()
+@receiver(post_save, sender=User)
+def bump_principal_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    bump_on_commit(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def bump_principal_on_delete(sender, instance, **kwargs):
+    bump_on_commit(instance.pk)
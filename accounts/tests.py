@@ -1,3 +1,73 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from accounts.authentication import CachedJWTAuthentication, principal_cache
+from accounts.models import User
+from accounts.views import UserDeleteView, UserUpdateView
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES, AUTH_PRINCIPAL_LOCAL_TTL=0)
+class CachedJWTAuthenticationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        principal_cache.clear_local()
+        self.user = User.objects.create_user('reader', 'reader@example.com', 'password')
+        self.header = f'Bearer {AccessToken.for_user(self.user)}'
+
+    def authenticate(self):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=self.header)
+        user, _ = CachedJWTAuthentication().authenticate(request)
+        return user
+
+    def test_cached_principal_needs_no_queries(self):
+        self.authenticate()
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+        self.assertEqual((user.pk, user.username, user.is_active), (self.user.pk, 'reader', True))
+
+    def test_deactivated_and_deleted_users_are_rejected(self):
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        with self.assertRaises(AuthenticationFailed) as raised:
+            self.authenticate()
+        self.assertEqual(raised.exception.detail['code'], 'user_inactive')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        with self.assertRaises(AuthenticationFailed) as raised:
+            self.authenticate()
+        self.assertEqual(raised.exception.detail['code'], 'user_not_found')
+
+    def test_update_view_saves_cached_principal_without_touching_password(self):
+        self.authenticate()
+        request = APIRequestFactory().put('/', {'username': 'renamed'}, format='json', HTTP_AUTHORIZATION=self.header)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = UserUpdateView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.authenticate().username, 'renamed')
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('password'))
+
+        request = APIRequestFactory().delete('/', HTTP_AUTHORIZATION=self.header)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = UserDeleteView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    @override_settings(AUTH_PRINCIPAL_LOCAL_TTL=60)
+    def test_local_copy_is_dropped_on_bump(self):
+        self.authenticate()
+        with self.assertNumQueries(0):
+            self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Ann'
+            self.user.save()
+        self.assertEqual(self.authenticate().first_name, 'Ann')
@@ -1,5 +1,5 @@
 # book_microservice/settings.py
-from decouple import config
+from decouple import Csv, config
 from pathlib import Path
 import os
 from dotenv import load_dotenv
@@ -22,6 +22,21 @@ cloudinary.config(
 
 GOOGLE_API_KEY = config('GOOGLE_API_KEY')
 
+# Клиент Google Books (books/google_books.py): пул соединений, таймауты, ретраи.
+# GOOGLE_BOOKS_SINGLE_FLIGHT='redis' склеивает одинаковые запросы между воркерами
+GOOGLE_BOOKS_CONNECT_TIMEOUT = config('GOOGLE_BOOKS_CONNECT_TIMEOUT', default=3.05, cast=float)
+GOOGLE_BOOKS_READ_TIMEOUT = config('GOOGLE_BOOKS_READ_TIMEOUT', default=5, cast=float)
+GOOGLE_BOOKS_MAX_RETRIES = config('GOOGLE_BOOKS_MAX_RETRIES', default=2, cast=int)
+GOOGLE_BOOKS_POOL_SIZE = config('GOOGLE_BOOKS_POOL_SIZE', default=20, cast=int)
+GOOGLE_BOOKS_SINGLE_FLIGHT = config('GOOGLE_BOOKS_SINGLE_FLIGHT', default='local')
+# Сохранённый том Google Books (books.google_volumes) перезапрашивается, если он старше стольких дней
+GOOGLE_VOLUME_REFRESH_DAYS = config('GOOGLE_VOLUME_REFRESH_DAYS', default=30, cast=int)
+
+# Конфигурация полнотекстового поиска Postgres ('simple' не зависит от языка каталога)
+BOOK_SEARCH_CONFIG = config('BOOK_SEARCH_CONFIG', default='simple')
+# Максимальный радиус для /api/books/nearby/
+BOOK_NEARBY_MAX_RADIUS_KM = config('BOOK_NEARBY_MAX_RADIUS_KM', default=50, cast=float)
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = config('SECRET_KEY')
@@ -37,12 +52,14 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'books',
     'accounts',
 ]
 
 MIDDLEWARE = [
+    'books.metrics.MetricsMiddleware',  # первым: латентность включает остальные middleware
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -90,18 +107,23 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # GCRA в одном Lua-скрипте Redis (books.throttling); ScopedGCRAThrottle добавляет
+    # отдельный бюджет представлениям с throttle_scope
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle',
+        'books.throttling.AnonGCRAThrottle',
+        'books.throttling.UserGCRAThrottle',
+        'books.throttling.ScopedGCRAThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/day',
         'user': '1000/day',
+        'suggestions': '30/min',  # каждый промах кэша — запрос в Google Books
+        'photo_uploads': '60/hour',  # обработка и загрузка в Cloudinary
     },
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,  # Количество записей на странице
@@ -118,6 +140,49 @@ CACHES = {
     }
 }
 
+# Фоновая загрузка фото (books.photo_jobs, python manage.py photo_worker).
+# Для разработки без Cloudinary: PHOTO_STORAGE_BACKEND=books.photo_storage.LocalPhotoStorage
+PHOTO_STORAGE_BACKEND = config('PHOTO_STORAGE_BACKEND', default='books.photo_storage.CloudinaryPhotoStorage')
+PHOTO_STORAGE_OPTIONS = {}
+PHOTO_SPOOL_DIR = config('PHOTO_SPOOL_DIR', default=str(BASE_DIR / 'spool' / 'photos'))
+PHOTO_JOB_MAX_ATTEMPTS = config('PHOTO_JOB_MAX_ATTEMPTS', default=5, cast=int)
+PHOTO_JOB_RETRY_BASE_SECONDS = config('PHOTO_JOB_RETRY_BASE_SECONDS', default=5, cast=int)
+PHOTO_JOB_LEASE_SECONDS = config('PHOTO_JOB_LEASE_SECONDS', default=300, cast=int)
+PHOTO_WEBP_QUALITY = config('PHOTO_WEBP_QUALITY', default=80, cast=int)
+PHOTO_MAX_PIXELS = config('PHOTO_MAX_PIXELS', default=50_000_000, cast=int)
+MEDIA_URL = '/media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Ответы списков/поиска с тегами (books/response_cache.py) сбрасываются по событиям, а не по времени
+RESPONSE_CACHE_TTL = config('RESPONSE_CACHE_TTL', default=6 * 3600, cast=int)
+
+# Пакетный lookup /api/books/owners/: максимум id в запросе и TTL записей id -> владелец
+USER_BOOK_LOOKUP_MAX_BATCH = config('USER_BOOK_LOOKUP_MAX_BATCH', default=1000, cast=int)
+USER_BOOK_LOOKUP_TTL = config('USER_BOOK_LOOKUP_TTL', default=3600, cast=int)
+
+# Рекомендации (books.recommendations): сколько похожих книг хранить и доля жанров в сходстве
+RECOMMENDATIONS_TOP_K = config('RECOMMENDATIONS_TOP_K', default=50, cast=int)
+RECOMMENDATIONS_GENRE_WEIGHT = config('RECOMMENDATIONS_GENRE_WEIGHT', default=0.5, cast=float)
+
+# Фасеты поиска (?facets=true): бакетов на фасет по умолчанию и максимум для ?facet_limit=
+SEARCH_FACET_BUCKETS = config('SEARCH_FACET_BUCKETS', default=10, cast=int)
+SEARCH_FACET_MAX_BUCKETS = config('SEARCH_FACET_MAX_BUCKETS', default=50, cast=int)
+
+# Локальный автокомплит (books.autocomplete): индекс в памяти каждого воркера
+AUTOCOMPLETE_BUILD_IN_BACKGROUND = config('AUTOCOMPLETE_BUILD_IN_BACKGROUND', default=True, cast=bool)
+AUTOCOMPLETE_SYNC_SECONDS = config('AUTOCOMPLETE_SYNC_SECONDS', default=1.0, cast=float)
+AUTOCOMPLETE_REBUILD_SECONDS = config('AUTOCOMPLETE_REBUILD_SECONDS', default=6 * 3600, cast=int)
+AUTOCOMPLETE_MAX_SYNC_CHANGES = config('AUTOCOMPLETE_MAX_SYNC_CHANGES', default=1000, cast=int)
+
+# Кэш подсказок Google Books (books.suggestion_cache): свежесть, сколько ещё отдавать
+# устаревшее с фоновым обновлением, пустые ответы, LRU в памяти воркера
+SUGGESTION_CACHE_TTL = config('SUGGESTION_CACHE_TTL', default=3600, cast=int)
+SUGGESTION_STALE_TTL = config('SUGGESTION_STALE_TTL', default=24 * 3600, cast=int)
+SUGGESTION_NEGATIVE_TTL = config('SUGGESTION_NEGATIVE_TTL', default=300, cast=int)
+SUGGESTION_LOCAL_SIZE = config('SUGGESTION_LOCAL_SIZE', default=1000, cast=int)
+SUGGESTION_LOCAL_TTL = config('SUGGESTION_LOCAL_TTL', default=60, cast=float)
+SUGGESTION_REFRESH_IN_BACKGROUND = config('SUGGESTION_REFRESH_IN_BACKGROUND', default=True, cast=bool)
+
 WSGI_APPLICATION = 'book_microservice.wsgi.application'
 
 LANGUAGE_CODE = 'en-us'
@@ -132,8 +197,27 @@ STATICFILES_FINDERS = [
 ]
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
+# Пользователь из JWT без SELECT на запрос (accounts.authentication): в Redis до
+# AUTH_PRINCIPAL_CACHE_TTL секунд (сбрасывается версией при изменении пользователя),
+# в памяти процесса — AUTH_PRINCIPAL_LOCAL_TTL секунд (0 — выключено): столько
+# отключённый пользователь ещё может проходить в других процессах
+AUTH_PRINCIPAL_CACHE_TTL = config('AUTH_PRINCIPAL_CACHE_TTL', default=300, cast=int)
+AUTH_PRINCIPAL_LOCAL_TTL = config('AUTH_PRINCIPAL_LOCAL_TTL', default=2.0, cast=float)
+
+# Метрики процесса (books.metrics) на GET /metrics; METRICS_TOKEN — Bearer-токен для скрейпера.
+# Без токена /metrics отвечает только адресам из METRICS_ALLOWED_NETWORKS (по умолчанию — localhost)
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+METRICS_ALLOWED_NETWORKS = config('METRICS_ALLOWED_NETWORKS', default='127.0.0.0/8,::1/128', cast=Csv())
+
+# Куда /api/books/ingest/ сохраняет загруженные файлы каталога и checkpoint'ы; загружает их ingest_worker
+CATALOG_INGEST_DIR = config('CATALOG_INGEST_DIR', default=str(BASE_DIR / 'ingest'))
+CATALOG_INGEST_MAX_ATTEMPTS = config('CATALOG_INGEST_MAX_ATTEMPTS', default=3, cast=int)
+CATALOG_INGEST_LEASE_SECONDS = config('CATALOG_INGEST_LEASE_SECONDS', default=300, cast=int)
+CATALOG_INGEST_RETRY_BASE_SECONDS = config('CATALOG_INGEST_RETRY_BASE_SECONDS', default=60, cast=int)
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
 ]
 
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -1,6 +1,6 @@
 # books/admin.py
 from django.contrib import admin
-from books.models import Book, UserBook, Photo, Genre
+from books.models import Book, BookMergeProposal, UserBook, Photo, Genre
 
 
 @admin.register(Book)
@@ -46,4 +46,12 @@ class PhotoAdmin(admin.ModelAdmin):
 @admin.register(Genre)
 class GenreAdmin(admin.ModelAdmin):
     list_display = ['id', 'name']
-    search_fields = ['name']
\ No newline at end of file
+    search_fields = ['name']
+
+# Предложения find_duplicate_books: неверные удаляются здесь до merge_books
+@admin.register(BookMergeProposal)
+class BookMergeProposalAdmin(admin.ModelAdmin):
+    list_display = ['duplicate', 'canonical', 'score', 'created_at']
+    list_select_related = ['duplicate', 'canonical']
+    ordering = ['score']
+    raw_id_fields = ['duplicate', 'canonical']
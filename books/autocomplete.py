@@ -0,0 +1,363 @@
+# books/autocomplete.py
+import bisect
+import heapq
+import logging
+import sys
+import threading
+import time
+from array import array
+from itertools import chain
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from books.models import UserBook
+
+logger = logging.getLogger(__name__)
+
+SEQ_CACHE_KEY = 'autocomplete:seq'
+CHANGE_CACHE_KEY = 'autocomplete:change:{}'
+CHANGE_TTL = 24 * 3600
+SEPARATOR = '\x1f'  # между name и author в тексте книги
+# Запись индекса — slot << OFFSET_BITS | смещение начала слова в тексте книги
+OFFSET_BITS = 12
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+# Диапазон до SCAN_LIMIT записей просматривается целиком, для более широких
+# (короткие префиксы) держим готовый топ из HEAD_SIZE книг
+SCAN_LIMIT = 2000
+HEAD_SIZE = 50
+MAX_LIMIT = 20
+# Новые записи копятся в маленьком отсортированном списке и вливаются в основной массив пачкой
+OVERLAY_LIMIT = 10000
+
+_BOOKS_SQL = """
+    SELECT b.book_id, b.name, b.author,
+           count(ub.user_book_id) FILTER (WHERE ub.status = 'available')
+    FROM books b
+    LEFT JOIN user_books ub ON ub.book_id_id = b.book_id
+    {where}
+    GROUP BY b.book_id
+    ORDER BY b.book_id
+"""
+
+
+def normalize(text):
+    return ' '.join(text.replace(SEPARATOR, ' ').split()).casefold()
+
+
+def display_text(name, author):
+    return f'{" ".join(name.split())}{SEPARATOR}{" ".join(author.split())}'
+
+
+def word_starts(folded):
+    return [0] + [i + 1 for i, char in enumerate(folded) if char in (' ', SEPARATOR)]
+
+
+def load_books(book_ids=None):
+    where, params = '', None
+    if book_ids is not None:
+        where, params = 'WHERE b.book_id = ANY(%s)', [list(book_ids)]
+    with connection.cursor() as cursor:
+        cursor.execute(_BOOKS_SQL.format(where=where), params)
+        return cursor.fetchall()
+
+
+class _Head:
+    # Топ слотов префикса; floor — ранг лучшей книги вне топа (None — в топе весь диапазон)
+    __slots__ = ('slots', 'floor')
+
+    def __init__(self, slots, floor):
+        self.slots = slots
+        self.floor = floor
+
+
+class PrefixIndex:
+    """
+    Префиксный индекс по началам слов name и author. Книга — слот в
+    параллельных массивах (book_id, число доступных экземпляров, текст
+    "name\\x1fauthor"); индекс — массив записей (слот, смещение слова),
+    отсортированный по тексту с этого смещения. Префикс — это два bisect,
+    сравниваемые строки вычисляются из текста книги на лету, отдельно
+    суффиксы не хранятся. Удалённая или переименованная книга получает вес
+    -1 (переименованная — ещё и новый слот); мусор уходит при пересборке.
+    """
+
+    def __init__(self):
+        self.book_ids = array('i')
+        self.weights = array('i')
+        self.texts = []
+        self.entries = array('Q')
+        self.overlay = []
+        self.heads = {}
+        self._head_length = 0  # длина самого длинного префикса, для которого строился топ
+        self._indexed_ids = 0  # book_ids[:_indexed_ids] отсортированы (из полной сборки)
+        self._moved = {}  # book_id -> слот для книг, добавленных после сборки
+
+    @classmethod
+    def from_rows(cls, rows):
+        index = cls()
+        entries = []
+        for book_id, name, author, weight in rows:
+            entries.extend(index._add_slot(book_id, name, author, weight))
+        folded = [text.casefold() for text in index.texts]
+        entries.sort(key=lambda entry: folded[entry >> OFFSET_BITS][entry & OFFSET_MASK:])
+        index.entries = array('Q', entries)
+        index._indexed_ids = len(index.book_ids)
+        return index
+
+    def memory_bytes(self):
+        # Массивы, список текстов и сами строки (без топов префиксов — они малы)
+        return (
+            sum(sys.getsizeof(part) for part in (self.book_ids, self.weights, self.entries, self.texts, self.overlay))
+            + sum(sys.getsizeof(text) for text in self.texts)
+            + sys.getsizeof(self._moved)
+        )
+
+    def _suffix(self, entry):
+        return self.texts[entry >> OFFSET_BITS].casefold()[entry & OFFSET_MASK:]
+
+    def _rank(self, slot):
+        return (self.weights[slot], -slot)
+
+    def _add_slot(self, book_id, name, author, weight):
+        slot = len(self.texts)
+        text = display_text(name, author)
+        self.texts.append(text)
+        self.book_ids.append(book_id)
+        self.weights.append(weight)
+        return [slot << OFFSET_BITS | offset for offset in word_starts(text.casefold()) if offset <= OFFSET_MASK]
+
+    def slot(self, book_id):
+        if book_id in self._moved:
+            return self._moved[book_id]
+        position = bisect.bisect_left(self.book_ids, book_id, 0, self._indexed_ids)
+        if position < self._indexed_ids and self.book_ids[position] == book_id:
+            return position
+        return None
+
+    def _ranges(self, prefix):
+        upper = prefix + '\U0010ffff'
+        return (
+            (bisect.bisect_left(self.entries, prefix, key=self._suffix),
+             bisect.bisect_left(self.entries, upper, key=self._suffix)),
+            (bisect.bisect_left(self.overlay, prefix, key=self._suffix),
+             bisect.bisect_left(self.overlay, upper, key=self._suffix)),
+        )
+
+    def _live_slots(self, ranges):
+        (lo, hi), (overlay_lo, overlay_hi) = ranges
+        slots = {entry >> OFFSET_BITS for entry in chain(self.entries[lo:hi], self.overlay[overlay_lo:overlay_hi])}
+        return [slot for slot in slots if self.weights[slot] >= 0]
+
+    def _build_head(self, prefix, ranges):
+        top = heapq.nlargest(HEAD_SIZE + 1, self._live_slots(ranges), key=self._rank)
+        floor = self._rank(top[HEAD_SIZE]) if len(top) > HEAD_SIZE else None
+        head = self.heads[prefix] = _Head(top[:HEAD_SIZE], floor)
+        self._head_length = max(self._head_length, len(prefix))
+        return head
+
+    def lookup(self, query, limit=10):
+        """
+        До limit книг, у которых name или author содержит слово, начинающееся
+        с query: [(book_id, name, author, available_copies)], больше
+        доступных экземпляров — выше.
+        """
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        limit = min(limit, MAX_LIMIT)
+        ranges = self._ranges(prefix)
+        (lo, hi), (overlay_lo, overlay_hi) = ranges
+        if hi - lo + overlay_hi - overlay_lo <= SCAN_LIMIT:
+            slots = heapq.nlargest(limit, self._live_slots(ranges), key=self._rank)
+        else:
+            head = self.heads.get(prefix)
+            if head is None or (len(head.slots) < limit and head.floor is not None):
+                head = self._build_head(prefix, ranges)
+            slots = sorted(head.slots, key=self._rank, reverse=True)[:limit]
+        return [
+            (self.book_ids[slot], *self.texts[slot].split(SEPARATOR, 1), self.weights[slot])
+            for slot in slots
+        ]
+
+    def _update_heads(self, slot):
+        """
+        Поддерживает топы префиксов слота после изменения его веса: в топе все
+        книги сильнее floor, вне топа — не сильнее. Если топ стал слишком
+        мал, он пересчитается при следующем запросе.
+        """
+        if not self.heads:
+            return
+        rank, alive = self._rank(slot), self.weights[slot] >= 0
+        folded = self.texts[slot].casefold()
+        # Топы есть только у коротких префиксов — длиннее _head_length не перебираем
+        prefixes = {
+            folded[start:end]
+            for start in word_starts(folded)
+            for end in range(start + 1, min(start + self._head_length, len(folded)) + 1)
+        }
+        for prefix in prefixes:
+            head = self.heads.get(prefix)
+            if head is None:
+                continue
+            if slot in head.slots:
+                if not alive or (head.floor is not None and rank < head.floor):
+                    head.slots.remove(slot)
+            elif alive and (head.floor is None or rank > head.floor):
+                head.slots.append(slot)
+            if head.floor is not None and len(head.slots) < MAX_LIMIT:
+                del self.heads[prefix]
+
+    def set_weight(self, slot, weight):
+        self.weights[slot] = weight
+        self._update_heads(slot)
+
+    def add(self, book_id, name, author, weight):
+        for entry in self._add_slot(book_id, name, author, weight):
+            bisect.insort(self.overlay, entry, key=self._suffix)
+        slot = len(self.texts) - 1
+        self._moved[book_id] = slot
+        self._update_heads(slot)
+        if len(self.overlay) > OVERLAY_LIMIT:
+            self.compact()
+
+    def remove(self, book_id):
+        slot = self.slot(book_id)
+        if slot is not None:
+            self._moved.pop(book_id, None)
+            self.set_weight(slot, -1)
+
+    def apply(self, rows, book_ids):
+        """
+        Применяет свежие строки load_books(book_ids); id без строки — удалены.
+        """
+        found = set()
+        for book_id, name, author, weight in rows:
+            found.add(book_id)
+            slot = self.slot(book_id)
+            if slot is not None and self.texts[slot] == display_text(name, author):
+                if self.weights[slot] != weight:
+                    self.set_weight(slot, weight)
+                continue
+            self.remove(book_id)
+            self.add(book_id, name, author, weight)
+        for book_id in set(book_ids) - found:
+            self.remove(book_id)
+
+    def compact(self):
+        merged = heapq.merge(self.entries, self.overlay, key=self._suffix)
+        self.entries = array('Q', (entry for entry in merged if self.weights[entry >> OFFSET_BITS] >= 0))
+        self.overlay = []
+
+
+class CatalogAutocomplete:
+    """
+    Индекс процесса: строится лениво (по умолчанию в фоновом потоке — пока
+    он не готов, suggest() возвращает None), изменения каталога получает из
+    журнала в кэше (record_changes) не чаще раза в AUTOCOMPLETE_SYNC_SECONDS
+    и целиком пересобирается раз в AUTOCOMPLETE_REBUILD_SECONDS.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._seq = 0
+        self._built_at = 0.0
+        self._synced_at = 0.0
+        self._builder = None
+
+    def suggest(self, query, limit=10):
+        index = self._ready_index()
+        if index is None:
+            return None
+        with self._lock:
+            return self._index.lookup(query, limit)
+
+    def _ready_index(self):
+        now = time.monotonic()
+        if self._index is None or now - self._built_at > settings.AUTOCOMPLETE_REBUILD_SECONDS:
+            self._start_build()
+            if self._index is None:
+                return None
+        if now - self._synced_at > settings.AUTOCOMPLETE_SYNC_SECONDS:
+            self._sync()
+        return self._index
+
+    def _start_build(self):
+        if not settings.AUTOCOMPLETE_BUILD_IN_BACKGROUND:
+            self.build()
+            return
+        with self._lock:
+            if self._builder is not None and self._builder.is_alive():
+                return
+            self._builder = threading.Thread(target=self._build_in_thread, name='autocomplete-build', daemon=True)
+            self._builder.start()
+
+    def _build_in_thread(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception('Failed to build autocomplete index')
+        finally:
+            connection.close()  # поток свой, соединение с БД тоже
+
+    def build(self):
+        # Номер журнала — до чтения каталога: изменения во время сборки применятся повторно
+        seq = _current_seq()
+        started = time.monotonic()
+        index = PrefixIndex.from_rows(load_books())
+        with self._lock:
+            self._index, self._seq = index, seq
+            self._built_at = self._synced_at = time.monotonic()
+        logger.info('Autocomplete index built: %s books in %.1fs', len(index.book_ids), time.monotonic() - started)
+        return index
+
+    def _sync(self):
+        self._synced_at = time.monotonic()
+        seq = _current_seq()
+        if seq == self._seq:
+            return
+        keys = [CHANGE_CACHE_KEY.format(n) for n in range(self._seq + 1, seq + 1)]
+        changes = cache.get_many(keys) if 0 < len(keys) <= settings.AUTOCOMPLETE_MAX_SYNC_CHANGES else {}
+        if len(changes) < len(keys) or not keys:
+            # Журнал сброшен, истёк или слишком длинный — дешевле собрать заново
+            self._built_at = 0.0
+            self._start_build()
+            return
+        book_ids = {book_id for change in changes.values() for book_id in change}
+        rows = load_books(book_ids)
+        with self._lock:
+            self._index.apply(rows, book_ids)
+            self._seq = seq
+
+    def reset(self):
+        with self._lock:
+            self._index, self._seq, self._built_at, self._synced_at = None, 0, 0.0, 0.0
+
+
+def _current_seq():
+    return cache.get(SEQ_CACHE_KEY) or 0
+
+
+def record_changes(book_ids=(), user_book_ids=()):
+    """
+    После коммита пишет id изменившихся книг в журнал: каждый процесс
+    применит их к своему индексу при следующей синхронизации.
+    """
+    book_ids, user_book_ids = list(book_ids), list(user_book_ids)
+    if book_ids or user_book_ids:
+        transaction.on_commit(lambda: _publish(book_ids, user_book_ids))
+
+
+def _publish(book_ids, user_book_ids):
+    if user_book_ids:
+        book_ids = book_ids + list(
+            UserBook.objects.filter(pk__in=user_book_ids).values_list('book_id_id', flat=True)
+        )
+    cache.add(SEQ_CACHE_KEY, 0, timeout=None)
+    seq = cache.incr(SEQ_CACHE_KEY)
+    cache.set(CHANGE_CACHE_KEY.format(seq), sorted(set(book_ids)), timeout=CHANGE_TTL)
+
+
+autocomplete = CatalogAutocomplete()
@@ -0,0 +1,54 @@
+# books/benchmarks.py
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure(func, repeat=20, warmup=2):
+    """
+    Вызывает func() repeat раз и возвращает длительности в миллисекундах.
+    """
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def summarize(samples):
+    return {
+        'p50_ms': round(percentile(samples, 50), 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'p99_ms': round(percentile(samples, 99), 3),
+        'mean_ms': round(statistics.fmean(samples), 3) if samples else 0.0,
+    }
+
+
+@contextmanager
+def count_queries(using=connection):
+    """
+    with count_queries() as queries: ... — queries[0] — число выполненных
+    SQL-запросов. В отличие от CaptureQueriesContext не зависит от
+    connection.queries, который обнуляется в начале каждого HTTP-запроса.
+    """
+    queries = [0]
+
+    def counter(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    with using.execute_wrapper(counter):
+        yield queries
@@ -0,0 +1,214 @@
+# books/datasets.py
+import io
+import json
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+
+from accounts.models import User
+from books.genres import genre_dictionary
+from books.geo import geohash_encode
+from books.listings import refresh_listings
+from books.models import ExchangeRequest, UserBook
+from books.search import update_search_vectors
+
+# Словари синтетических названий, авторов и жанров — общие для всех бенчмарков
+WORDS = (
+    'shadow wind river night stone fire winter garden silent empire lost city '
+    'star queen king dragon sea house secret war peace glass iron golden dark '
+    'light road forest mountain song blood moon sun storm island heart letter '
+    'journey child time memory dream ghost crown voice promise hunter spring'
+).split()
+FIRST_NAMES = 'Anna Ivan Maria Peter Olga John Elena Mark Irina Paul Sofia Leo'.split()
+LAST_NAMES = 'Tolstoy Orwell Austen Bulgakov Christie Pratchett Rowling King Gaiman Dumas'.split()
+GENRES = (
+    'Fiction', 'Fantasy', 'Science Fiction', 'Mystery', 'Thriller', 'Romance', 'History',
+    'Biography', 'Poetry', 'Drama', 'Horror', 'Adventure', 'Classics', 'Philosophy',
+    'Psychology', 'Science', 'Travel', 'Humor', 'Children', 'Young Adult',
+)
+
+COPY_CHUNK_ROWS = 50000
+USERS_PER_BOOK = 0.05
+EXTRA_COPIES = 0.2  # доля книг со вторым экземпляром
+PHOTO_SHARE = 0.5
+HISTORY_SHARE = 0.5  # доля экземпляров, которые хоть раз запрашивали
+# Экземпляры раскиданы вокруг городов, у пользователя два адреса
+CITIES = ((55.7558, 37.6173), (59.9343, 30.3351), (56.8389, 60.6057), (55.0084, 82.9357), (43.5855, 39.7231))
+CONDITIONS = ('New', 'Like new', 'Good', 'OK', 'Worn')
+PHOTO_SIZES = (('full', 1600, 1200), ('medium', 640, 480), ('thumb', 160, 120))
+
+
+def _copy_value(value):
+    if value is None:
+        return r'\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def copy_rows(table, columns, rows):
+    """
+    COPY table (columns) FROM STDIN порциями по COPY_CHUNK_ROWS строк.
+    rows — итератор кортежей, сигналы и save() не вызываются.
+    """
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    count = 0
+    buffer = io.StringIO()
+    with connection.cursor() as cursor:
+        for row in rows:
+            buffer.write('\t'.join(map(_copy_value, row)))
+            buffer.write('\n')
+            count += 1
+            if count % COPY_CHUNK_ROWS == 0:
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+                buffer = io.StringIO()
+        if buffer.tell():
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+    return count
+
+
+def reserve_ids(table, column, count):
+    # id берутся из той же последовательности, что и у обычных INSERT
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)', [table, column, count]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def generate(size, seed=42, prefix='bench', log=None):
+    """
+    Синтетический каталог из size книг: пользователи (владельцы распределены
+    по Ципфу — есть «тяжёлые» полки), жанры, экземпляры с координатами, фото
+    и история обменов. Всё пишется через COPY, затем пересчитываются
+    search_vector и витрина user_book_listings. Возвращает статистику и
+    describe(prefix).
+    """
+    if User.objects.filter(username=f'{prefix}_0').exists():
+        raise ValueError(f"Dataset '{prefix}' already exists")
+    log = log or (lambda message: None)
+    rng = random.Random(seed)
+    now = timezone.now()
+    timings = {}
+    started = time.monotonic()
+
+    def step(name):
+        nonlocal started
+        timings[f'{name}_s'] = round(time.monotonic() - started, 3)
+        log(f'{name}: {timings[name + "_s"]} s')
+        started = time.monotonic()
+
+    user_ids = reserve_ids('accounts_user', 'id', max(10, int(size * USERS_PER_BOOK)))
+    password = make_password(None)
+    copy_rows('accounts_user', (
+        'id', 'password', 'is_superuser', 'username', 'first_name', 'last_name', 'email',
+        'is_staff', 'is_active', 'date_joined', 'created_at',
+    ), (
+        (user_id, password, False, f'{prefix}_{i}', rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES),
+         f'{prefix}_{i}@example.com', False, True, now, now)
+        for i, user_id in enumerate(user_ids)
+    ))
+    step('users')
+
+    genre_ids = list(genre_dictionary.resolve(GENRES).values())
+    book_ids = reserve_ids('books', 'book_id', size)
+    copy_rows('books', ('book_id', 'name', 'author', 'overview'), (
+        (book_id, f"{' '.join(rng.sample(WORDS, 3)).title()} {prefix}-{i}",
+         f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}', ' '.join(rng.choices(WORDS, k=30)))
+        for i, book_id in enumerate(book_ids)
+    ))
+    copy_rows('books_genres', ('book_id', 'genre_id'), (
+        (book_id, genre_id) for book_id in book_ids for genre_id in rng.sample(genre_ids, rng.randint(1, 3))
+    ))
+    step('books')
+
+    addresses = []
+    for _ in range(min(len(user_ids) * 2, 50000)):
+        city_lat, city_lon = rng.choice(CITIES)
+        lat, lon = round(city_lat + rng.gauss(0, 0.08), 6), round(city_lon + rng.gauss(0, 0.12), 6)
+        addresses.append((f'{lat},{lon}', lat, lon, geohash_encode(lat, lon)))
+
+    copy_book_ids = book_ids + rng.sample(book_ids, int(size * EXTRA_COPIES))
+    owners = rng.choices(
+        range(len(user_ids)), cum_weights=list(accumulate(1 / rank for rank in range(1, len(user_ids) + 1))),
+        k=len(copy_book_ids),
+    )
+    user_book_ids = reserve_ids('user_books', 'user_book_id', len(copy_book_ids))
+    statuses = ['available'] * len(user_book_ids)
+
+    requests = []
+    for index in rng.sample(range(len(user_book_ids)), int(len(user_book_ids) * HISTORY_SHARE)):
+        created_at = now - timedelta(days=rng.uniform(1, 365))
+        for attempt in range(rng.randint(1, 3), 0, -1):
+            requester = rng.randrange(len(user_ids) - 1)
+            requester += requester >= owners[index]  # любой, кроме владельца
+            status = 'rejected'
+            if attempt == 1:
+                status = rng.choices(('rejected', 'pending', 'accepted'), weights=(70, 15, 15))[0]
+                statuses[index] = {'rejected': 'available', 'pending': 'requested', 'accepted': 'exchanged'}[status]
+            requests.append((user_book_ids[index], user_ids[requester], user_ids[owners[index]], status, created_at))
+            created_at += timedelta(hours=rng.uniform(1, 72))
+
+    def user_book_rows():
+        for user_book_id, owner, book_id, status in zip(user_book_ids, owners, copy_book_ids, statuses):
+            location, lat, lon, geohash = addresses[(owner * 2 + rng.randint(0, 1)) % len(addresses)]
+            yield (user_book_id, user_ids[owner], book_id, rng.choice(CONDITIONS), location, status, lat, lon, geohash)
+
+    copy_rows('user_books', (
+        'user_book_id', 'user_id', 'book_id_id', 'condition', 'location', 'status', 'latitude', 'longitude', 'geohash',
+    ), user_book_rows())
+    step('user_books')
+
+    photos = rng.sample(user_book_ids, int(len(user_book_ids) * PHOTO_SHARE))
+    copy_rows('photo', ('user_book_id_id', 'file_path', 'status', 'variants'), (
+        (user_book_id, f'https://example.com/{prefix}/{user_book_id}/full.webp', 'ready', json.dumps({
+            name: {'url': f'https://example.com/{prefix}/{user_book_id}/{name}.webp', 'width': width, 'height': height}
+            for name, width, height in PHOTO_SIZES
+        }))
+        for user_book_id in photos
+    ))
+    copy_rows('exchange_requests', ('book_id', 'requester_id', 'owner_id', 'status', 'created_at'), requests)
+    step('photos_exchanges')
+
+    update_search_vectors(book_ids)
+    refresh_listings(id_range=(user_book_ids[0], user_book_ids[-1] + 1))
+    with connection.cursor() as cursor:
+        for table in ('accounts_user', 'books', 'books_genres', 'user_books', 'user_book_listings',
+                      'photo', 'exchange_requests'):
+            cursor.execute(f'ANALYZE {table}')
+    step('derived')
+
+    return {
+        'users': len(user_ids), 'books': size, 'user_books': len(user_book_ids), 'photos': len(photos),
+        'exchange_requests': len(requests), **timings, **describe(prefix),
+    }
+
+
+def describe(prefix='bench'):
+    """
+    Опорные объекты набора для бенчмарков: самый «тяжёлый» владелец и
+    отправитель запросов, доступный экземпляр и кто может его запросить,
+    пачка id экземпляров для /api/books/owners/.
+    """
+    user_books = UserBook.objects.filter(user__username__startswith=f'{prefix}_')
+    heavy_owner = user_books.values('user_id').annotate(copies=Count('pk')).order_by('-copies', 'user_id').first()
+    if heavy_owner is None:
+        raise ValueError(f"Dataset '{prefix}' not found")
+    heavy_requester = ExchangeRequest.objects.filter(
+        requester__username__startswith=f'{prefix}_'
+    ).values('requester_id').annotate(requests=Count('pk')).order_by('-requests', 'requester_id').first()
+    available = user_books.filter(status='available').exclude(user_id=heavy_owner['user_id']).order_by('pk').first()
+    return {
+        'heavy_owner_id': heavy_owner['user_id'],
+        'heavy_owner_copies': heavy_owner['copies'],
+        'heavy_requester_id': heavy_requester['requester_id'] if heavy_requester else heavy_owner['user_id'],
+        'available_user_book_id': available.pk,
+        'lookup_user_book_ids': list(user_books.order_by('pk').values_list('pk', flat=True)[:100]),
+        'center': CITIES[0],
+    }
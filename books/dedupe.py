@@ -0,0 +1,412 @@
+# books/dedupe.py
+import hashlib
+import re
+import time
+import unicodedata
+
+import numpy as np
+from django.db import connection, transaction
+from django.utils import timezone
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from books.autocomplete import record_changes as record_autocomplete_changes
+from books.datasets import copy_rows
+from books.listings import refresh_listings
+from books.lookups import invalidate_user_book_lookups
+from books.models import BookMergeProposal
+from books.recommendations import mark_books_stale, mark_users_stale
+from books.response_cache import (
+    TAG_BOOKS, TAG_USER_BOOK_COUNTS, TAG_USER_BOOKS, book_tag, invalidate_on_commit, user_book_tag, user_tag
+)
+from books.search import update_search_vectors
+
+# MinHash по 3-граммам байт названия: NUM_PERM хэшей, LSH — BANDS полос по ROWS.
+# Кандидатом пара становится с вероятностью 1 - (1 - J^ROWS)^BANDS: ~0.89 при
+# сходстве 0.7 и ~0.02 при 0.3
+NUM_PERM = 32
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+PERM_BLOCK = 8  # хэшей за проход: матрица шинглов × PERM_BLOCK uint64 на порцию
+SEED = 20251018
+DEFAULT_THRESHOLD = 0.7
+READ_CHUNK = 20000
+MAX_BUCKET = 20
+
+_BRACKETS = re.compile(r'\([^)]*\)|\[[^\]]*\]')
+_SUBTITLE = re.compile(r'\s*(?::|\s[-–—]\s)(.*)$')
+_TRAILING_ARTICLE = re.compile(r',\s*(?:the|a|an)\s*$')
+_WORDS = re.compile(r'[^\W_]+')
+_NUMBERS = re.compile(r'\d+|\b(?:ii|iii|iv|vi|vii|viii|ix)\b')
+ARTICLES = frozenset({'the', 'a', 'an'})
+# Подзаголовок с такими словами — издание, а не другая книга («Dune: Deluxe Edition»)
+EDITION_WORDS = frozenset({
+    'edition', 'ed', 'anniversary', 'illustrated', 'deluxe', 'unabridged', 'abridged', 'annotated',
+    'revised', 'classic', 'classics', 'collector', 'collectors', 'reprint', 'paperback', 'hardcover', 'novel',
+})
+
+
+def _fold(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(ch for ch in text if not unicodedata.combining(ch)).casefold().strip()
+
+
+def normalize_title(name):
+    """
+    «The Hobbit», «Hobbit, The» и «The Hobbit (75th Anniversary Edition)» —
+    одно «hobbit». Подзаголовок после «:» или « - » отбрасывается, только
+    если он про издание: «Star Wars: A New Hope» остаётся собой.
+    """
+    folded = _fold(name).replace('&', ' and ')
+    text = _BRACKETS.sub(' ', folded).strip() or folded
+    subtitle = _SUBTITLE.search(text)
+    if subtitle and subtitle.start() and EDITION_WORDS & set(_WORDS.findall(subtitle.group(1))):
+        text = text[:subtitle.start()]
+    words = _WORDS.findall(_TRAILING_ARTICLE.sub('', text))
+    if len(words) > 1 and words[0] in ARTICLES:
+        words = words[1:]
+    return ' '.join(words) or ' '.join(_WORDS.findall(folded))
+
+
+def normalize_author(author):
+    # «J.R.R. Tolkien» и «Tolkien, J. R. R.» — «tolkien»; инициалы и «Unknown» не в счёт
+    return ' '.join(sorted({word for word in _WORDS.findall(_fold(author)) if len(word) > 1 and word != 'unknown'}))
+
+
+def number_key(title_key):
+    # «Dragon Tale 1» и «Dragon Tale 2», «Rocky II» и «Rocky III» — разные книги при любом сходстве
+    numbers = _NUMBERS.findall(title_key)
+    return fingerprint(' '.join(number.lstrip('0') for number in numbers), '') if numbers else 0
+
+
+def fingerprint(title_key, author_key):
+    digest = hashlib.blake2b(f'{title_key}\x1f{author_key}'.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+def _permutations():
+    rng = np.random.default_rng(SEED)
+    # Multiply-shift: (a * x + b) mod 2^64, старшие 32 бита; a нечётное
+    a = rng.integers(1, 2 ** 63, size=NUM_PERM, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 2 ** 63, size=NUM_PERM, dtype=np.uint64)
+    return a, b
+
+
+_PERM_A, _PERM_B = _permutations()
+
+
+def minhash_signatures(texts):
+    """
+    Сигнатуры (len(texts) × NUM_PERM, uint32) без цикла по строкам: байты
+    всех текстов склеиваются в один массив, 3-граммы на стыках
+    отбрасываются, минимум по каждому тексту — np.minimum.reduceat.
+    """
+    encoded = [f' {text} '.encode('utf-8').ljust(3) for text in texts]
+    signatures = np.empty((len(encoded), NUM_PERM), dtype=np.uint32)
+    if not encoded:
+        return signatures
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint64)
+    shingles = (data[:-2] << np.uint64(16)) | (data[1:-1] << np.uint64(8)) | data[2:]
+    ends = np.cumsum(lengths)
+    valid = np.ones(len(shingles), dtype=bool)
+    crossing = np.concatenate((ends - 2, ends - 1))
+    valid[crossing[crossing < len(shingles)]] = False
+    shingles = shingles[valid]
+    starts = np.concatenate(([0], np.cumsum(lengths - 2)[:-1]))
+    for block in range(0, NUM_PERM, PERM_BLOCK):
+        a, b = _PERM_A[block:block + PERM_BLOCK], _PERM_B[block:block + PERM_BLOCK]
+        hashed = ((shingles[:, None] * a + b) >> np.uint64(32)).astype(np.uint32)
+        signatures[:, block:block + PERM_BLOCK] = np.minimum.reduceat(hashed, starts, axis=0)
+    return signatures
+
+
+def _read_chunks(chunk_size):
+    # Keyset-пагинация по PK: память — одна порция, без серверного курсора и транзакции
+    last_id = 0
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute(
+                'SELECT book_id, name, author FROM books WHERE book_id > %s ORDER BY book_id LIMIT %s',
+                [last_id, chunk_size],
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1][0]
+
+
+class CatalogSignatures:
+    """
+    Всё, что нужно для поиска пар, индексируется позицией книги: book_ids,
+    signatures (MinHash названия), authors (номер нормализованного автора в
+    author_tokens), fingerprints (хэш нормализованных названия и автора),
+    numbers (number_key названия).
+    """
+
+    def __init__(self, chunk_size=READ_CHUNK):
+        author_numbers = {}
+        book_ids, signatures, authors, fingerprints, numbers = [], [], [], [], []
+        for rows in _read_chunks(chunk_size):
+            titles = []
+            for book_id, name, author in rows:
+                title_key, author_key = normalize_title(name), normalize_author(author)
+                titles.append(title_key)
+                authors.append(author_numbers.setdefault(author_key, len(author_numbers)))
+                fingerprints.append(fingerprint(title_key, author_key))
+                numbers.append(number_key(title_key))
+                book_ids.append(book_id)
+            signatures.append(minhash_signatures(titles))
+        self.book_ids = np.array(book_ids, dtype=np.int64)
+        self.signatures = np.concatenate(signatures) if signatures else np.empty((0, NUM_PERM), dtype=np.uint32)
+        self.authors = np.array(authors, dtype=np.int64)
+        self.author_tokens = [frozenset(author_key.split()) for author_key in author_numbers]
+        self.fingerprints = np.array(fingerprints, dtype=np.int64)
+        self.numbers = np.array(numbers, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.book_ids)
+
+    def candidate_pairs(self):
+        """
+        Пары позиций (i < j) с общей полосой LSH. В корзине до MAX_BUCKET
+        книг — все пары, в большей (частое короткое название) каждая книга
+        связывается только с первой.
+        """
+        pairs = []
+        for band in range(BANDS):
+            rows = self.signatures[:, band * ROWS:(band + 1) * ROWS].astype(np.uint64)
+            keys = np.zeros(len(self), dtype=np.uint64)
+            for row in range(ROWS):
+                keys = (keys ^ rows[:, row]) * np.uint64(0xBF58476D1CE4E5B9)
+                keys ^= keys >> np.uint64(31)
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            new_bucket = np.ones(len(order), dtype=bool)
+            new_bucket[1:] = sorted_keys[1:] != sorted_keys[:-1]
+            starts = np.flatnonzero(new_bucket)
+            sizes = np.diff(np.append(starts, len(order)))
+            bucket_start = np.repeat(starts, sizes)
+            bucket_end = bucket_start + np.repeat(sizes, sizes)
+            position = np.arange(len(order))
+            # Сколько пар начинает каждая позиция: со всеми следующими в корзине или (большая корзина) ни одной
+            small = np.repeat(sizes <= MAX_BUCKET, sizes)
+            counts = np.where(small, bucket_end - position - 1, 0)
+            left = np.repeat(position, counts)
+            right = left + 1 + np.arange(len(left)) - np.repeat(np.cumsum(counts) - counts, counts)
+            pairs.append(np.stack((order[left], order[right]), axis=1))
+            large = ~small & (position != bucket_start)
+            pairs.append(np.stack((order[bucket_start[large]], order[large]), axis=1))
+        pairs = np.sort(np.concatenate(pairs), axis=1)
+        return np.unique(pairs, axis=0)
+
+    def scores(self, left, right):
+        # Оценка Жаккара по доле совпавших минимумов; совпавший отпечаток — ровно 1
+        estimate = (self.signatures[left] == self.signatures[right]).mean(axis=1)
+        return np.where(self.fingerprints[left] == self.fingerprints[right], 1.0, estimate)
+
+    def same_author(self, left, right):
+        """
+        Авторы совместимы, если один из них неизвестен или слова одного
+        входят в слова другого («Tolkien» и «J.R.R. Tolkien»). Проверяется
+        по разу на уникальную пару авторов.
+        """
+        author_pairs = np.sort(np.stack((self.authors[left], self.authors[right]), axis=1), axis=1)
+        unique, inverse = np.unique(author_pairs, axis=0, return_inverse=True)
+        compatible = np.fromiter((
+            a == b or not self.author_tokens[a] or not self.author_tokens[b]
+            or self.author_tokens[a] <= self.author_tokens[b] or self.author_tokens[b] <= self.author_tokens[a]
+            for a, b in unique.tolist()
+        ), dtype=bool, count=len(unique))
+        return compatible[inverse.ravel()]
+
+
+def _rank_inputs(book_ids):
+    # Каноническая книга: больше экземпляров, затем есть том Google, затем меньший id
+    copies = np.zeros(len(book_ids), dtype=np.int64)
+    has_volume = np.zeros(len(book_ids), dtype=bool)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT b.book_id, b.google_volume_id IS NOT NULL, count(ub.user_book_id) FROM books b '
+            'LEFT JOIN user_books ub ON ub.book_id_id = b.book_id WHERE b.book_id = ANY(%s) GROUP BY b.book_id',
+            [book_ids.tolist()],
+        )
+        rows = cursor.fetchall()
+    if rows:
+        found = np.array([row[0] for row in rows], dtype=np.int64)
+        positions = np.searchsorted(book_ids, found)
+        has_volume[positions] = [row[1] for row in rows]
+        copies[positions] = [row[2] for row in rows]
+    return copies, has_volume
+
+
+def _components(size, edges):
+    graph = sparse.coo_matrix((np.ones(len(edges), dtype=np.int8), (edges[:, 0], edges[:, 1])), shape=(size, size))
+    return connected_components(graph, directed=False)[1]
+
+
+def _group(size, matched, authors):
+    """
+    Группы книг: сначала по парам с одинаковым автором, затем по «нестрогим»
+    (автор неизвестен или записан короче). Нестрогая пара учитывается, только
+    если обе её книги нестрого совпали с единственной группой — иначе
+    «The Hobbit (Unknown)» склеил бы «Hobbit» разных авторов.
+    """
+    strict = authors[matched[:, 0]] == authors[matched[:, 1]]
+    labels = _components(size, matched[strict])
+    loose = matched[~strict]
+    if not len(loose):
+        return labels
+    ends = np.concatenate((loose, loose[:, ::-1]))
+    reached = np.unique(np.stack((ends[:, 0], labels[ends[:, 1]]), axis=1), axis=0)
+    books, groups_reached = np.unique(reached[:, 0], return_counts=True)
+    ambiguous = books[groups_reached > 1]
+    loose = loose[~np.isin(loose, ambiguous).any(axis=1)]
+    return _components(size, np.concatenate((matched[strict], loose)))
+
+
+def find_duplicates(threshold=DEFAULT_THRESHOLD, chunk_size=READ_CHUNK):
+    """
+    Полный проход по каталогу: сигнатуры порциями, пары-кандидаты LSH,
+    проверка по полной сигнатуре, группы — компоненты связности. Заменяет
+    все предложения в book_merge_proposals. Возвращает статистику.
+    """
+    stats = {}
+    timer = time.perf_counter()
+    catalog = CatalogSignatures(chunk_size)
+    stats['signatures_s'] = round(time.perf_counter() - timer, 3)
+
+    timer = time.perf_counter()
+    pairs = catalog.candidate_pairs()
+    left, right = pairs[:, 0], pairs[:, 1]
+    matched = pairs[(catalog.numbers[left] == catalog.numbers[right]) & (catalog.scores(left, right) >= threshold)]
+    matched = matched[catalog.same_author(matched[:, 0], matched[:, 1])]
+    labels = _group(len(catalog), matched, catalog.authors)
+    sizes = np.bincount(labels)
+    clustered = np.flatnonzero(sizes[labels] > 1)
+    stats['candidates_s'] = round(time.perf_counter() - timer, 3)
+
+    timer = time.perf_counter()
+    copies, has_volume = _rank_inputs(catalog.book_ids[clustered])
+    order = np.lexsort((catalog.book_ids[clustered], ~has_volume, -copies, labels[clustered]))
+    ranked = clustered[order]
+    ranked_labels = labels[ranked]
+    is_canonical = np.ones(len(ranked), dtype=bool)
+    is_canonical[1:] = ranked_labels[1:] != ranked_labels[:-1]
+    canonical = ranked[np.flatnonzero(is_canonical)][np.cumsum(is_canonical) - 1]
+    duplicates, canonical = ranked[~is_canonical], canonical[~is_canonical]
+    scores = catalog.scores(duplicates, canonical)
+
+    created_at = timezone.now().isoformat()
+    with transaction.atomic():
+        BookMergeProposal.objects.all().delete()
+        copy_rows(
+            BookMergeProposal._meta.db_table, ('duplicate_id', 'canonical_id', 'score', 'created_at'),
+            zip(catalog.book_ids[duplicates].tolist(), catalog.book_ids[canonical].tolist(),
+                np.round(scores, 4).tolist(), [created_at] * len(duplicates)),
+        )
+        # merge_books сразу читает таблицу целиком — статистика нужна уже сейчас
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {BookMergeProposal._meta.db_table}')
+    stats['write_s'] = round(time.perf_counter() - timer, 3)
+
+    stats.update({
+        'books': len(catalog),
+        'candidates': len(pairs),
+        'matched': len(matched),
+        'groups': int(is_canonical.sum()),
+        'proposals': len(duplicates),
+    })
+    return stats
+
+
+# Без статистики по свежей временной таблице планировщик выбирает вложенные циклы
+_MERGE_MAP_SQL = """
+    CREATE TEMP TABLE book_merge_map ON COMMIT DROP AS
+    SELECT p.duplicate_id, p.canonical_id FROM book_merge_proposals p
+    WHERE p.score >= %s AND NOT EXISTS (
+        SELECT 1 FROM book_merge_proposals c WHERE c.duplicate_id = p.canonical_id
+    );
+    ALTER TABLE book_merge_map ADD PRIMARY KEY (duplicate_id);
+    ANALYZE book_merge_map;
+"""
+
+_MOVE_USER_BOOKS_SQL = """
+    UPDATE user_books ub SET book_id_id = m.canonical_id FROM book_merge_map m
+    WHERE ub.book_id_id = m.duplicate_id
+    RETURNING ub.user_book_id, ub.user_id
+"""
+
+_MOVE_GENRES_SQL = """
+    INSERT INTO books_genres (book_id, genre_id)
+    SELECT DISTINCT m.canonical_id, bg.genre_id FROM books_genres bg
+    JOIN book_merge_map m ON m.duplicate_id = bg.book_id
+    ON CONFLICT (book_id, genre_id) DO NOTHING
+"""
+
+# id тома переносится, только если у канонической книги своего нет (unique — сначала снять с дубликата)
+_MOVE_VOLUME_IDS_SQL = """
+    CREATE TEMP TABLE book_merge_volumes ON COMMIT DROP AS
+    SELECT DISTINCT ON (m.canonical_id) m.canonical_id, d.google_volume_id
+    FROM book_merge_map m
+    JOIN books d ON d.book_id = m.duplicate_id
+    JOIN books c ON c.book_id = m.canonical_id
+    WHERE d.google_volume_id IS NOT NULL AND c.google_volume_id IS NULL
+    ORDER BY m.canonical_id, d.book_id;
+    UPDATE books SET google_volume_id = NULL
+    WHERE google_volume_id IS NOT NULL AND book_id IN (SELECT duplicate_id FROM book_merge_map);
+    UPDATE books b SET google_volume_id = v.google_volume_id FROM book_merge_volumes v
+    WHERE b.book_id = v.canonical_id;
+"""
+
+_DELETE_DUPLICATES_SQL = """
+    DELETE FROM books_genres WHERE book_id IN (SELECT duplicate_id FROM book_merge_map);
+    DELETE FROM book_recommendations WHERE book_id IN (SELECT duplicate_id FROM book_merge_map);
+    DELETE FROM book_merge_proposals WHERE duplicate_id IN (SELECT duplicate_id FROM book_merge_map);
+    DELETE FROM books WHERE book_id IN (SELECT duplicate_id FROM book_merge_map);
+"""
+
+
+def merge_proposals(min_score=0.0):
+    """
+    Сливает дубликаты из book_merge_proposals со score >= min_score в одной
+    транзакции набором UPDATE/INSERT ... SELECT по временной таблице:
+    экземпляры и жанры переходят к канонической книге, дубликаты удаляются.
+    Предложение, чья каноническая книга сама предложена к слиянию,
+    пропускается до следующего find_duplicate_books.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(_MERGE_MAP_SQL, [min_score])
+        cursor.execute('SELECT duplicate_id, canonical_id FROM book_merge_map')
+        merged = cursor.fetchall()
+        if not merged:
+            cursor.execute('DROP TABLE book_merge_map')
+            return {'books': 0, 'user_books': 0, 'genre_links': 0}
+        cursor.execute(_MOVE_USER_BOOKS_SQL)
+        moved = cursor.fetchall()
+        cursor.execute(_MOVE_GENRES_SQL)
+        genre_links = cursor.rowcount
+        cursor.execute(_MOVE_VOLUME_IDS_SQL)
+        cursor.execute(_DELETE_DUPLICATES_SQL)
+        # Внутри внешней транзакции ON COMMIT DROP сработал бы слишком поздно
+        cursor.execute('DROP TABLE book_merge_map, book_merge_volumes')
+
+        duplicate_ids = [duplicate_id for duplicate_id, _ in merged]
+        canonical_ids = sorted({canonical_id for _, canonical_id in merged})
+        user_book_ids = [user_book_id for user_book_id, _ in moved]
+        user_ids = sorted({user_id for _, user_id in moved})
+        # Сигналы при сыром SQL не срабатывают: производные данные — как в books.signals
+        update_search_vectors(canonical_ids)
+        refresh_listings(book_ids=canonical_ids)
+        mark_books_stale(book_ids=canonical_ids)
+        mark_users_stale(user_ids)
+        record_autocomplete_changes(book_ids=duplicate_ids + canonical_ids)
+        invalidate_user_book_lookups(user_book_ids)
+        invalidate_on_commit(
+            TAG_BOOKS, TAG_USER_BOOKS, TAG_USER_BOOK_COUNTS,
+            *(book_tag(book_id) for book_id in duplicate_ids + canonical_ids),
+            *(user_book_tag(user_book_id) for user_book_id in user_book_ids),
+            *(user_tag(user_id) for user_id in user_ids),
+        )
+    return {'books': len(merged), 'user_books': len(moved), 'genre_links': genre_links}
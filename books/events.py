@@ -0,0 +1,149 @@
+# books/events.py
+import asyncio
+import json
+import logging
+import uuid
+import weakref
+
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'events:user:'
+
+
+def user_channel(user_id):
+    return f'{CHANNEL_PREFIX}{user_id}'
+
+
+def publish(user_ids, event_type, payload):
+    """
+    Публикует событие в Redis-каналы пользователей. Доставка — best effort:
+    пропущенное событие клиент восстановит по /api/exchange-requests/list/.
+    """
+    message = json.dumps({'id': uuid.uuid4().hex, 'type': event_type, 'data': payload})
+    try:
+        client = get_redis_connection('default')
+    except NotImplementedError:
+        return  # кэш не Redis (локальная разработка, тесты) — потоков событий нет
+    try:
+        for user_id in dict.fromkeys(user_ids):
+            client.publish(user_channel(user_id), message)
+    except Exception:
+        logger.warning('Failed to publish %s event', event_type, exc_info=True)
+
+
+def publish_on_commit(user_ids, event_type, payload):
+    transaction.on_commit(lambda: publish(user_ids, event_type, payload))
+
+
+class EventHub:
+    """
+    Одно Redis-подключение на процесс (PSUBSCRIBE на каналы всех
+    пользователей) и раздача сообщений по asyncio.Queue подписчиков этого
+    процесса. Тысяча открытых SSE-соединений — это тысяча очередей в памяти,
+    а не тысяча подключений к Redis.
+    """
+
+    def __init__(self, redis_url, queue_size=100):
+        self.redis_url = redis_url
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._listener = None
+        self.ready = asyncio.Event()  # PSUBSCRIBE выполнен, события доходят
+
+    @property
+    def subscriber_count(self):
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(str(user_id), set()).add(queue)
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        queues = self._subscribers.get(str(user_id))
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[str(user_id)]
+
+    def dispatch(self, channel, message):
+        user_id = channel[len(CHANNEL_PREFIX):]
+        for queue in list(self._subscribers.get(user_id, ())):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Клиент не успевает читать — теряет старое событие, а не тормозит остальных
+                queue.get_nowait()
+                queue.put_nowait(message)
+
+    async def _listen(self):
+        while True:
+            client = aioredis.from_url(self.redis_url)
+            pubsub = client.pubsub()
+            try:
+                await pubsub.psubscribe(f'{CHANNEL_PREFIX}*')
+                self.ready.set()
+                async for message in pubsub.listen():
+                    if message['type'] == 'pmessage':
+                        self.dispatch(message['channel'].decode(), message['data'].decode())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning('Event listener lost Redis connection, reconnecting', exc_info=True)
+                self.ready.clear()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+                await client.aclose()
+
+
+_hubs = weakref.WeakKeyDictionary()
+
+
+def get_hub():
+    # Хаб привязан к event loop: под uvicorn это один loop на воркер
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        hub = _hubs[loop] = EventHub(
+            getattr(settings, 'EVENTS_REDIS_URL', settings.CACHES['default']['LOCATION']),
+            queue_size=getattr(settings, 'EVENTS_QUEUE_SIZE', 100),
+        )
+    return hub
+
+
+def format_sse(message):
+    event = json.loads(message)
+    return (
+        f"id: {event['id']}\n"
+        f"event: {event['type']}\n"
+        f"data: {json.dumps(event['data'], separators=(',', ':'))}\n\n"
+    )
+
+
+async def event_stream(user_id, heartbeat=None):
+    """
+    Поток SSE для пользователя. Комментарий-heartbeat не даёт прокси закрыть
+    простаивающее соединение; отписка — в finally, когда клиент отключился.
+    """
+    heartbeat = heartbeat or getattr(settings, 'EVENTS_HEARTBEAT_SECONDS', 25)
+    hub = get_hub()
+    queue = hub.subscribe(user_id)
+    try:
+        yield 'retry: 5000\n: connected\n\n'
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            yield format_sse(message)
+    finally:
+        hub.unsubscribe(user_id, queue)
@@ -0,0 +1,139 @@
+# books/exchanges.py
+from django.db import IntegrityError, connection, transaction
+
+from books.autocomplete import record_changes as record_autocomplete_changes
+from books.events import publish_on_commit
+from books.listings import refresh_listings
+from books.lookups import invalidate_user_book_lookups
+from books.recommendations import mark_exchange_requested
+from books.models import ExchangeRequest
+from books.response_cache import (
+    TAG_USER_BOOK_COUNTS, TAG_USER_BOOKS, invalidate_on_commit, user_book_tag, user_tag
+)
+
+# Действие владельца -> (новый статус запроса, новый статус экземпляра)
+TRANSITIONS = {
+    'accept': ('accepted', 'exchanged'),
+    'reject': ('rejected', 'available'),
+}
+
+# Экземпляр резервируется и запрос создаётся одним выражением: из двух
+# одновременных запросов на одну книгу UPDATE пройдёт только у первого,
+# второй дождётся его блокировки строки и увидит status <> 'available'
+_CREATE_REQUEST_SQL = """
+    WITH reserved AS (
+        UPDATE user_books SET status = 'requested'
+        WHERE user_book_id = %(user_book_id)s AND status = 'available' AND user_id <> %(requester_id)s
+        RETURNING user_book_id, user_id
+    )
+    INSERT INTO exchange_requests (book_id, requester_id, owner_id, status, created_at)
+    SELECT user_book_id, %(requester_id)s, user_id, 'pending', now() FROM reserved
+    RETURNING exchange_request_id, owner_id
+"""
+
+_TRANSITION_SQL = """
+    WITH decided AS (
+        UPDATE exchange_requests SET status = %(request_status)s
+        WHERE exchange_request_id = %(exchange_request_id)s AND status = 'pending' {owner_condition}
+        RETURNING book_id, requester_id, owner_id
+    )
+    UPDATE user_books ub SET status = %(book_status)s
+    FROM decided
+    WHERE ub.user_book_id = decided.book_id
+    RETURNING decided.book_id, decided.requester_id, decided.owner_id
+"""
+
+
+class ExchangeError(Exception):
+    def __init__(self, message, status_code=409):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _changed(exchange_request_id, request_status, book_status, user_book_id, requester_id, owner_id):
+    # Сырые UPDATE не шлют сигналов — витрину и кэш ответов обновляем сами
+    refresh_listings(user_book_ids=[user_book_id])
+    tags = [TAG_USER_BOOK_COUNTS, user_book_tag(user_book_id), user_tag(requester_id), user_tag(owner_id)]
+    if book_status == 'available':
+        tags.append(TAG_USER_BOOKS)  # отклонённый запрос вернул экземпляр в поиск
+    invalidate_on_commit(*tags)
+    invalidate_user_book_lookups([user_book_id])
+    record_autocomplete_changes(user_book_ids=[user_book_id])
+    if request_status == 'pending':
+        mark_exchange_requested(user_book_id, requester_id)
+    # Обеим сторонам — в поток /api/exchange-requests/events/
+    publish_on_commit([requester_id, owner_id], f'exchange_request.{request_status}', {
+        'exchange_request_id': exchange_request_id,
+        'user_book_id': user_book_id,
+        'status': request_status,
+        'book_status': book_status,
+    })
+
+
+def _load(exchange_request_id):
+    return ExchangeRequest.objects.select_related(
+        'book__book_id', 'requester', 'owner'
+    ).prefetch_related('book__book_id__genres').get(pk=exchange_request_id)
+
+
+def create_request(user_book_id, requester):
+    """
+    available -> requested для экземпляра и новый pending-запрос — атомарно.
+    """
+    with transaction.atomic():
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(_CREATE_REQUEST_SQL, {'user_book_id': user_book_id, 'requester_id': requester.pk})
+                row = cursor.fetchone()
+        except IntegrityError:
+            # uniq_exchange_open_per_book: открытый запрос на этот экземпляр уже есть
+            raise ExchangeError("Book is not available for exchange")
+        if row is None:
+            _raise_create_error(user_book_id, requester)
+        exchange_request_id, owner_id = row
+        _changed(exchange_request_id, 'pending', 'requested', user_book_id, requester.pk, owner_id)
+    return _load(exchange_request_id)
+
+
+def _raise_create_error(user_book_id, requester):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT user_id FROM user_books WHERE user_book_id = %s', [user_book_id])
+        row = cursor.fetchone()
+    if row is None:
+        raise ExchangeError("Book not found", status_code=404)
+    if row[0] == requester.pk:
+        raise ExchangeError("You cannot request your own book", status_code=400)
+    raise ExchangeError("Book is not available for exchange")
+
+
+def decide_request(exchange_request_id, user, action):
+    """
+    pending -> accepted/rejected для запроса и requested -> exchanged/available
+    для экземпляра одним выражением. Решает владелец книги (или суперпользователь).
+    """
+    if action not in TRANSITIONS:
+        raise ExchangeError("Invalid action", status_code=400)
+    request_status, book_status = TRANSITIONS[action]
+    params = {
+        'exchange_request_id': exchange_request_id,
+        'request_status': request_status,
+        'book_status': book_status,
+        'owner_id': user.pk,
+    }
+    owner_condition = '' if user.is_superuser else 'AND owner_id = %(owner_id)s'
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(_TRANSITION_SQL.format(owner_condition=owner_condition), params)
+            row = cursor.fetchone()
+        if row is None:
+            _raise_decide_error(exchange_request_id, user)
+        _changed(exchange_request_id, request_status, book_status, *row)
+    return _load(exchange_request_id)
+
+
+def _raise_decide_error(exchange_request_id, user):
+    owner_id = ExchangeRequest.objects.filter(pk=exchange_request_id).values_list('owner_id', flat=True).first()
+    if owner_id is None or (not user.is_superuser and owner_id != user.pk):
+        raise ExchangeError("Request not found or access denied", status_code=404)
+    raise ExchangeError("Request is not in pending status")
@@ -0,0 +1,117 @@
+# books/genres.py
+import threading
+
+from django.core.cache import cache
+from django.db import transaction
+
+from books.models import Genre
+
+VERSION_CACHE_KEY = 'genre_dictionary:version'
+GENRE_NAME_MAX_LENGTH = Genre._meta.get_field('name').max_length
+
+
+def normalize_genre_names(genres):
+    """
+    'Fiction / Fantasy, Drama' или ['Fiction / Fantasy', 'Drama'] ->
+    ['Fiction', 'Fantasy', 'Drama']: части по '/', без пустых и повторов.
+    """
+    if isinstance(genres, str):
+        genres = genres.split(',')
+    normalized = []
+    seen = set()
+    for genre in genres or []:
+        if isinstance(genre, str):
+            for part in genre.split('/'):
+                part = part.strip()[:GENRE_NAME_MAX_LENGTH]
+                if part and part not in seen:
+                    seen.add(part)
+                    normalized.append(part)
+    return normalized
+
+
+class GenreDictionary:
+    """
+    Справочник жанров name -> id в памяти процесса. Таблица жанров маленькая
+    и почти не меняется, поэтому известные имена не ходят в БД вовсе,
+    неизвестные резолвятся одним SELECT, а отсутствующие — одним INSERT
+    ... ON CONFLICT. Найденные id попадают в словарь только после коммита:
+    жанр, вставленный в откаченной транзакции, иначе остался бы в нём с id,
+    которого нет в таблице. Удаление/переименование жанра увеличивает версию
+    в кэше (см. books/signals.py), и словари во всех воркерах сбрасываются.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._version = None
+
+    def _current_version(self):
+        version = cache.get(VERSION_CACHE_KEY)
+        if version is None:
+            cache.add(VERSION_CACHE_KEY, 1, timeout=None)
+            version = cache.get(VERSION_CACHE_KEY, 1)
+        return version
+
+    def _sync_version(self):
+        version = self._current_version()
+        if version != self._version:
+            self._ids.clear()
+            self._version = version
+
+    def resolve(self, names):
+        """
+        Возвращает {name: id} для всех имён, создавая недостающие жанры.
+        """
+        names = list(dict.fromkeys(name[:GENRE_NAME_MAX_LENGTH] for name in names if name))
+        if not names:
+            return {}
+
+        with self._lock:
+            self._sync_version()
+            version = self._version
+            resolved = {name: self._ids[name] for name in names if name in self._ids}
+
+        missing = [name for name in names if name not in resolved]
+        if missing:
+            found = dict(Genre.objects.filter(name__in=missing).values_list('name', 'id'))
+            to_create = [name for name in missing if name not in found]
+            if to_create:
+                # ON CONFLICT DO UPDATE возвращает id и для строк, вставленных конкурентно
+                created = Genre.objects.bulk_create(
+                    [Genre(name=name) for name in to_create],
+                    update_conflicts=True, unique_fields=['name'], update_fields=['name'],
+                )
+                found.update((genre.name, genre.id) for genre in created)
+            transaction.on_commit(lambda: self._remember(found, version))
+            resolved.update(found)
+        return resolved
+
+    def _remember(self, ids, version):
+        with self._lock:
+            # Словарь успели сбросить (переименование жанра) — эти id могли устареть
+            if self._version == version:
+                self._ids.update(ids)
+
+    def resolve_ids(self, names):
+        resolved = self.resolve(names)
+        names = (name[:GENRE_NAME_MAX_LENGTH] for name in names if name)
+        return list(dict.fromkeys(resolved[name] for name in names if name in resolved))
+
+    def set_book_genres(self, book, names):
+        book.genres.set(self.resolve_ids(names))
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._version = None
+
+
+def invalidate():
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.add(VERSION_CACHE_KEY, 1, timeout=None)
+    genre_dictionary.clear()
+
+
+genre_dictionary = GenreDictionary()
@@ -0,0 +1,173 @@
+# books/geo.py
+import math
+
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+GEOHASH_PRECISION = 9  # ~5 м — с запасом для любого радиуса поиска
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def parse_location(value):
+    """
+    'lat,lon' -> (lat, lon). ValueError, если строка не похожа на координаты.
+    """
+    if not value or not isinstance(value, str):
+        raise ValueError('Location must be a string')
+    try:
+        lat, lon = map(float, value.split(','))
+    except (ValueError, AttributeError):
+        raise ValueError("Location must be 'lat,lon'")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError('Coordinates out of range')
+    return lat, lon
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """
+    Размер ячейки geohash в градусах: (lat, lon).
+    """
+    total_bits = 5 * precision
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+
+def wrap_longitude(lon):
+    return (lon + 180.0) % 360.0 - 180.0
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    bbox круга: (min_lat, min_lon, max_lat, max_lon). Если круг пересекает
+    180-й меридиан, min_lon > max_lon; если накрывает полюс — берётся вся
+    долгота.
+    """
+    angular = radius_km / EARTH_RADIUS_KM
+    dlat = math.degrees(angular)
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), -180.0, min(max_lat, 90.0), 180.0
+    # Самая широкая по долготе точка круга — не на широте центра, а ближе к полюсу
+    dlon = math.degrees(math.asin(min(math.sin(angular) / math.cos(math.radians(lat)), 1.0)))
+    return min_lat, wrap_longitude(lon - dlon), max_lat, wrap_longitude(lon + dlon)
+
+
+def _longitude_span(min_lon, max_lon):
+    return max_lon - min_lon if min_lon <= max_lon else max_lon - min_lon + 360.0
+
+
+def box_center(min_lat, min_lon, max_lat, max_lon):
+    return (min_lat + max_lat) / 2, wrap_longitude(min_lon + _longitude_span(min_lon, max_lon) / 2)
+
+
+def box_size_km(min_lat, min_lon, max_lat, max_lon):
+    """
+    (высота, ширина) bbox в км; ширина — по самой длинной параллели внутри.
+    """
+    widest_lat = 0.0 if min_lat <= 0 <= max_lat else min(abs(min_lat), abs(max_lat))
+    return (
+        (max_lat - min_lat) * KM_PER_DEGREE_LAT,
+        _longitude_span(min_lon, max_lon) * KM_PER_DEGREE_LAT * math.cos(math.radians(widest_lat)),
+    )
+
+
+def covering_prefixes(min_lat, min_lon, max_lat, max_lon):
+    """
+    Подбирает самую мелкую точность, при которой bbox не больше одной ячейки,
+    и возвращает ячейки (не больше четырёх), в которые попадают его углы.
+    Пустой список — bbox слишком большой, фильтровать по geohash бессмысленно.
+    """
+    height, width = max_lat - min_lat, max_lon - min_lon
+    precision = 0
+    for candidate in range(1, GEOHASH_PRECISION + 1):
+        cell_lat, cell_lon = geohash_cell_size(candidate)
+        if cell_lat < height or cell_lon < width:
+            break
+        precision = candidate
+    if precision == 0:
+        return []
+    return sorted({
+        geohash_encode(corner_lat, corner_lon, precision)
+        for corner_lat in (min_lat, max_lat)
+        for corner_lon in (min_lon, max_lon)
+    })
+
+
+def apply_coordinates(user_book):
+    """
+    Заполняет latitude/longitude/geohash из строкового location.
+    """
+    try:
+        lat, lon = parse_location(user_book.location)
+    except ValueError:
+        user_book.latitude = user_book.longitude = None
+        user_book.geohash = ''
+        return False
+    user_book.latitude, user_book.longitude = lat, lon
+    user_book.geohash = geohash_encode(lat, lon)
+    return True
+
+
+def distance_km_expression(lat, lon):
+    """
+    Формула гаверсинусов в SQL, чтобы сортировать по расстоянию на стороне БД.
+    """
+    dlat = Radians(F('latitude') - Value(lat)) / 2
+    dlon = Radians(F('longitude') - Value(lon)) / 2
+    a = (
+        Power(Sin(dlat), 2)
+        + Cos(Radians(Value(lat))) * Cos(Radians(F('latitude'))) * Power(Sin(dlon), 2)
+    )
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Sqrt(Least(Value(1.0), a, output_field=FloatField())))
+
+
+def _box_filter(min_lat, min_lon, max_lat, max_lon):
+    prefix_filter = Q()
+    for prefix in covering_prefixes(min_lat, min_lon, max_lat, max_lon):
+        prefix_filter |= Q(geohash__startswith=prefix)
+    return prefix_filter & Q(latitude__range=(min_lat, max_lat), longitude__range=(min_lon, max_lon))
+
+
+def within_box(queryset, min_lat, min_lon, max_lat, max_lon):
+    """
+    min_lon > max_lon — bbox через 180-й меридиан: ищем в двух половинах.
+    """
+    if min_lon > max_lon:
+        return queryset.filter(
+            _box_filter(min_lat, min_lon, max_lat, 180.0) | _box_filter(min_lat, -180.0, max_lat, max_lon)
+        )
+    return queryset.filter(_box_filter(min_lat, min_lon, max_lat, max_lon))
+
+
+def nearby(queryset, lat, lon, radius_km):
+    """
+    Копии в радиусе radius_km, отсортированные по расстоянию (поле distance_km).
+    """
+    queryset = within_box(queryset, *bounding_box(lat, lon, radius_km))
+    return queryset.annotate(
+        distance_km=distance_km_expression(lat, lon)
+    ).filter(distance_km__lte=radius_km).order_by('distance_km', 'user_book_id')
@@ -0,0 +1,183 @@
+# books/google_books.py
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from books.metrics import track_upstream
+
+
+class GoogleBooksError(Exception):
+    def __init__(self, message, status_code=502):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Дедупликация одновременных вызовов внутри процесса: пока для ключа идёт
+    запрос, остальные потоки с тем же ключом ждут и получают его результат.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+
+class RedisSingleFlight(SingleFlight):
+    """
+    То же между gunicorn-воркерами: лидер берёт Redis-lock и кладёт результат
+    в кэш на короткое время, остальные воркеры дожидаются его. Если лидер
+    упал или не успел за wait_timeout, ведомый делает запрос сам.
+    """
+
+    def __init__(self, lock_timeout=10, wait_timeout=5, poll_interval=0.05, result_ttl=10):
+        super().__init__()
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.result_ttl = result_ttl
+
+    def do(self, key, fn):
+        return super().do(key, lambda: self._do_distributed(key, fn))
+
+    def _do_distributed(self, key, fn):
+        if not hasattr(cache, 'lock'):
+            return fn()
+
+        result_key = f'google_books:flight:{key}'
+        result = cache.get(result_key)
+        if result is not None:
+            return result
+
+        lock = cache.lock(f'google_books:flight-lock:{key}', timeout=self.lock_timeout)
+        if lock.acquire(blocking=False):
+            try:
+                result = fn()
+                cache.set(result_key, result, timeout=self.result_ttl)
+                return result
+            finally:
+                try:
+                    lock.release()
+                except Exception:
+                    pass  # lock истёк по timeout — не страшно
+
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            result = cache.get(result_key)
+            if result is not None:
+                return result
+            if not lock.locked():
+                break
+        return fn()
+
+
+class GoogleBooksClient:
+    def __init__(self, api_key, base_url='https://www.googleapis.com/books/v1', timeout=(3.05, 5),
+                 max_retries=2, pool_size=20, single_flight=None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.single_flight = single_flight or SingleFlight()
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=0.2,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False,
+            # Retry-After у 429 бывает в минутах — воркер не должен спать столько внутри запроса;
+            # пауза остаётся backoff_factor * 2^n, после max_retries ошибка уходит клиенту
+            respect_retry_after_header=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _get(self, operation, path, params=None):
+        params = dict(params or {}, key=self.api_key)
+        with track_upstream('google_books', operation):
+            try:
+                response = self.session.get(f'{self.base_url}{path}', params=params, timeout=self.timeout)
+            except requests.Timeout:
+                raise GoogleBooksError('Google Books API timed out', status_code=504)
+            except requests.RequestException as e:
+                raise GoogleBooksError(f'Google Books API is unavailable: {e}', status_code=503)
+            if response.status_code != 200:
+                raise GoogleBooksError('Google Books API error', status_code=response.status_code)
+            try:
+                return response.json()
+            except ValueError:
+                # 200 с HTML-страницей прокси или обрезанным телом
+                raise GoogleBooksError('Google Books API returned invalid JSON', status_code=502)
+
+    def search_volumes(self, query):
+        return self.single_flight.do(f'search:{query}', lambda: self._get('search', '/volumes', {'q': query}))
+
+    def get_volume(self, volume_id):
+        return self.single_flight.do(f'volume:{volume_id}', lambda: self._get('volume', f'/volumes/{volume_id}'))
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                flight = (
+                    RedisSingleFlight()
+                    if getattr(settings, 'GOOGLE_BOOKS_SINGLE_FLIGHT', 'local') == 'redis'
+                    else SingleFlight()
+                )
+                _client = GoogleBooksClient(
+                    api_key=settings.GOOGLE_API_KEY,
+                    base_url=getattr(settings, 'GOOGLE_BOOKS_API_URL', 'https://www.googleapis.com/books/v1'),
+                    timeout=(
+                        getattr(settings, 'GOOGLE_BOOKS_CONNECT_TIMEOUT', 3.05),
+                        getattr(settings, 'GOOGLE_BOOKS_READ_TIMEOUT', 5),
+                    ),
+                    max_retries=getattr(settings, 'GOOGLE_BOOKS_MAX_RETRIES', 2),
+                    pool_size=getattr(settings, 'GOOGLE_BOOKS_POOL_SIZE', 20),
+                    single_flight=flight,
+                )
+    return _client
@@ -0,0 +1,42 @@
+# books/google_volumes.py
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from books.google_books import GoogleBooksError, get_client as get_google_books_client
+from books.models import GoogleVolume
+
+logger = logging.getLogger(__name__)
+
+
+def get_volume(volume_id, client=None):
+    """
+    Том Google Books по id. Сохранённый в google_volumes ответ отдаётся без
+    сети, пока он моложе GOOGLE_VOLUME_REFRESH_DAYS; более старый
+    перезапрашивается, а если Google недоступен — отдаётся как есть.
+    GoogleBooksError — наружу, только если тома нет и локально.
+    """
+    cached = GoogleVolume.objects.filter(volume_id=volume_id).values_list('data', 'fetched_at').first()
+    if cached is not None:
+        data, fetched_at = cached
+        if fetched_at > timezone.now() - timedelta(days=settings.GOOGLE_VOLUME_REFRESH_DAYS):
+            return data
+    try:
+        return fetch_volume(volume_id, client)
+    except GoogleBooksError as e:
+        if cached is None:
+            raise
+        logger.warning('Serving stale Google volume %s: %s', volume_id, e)
+        return cached[0]
+
+
+def fetch_volume(volume_id, client=None):
+    volume = (client or get_google_books_client()).get_volume(volume_id)
+    # Один INSERT ... ON CONFLICT UPDATE: параллельные запросы за тем же томом не конфликтуют
+    GoogleVolume.objects.bulk_create(
+        [GoogleVolume(volume_id=volume_id, data=volume, fetched_at=timezone.now())],
+        update_conflicts=True, unique_fields=['volume_id'], update_fields=['data', 'fetched_at'],
+    )
+    return volume
@@ -0,0 +1,71 @@
+# books/images.py
+import os
+
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Имя размера -> максимальная длина длинной стороны в пикселях
+PHOTO_SIZES = (
+    ('full', 1600),
+    ('medium', 640),
+    ('thumb', 160),
+)
+OUTPUT_FORMAT = 'WEBP'
+OUTPUT_EXTENSION = '.webp'
+
+
+class ImageProcessingError(Exception):
+    pass
+
+
+def _open(path):
+    image = Image.open(path)
+    width, height = image.size
+    if width * height > settings.PHOTO_MAX_PIXELS:
+        raise ImageProcessingError(f'Image is too large: {width}x{height}')
+    return image
+
+
+def _normalize(image, max_side):
+    # JPEG декодируется сразу в уменьшенном масштабе (1/2, 1/4, 1/8) — не
+    # разворачиваем 12-мегапиксельный оригинал ради картинки в 1600px
+    image.draft('RGB', (max_side, max_side))
+    # Ориентацию из EXIF применяем к пикселям: сами EXIF в результат не попадут
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    return image
+
+
+def render_variants(path, output_dir, quality=None):
+    """
+    Перекодирует изображение из path в набор размеров PHOTO_SIZES (WebP, без
+    метаданных). Оригинал читается с диска, каждый следующий размер
+    уменьшается из предыдущего. Возвращает {size: {path, width, height, bytes}}.
+    """
+    quality = quality or settings.PHOTO_WEBP_QUALITY
+    # Битый файл может упасть не при открытии, а при декодировании (обрезанный
+    # JPEG — в draft/thumbnail), «бомба» — уже в Image.open
+    try:
+        return _render(path, output_dir, quality)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise ImageProcessingError(f'Not a valid image: {e}')
+
+
+def _render(path, output_dir, quality):
+    base_name = os.path.splitext(os.path.basename(path))[0]
+    variants = {}
+    with _open(path) as original:
+        image = _normalize(original, PHOTO_SIZES[0][1])
+        for size, max_side in PHOTO_SIZES:
+            image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS, reducing_gap=3.0)
+            variant_path = os.path.join(output_dir, f'{base_name}_{size}{OUTPUT_EXTENSION}')
+            # exif/icc_profile не передаём — метаданные оригинала отбрасываются
+            image.save(variant_path, OUTPUT_FORMAT, quality=quality, method=4)
+            variants[size] = {
+                'path': variant_path,
+                'width': image.width,
+                'height': image.height,
+                'bytes': os.path.getsize(variant_path),
+            }
+    return variants
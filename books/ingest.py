@@ -0,0 +1,442 @@
+# books/ingest.py
+import csv
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import chain, islice
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from books import google_volumes
+from books.autocomplete import record_changes as record_autocomplete_changes
+from books.google_books import GoogleBooksError
+from books.genres import genre_dictionary, normalize_genre_names
+from books.models import Book, CatalogIngestJob
+from books.search import update_search_vectors
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VOLUME_IDS = 'ids'
+FORMAT_JSON = 'json'
+FORMAT_CSV = 'csv'
+FORMATS = (FORMAT_VOLUME_IDS, FORMAT_JSON, FORMAT_CSV)
+
+# Битый или отсутствующий файл не станет лучше от повтора — задача падает сразу
+PERMANENT_ERRORS = (ValueError, csv.Error, FileNotFoundError)
+
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def detect_format(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in ('.json', '.jsonl', '.ndjson'):
+        return FORMAT_JSON
+    if extension == '.csv':
+        return FORMAT_CSV
+    return FORMAT_VOLUME_IDS
+
+
+def iter_records(stream, fmt):
+    """
+    Лениво читает текстовый поток. Для ids — по одному volume id на строку,
+    для json — JSON Lines или один массив объектов, для csv — заголовок
+    name,author,overview,genres.
+    """
+    if fmt == FORMAT_VOLUME_IDS:
+        for line in stream:
+            volume_id = line.strip()
+            if volume_id and not volume_id.startswith('#'):
+                yield {'volume_id': volume_id}
+    elif fmt == FORMAT_CSV:
+        yield from csv.DictReader(stream)
+    elif fmt == FORMAT_JSON:
+        first = stream.read(1)
+        while first and first.isspace():
+            first = stream.read(1)
+        if not first:
+            return
+        if first == '[':
+            yield from _iter_json_array(stream)
+            return
+        for line in chain([first + stream.readline()], stream):
+            line = line.strip()
+            if line:
+                yield _json_record(json.loads(line))
+    else:
+        raise ValueError(f'Unknown format: {fmt}')
+
+
+def _iter_json_array(stream):
+    """
+    Читает элементы JSON-массива (открывающая скобка уже прочитана) через
+    raw_decode по буферу из чанков. В памяти — не больше чанка и одной записи.
+    """
+    decoder = json.JSONDecoder()
+    chunk_size = JSON_CHUNK_SIZE
+    buffer, pos, eof = '', 0, False
+    expect_value, started = True, False
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ValueError('Unterminated JSON array')
+            buffer, pos = stream.read(chunk_size), 0
+            eof = not buffer
+            continue
+        char = buffer[pos]
+        if char == ']' and (not expect_value or not started):
+            _ensure_json_tail(buffer[pos + 1:], stream, chunk_size)
+            return
+        if not expect_value:
+            if char != ',':
+                raise ValueError(f'Expected "," or "]" in JSON array, got {char!r}')
+            pos, expect_value = pos + 1, True
+            continue
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # Запись обрезана границей чанка — дочитываем, пока есть что
+            if eof:
+                raise
+            chunk = stream.read(chunk_size)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+            continue
+        yield _json_record(value)
+        pos, expect_value, started = end, False, True
+
+
+def _ensure_json_tail(rest, stream, chunk_size):
+    while True:
+        if rest and not rest.isspace():
+            raise ValueError('Extra data after JSON array')
+        rest = stream.read(chunk_size)
+        if not rest:
+            return
+
+
+def _json_record(value):
+    if not isinstance(value, dict):
+        raise ValueError(f'JSON records must be objects, got {type(value).__name__}')
+    return value
+
+
+def is_transient_google_error(error):
+    return error.status_code == 429 or error.status_code >= 500
+
+
+def record_from_volume(volume):
+    info = volume.get('volumeInfo', {})
+    return {
+        'name': info.get('title', ''),
+        'author': ', '.join(info.get('authors', ['Unknown'])),
+        'overview': info.get('description', ''),
+        'genres': info.get('categories', ['Unknown']),
+    }
+
+
+class CatalogIngestor:
+    """
+    Потоковая загрузка каталога: записи читаются пачками по batch_size,
+    volume id докачиваются из Google пулом из workers потоков, запись в БД —
+    bulk_create для Book, Genre и таблицы связей. После каждой пачки
+    сохраняется checkpoint, так что прерванную загрузку можно продолжить.
+    """
+
+    def __init__(self, batch_size=1000, workers=8, checkpoint_path=None, client=None, progress=None):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.checkpoint_path = checkpoint_path
+        self.client = client
+        self.progress = progress or (lambda stats: None)
+        self.stats = {
+            'state': 'running', 'processed': 0, 'books_created': 0, 'books_linked': 0,
+            'skipped': 0, 'failed': 0, 'elapsed_seconds': 0.0, 'records_per_second': 0.0,
+        }
+
+    def load_checkpoint(self):
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding='utf-8') as f:
+                self.stats.update(json.load(f))
+        return self.stats['processed']
+
+    def save_checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        tmp_path = f'{self.checkpoint_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.stats, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def run(self, records):
+        records = iter(records)
+        skip = self.load_checkpoint()
+        self.stats['state'] = 'running'
+        if skip:
+            logger.info('Resuming catalog ingestion after %s records', skip)
+            for _ in islice(records, skip):
+                pass
+
+        started = time.monotonic() - self.stats['elapsed_seconds']
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                batch = list(islice(records, self.batch_size))
+                if not batch:
+                    break
+                resolved = self._resolve(batch, executor)
+                self._write(resolved)
+                self.stats['processed'] += len(batch)
+                self.stats['elapsed_seconds'] = round(time.monotonic() - started, 3)
+                self.stats['records_per_second'] = round(
+                    self.stats['processed'] / max(self.stats['elapsed_seconds'], 1e-9), 1
+                )
+                self.save_checkpoint()
+                self.progress(dict(self.stats))
+        self.stats['state'] = 'done'
+        self.save_checkpoint()
+        return self.stats
+
+    def _fetch(self, volume_id):
+        try:
+            # Уже сохранённые тома — из google_volumes, без Google
+            record = record_from_volume(google_volumes.get_volume(volume_id, self.client))
+        except GoogleBooksError as e:
+            if is_transient_google_error(e):
+                # Google лёг или ограничил нас: пачку не пишем, задача повторится с checkpoint
+                raise
+            logger.warning('Failed to fetch volume %s: %s', volume_id, e)
+            return None
+        finally:
+            connection.close()  # поток пула, соединение с БД у него своё
+        return dict(record, volume_id=volume_id)
+
+    def _resolve(self, batch, executor):
+        volume_ids = [record['volume_id'] for record in batch if record.get('volume_id')]
+        fetched = iter(executor.map(self._fetch, volume_ids))
+        resolved = []
+        for record in batch:
+            if record.get('volume_id'):
+                record = next(fetched)
+            if not record or not record.get('name'):
+                self.stats['failed'] += 1
+                continue
+            resolved.append(record)
+        return resolved
+
+    @transaction.atomic
+    def _write(self, records):
+        books_by_name = {}
+        for record in records:
+            # Как get_or_create в BookCreateView: первая запись с этим названием побеждает
+            books_by_name.setdefault(record['name'][:255], record)
+        if not books_by_name:
+            return
+
+        genre_names_by_book = {
+            name: normalize_genre_names(record.get('genres')) or ['Unknown']
+            for name, record in books_by_name.items()
+        }
+        genre_ids = genre_dictionary.resolve(
+            {genre for names in genre_names_by_book.values() for genre in names}
+        )
+
+        books_before = Book.objects.filter(name__in=books_by_name).count()
+        Book.objects.bulk_create([
+            Book(
+                name=name,
+                author=(record.get('author') or 'Unknown')[:255],
+                overview=record.get('overview') or '',
+                google_volume_id=record.get('volume_id'),
+            )
+            for name, record in books_by_name.items()
+        ], ignore_conflicts=True, batch_size=self.batch_size)
+        book_ids = dict(Book.objects.filter(name__in=books_by_name).values_list('name', 'book_id'))
+        self.stats['books_created'] += len(book_ids) - books_before
+
+        # Не вставленные и не найденные по названию — том уже привязан к книге с другим названием
+        skipped = [name for name in books_by_name if name not in book_ids]
+        if skipped:
+            logger.warning('Skipped %s catalog records whose volume id belongs to another book: %s',
+                           len(skipped), ', '.join(skipped[:10]))
+            self.stats['skipped'] += len(skipped)
+        self._link_volumes(books_by_name, book_ids)
+
+        Through = Book.genres.through
+        links = [
+            Through(book_id=book_ids[name], genre_id=genre_ids[genre])
+            for name, genres in genre_names_by_book.items()
+            for genre in genres
+            if name in book_ids and genre in genre_ids
+        ]
+        Through.objects.bulk_create(links, ignore_conflicts=True, batch_size=self.batch_size)
+
+        # bulk_create не шлёт сигналы — поисковые векторы и автокомплит обновляем сами
+        update_search_vectors(book_ids.values())
+        record_autocomplete_changes(book_ids=book_ids.values())
+
+    def _link_volumes(self, books_by_name, book_ids):
+        # Как BookCreateView: книге с таким названием, созданной раньше тома, записываем его id
+        volume_ids = {
+            name: record['volume_id'] for name, record in books_by_name.items()
+            if record.get('volume_id') and name in book_ids
+        }
+        if not volume_ids:
+            return
+        taken = set(
+            Book.objects.filter(google_volume_id__in=volume_ids.values()).values_list('google_volume_id', flat=True)
+        )
+        unlinked = Book.objects.filter(name__in=volume_ids, google_volume_id__isnull=True).values_list('name', flat=True)
+        books = [
+            Book(book_id=book_ids[name], google_volume_id=volume_ids[name])
+            for name in unlinked if volume_ids[name] not in taken
+        ]
+        Book.objects.bulk_update(books, ['google_volume_id'], batch_size=self.batch_size)
+        self.stats['books_linked'] += len(books)
+
+
+def job_paths(job_id, spool_dir):
+    return (
+        os.path.join(spool_dir, f'{job_id}.input'),
+        os.path.join(spool_dir, f'{job_id}.checkpoint.json'),
+    )
+
+
+def enqueue_ingest_job(upload, fmt):
+    """
+    Сохраняет загруженный файл в CATALOG_INGEST_DIR по частям и ставит
+    задачу в catalog_ingest_jobs; загружает её ingest_worker.
+    """
+    spool_dir = settings.CATALOG_INGEST_DIR
+    os.makedirs(spool_dir, exist_ok=True)
+    job_id = uuid.uuid4()
+    input_path, _ = job_paths(job_id, spool_dir)
+    with open(input_path, 'wb') as f:
+        for chunk in upload.chunks():
+            f.write(chunk)
+    try:
+        return CatalogIngestJob.objects.create(job_id=job_id, format=fmt, input_path=input_path)
+    except Exception:
+        os.remove(input_path)
+        raise
+
+
+def claim_ingest_job():
+    """
+    Забирает одну задачу (SKIP LOCKED — воркеров может быть несколько).
+    Воркер продлевает аренду после каждой пачки; «running»-задача без
+    продления CATALOG_INGEST_LEASE_SECONDS (воркер умер) забирается заново и
+    продолжает с checkpoint, пока попыток меньше CATALOG_INGEST_MAX_ATTEMPTS.
+    Задача, отложенная после временной ошибки, ждёт своего available_at.
+    """
+    now = timezone.now()
+    lease_expired = now - timedelta(seconds=settings.CATALOG_INGEST_LEASE_SECONDS)
+    max_attempts = settings.CATALOG_INGEST_MAX_ATTEMPTS
+    with transaction.atomic():
+        for job in CatalogIngestJob.objects.select_for_update(skip_locked=True).filter(
+            status='running', locked_at__lt=lease_expired, attempts__gte=max_attempts,
+        ):
+            _fail(job, f'Lease expired after {job.attempts} attempts')
+
+        job = (
+            CatalogIngestJob.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status='queued', available_at__lte=now)
+                | Q(status='running', locked_at__lt=lease_expired, attempts__lt=max_attempts)
+            )
+            .order_by('available_at')
+            .first()
+        )
+        if job is None:
+            return None
+        CatalogIngestJob.objects.filter(pk=job.pk).update(
+            status='running', locked_at=now, attempts=F('attempts') + 1, updated_at=now,
+        )
+    job.status, job.locked_at, job.attempts = 'running', now, job.attempts + 1
+    return job
+
+
+def process_ingest_job(job, batch_size=1000, workers=8, client=None):
+    _, checkpoint_path = job_paths(job.job_id, os.path.dirname(job.input_path))
+
+    def progress(stats):
+        # Каждая пачка — это и прогресс для GET /api/books/ingest/<job_id>/, и продление аренды
+        job.stats, job.locked_at = stats, timezone.now()
+        CatalogIngestJob.objects.filter(pk=job.pk, status='running').update(
+            stats=stats, locked_at=job.locked_at, updated_at=job.locked_at,
+        )
+
+    ingestor = CatalogIngestor(
+        batch_size=batch_size, workers=workers, checkpoint_path=checkpoint_path, client=client, progress=progress,
+    )
+    try:
+        with open(job.input_path, encoding='utf-8', newline='') as stream:
+            stats = ingestor.run(iter_records(stream, job.format))
+    except PERMANENT_ERRORS as e:
+        job.stats = ingestor.stats
+        _fail(job, e)
+        return False
+    except Exception as e:
+        # БД, Google, сеть: записанные пачки уже в checkpoint, повтор продолжит с них
+        logger.exception('Catalog ingestion job %s failed', job.pk)
+        job.stats = ingestor.stats
+        _retry(job, e)
+        return False
+
+    job.status, job.stats, job.last_error = 'done', stats, ''
+    job.save(update_fields=['status', 'stats', 'last_error', 'updated_at'])
+    for path in (job.input_path, checkpoint_path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return True
+
+
+def retry_delay(attempts):
+    return min(settings.CATALOG_INGEST_RETRY_BASE_SECONDS * 2 ** (attempts - 1), 3600)
+
+
+def _retry(job, error):
+    if job.attempts >= settings.CATALOG_INGEST_MAX_ATTEMPTS:
+        _fail(job, error)
+        return
+    delay = retry_delay(job.attempts)
+    logger.warning('Catalog ingestion job %s failed (attempt %s), retrying in %ss: %s',
+                   job.pk, job.attempts, delay, error)
+    job.status, job.last_error = 'queued', str(error)
+    job.stats = dict(job.stats, state='queued')
+    job.available_at = timezone.now() + timedelta(seconds=delay)
+    job.save(update_fields=['status', 'stats', 'last_error', 'available_at', 'updated_at'])
+
+
+def _fail(job, error):
+    # Checkpoint остаётся для разбора
+    logger.error('Catalog ingestion job %s failed permanently: %s', job.pk, error)
+    job.status, job.last_error = 'failed', str(error)
+    job.stats = dict(job.stats, state='failed')
+    job.save(update_fields=['status', 'stats', 'last_error', 'updated_at'])
+
+
+def run_ingest_worker(batch_size=1000, workers=8, poll_interval=5.0, once=False, stop=None):
+    """
+    Цикл воркера: забрать задачу, загрузить файл, повторить. once=True —
+    обработать то, что есть сейчас, и выйти. Возвращает число задач.
+    """
+    processed = 0
+    while not (stop and stop()):
+        job = claim_ingest_job()
+        if job is None:
+            if once:
+                break
+            time.sleep(poll_interval)
+            continue
+        process_ingest_job(job, batch_size=batch_size, workers=workers)
+        processed += 1
+    return processed
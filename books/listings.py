@@ -0,0 +1,121 @@
+# books/listings.py
+from django.db import connection
+
+# Одна строка на UserBook; жанры — в порядке добавления к книге
+_SELECT_LISTINGS_SQL = """
+    SELECT ub.user_book_id, ub.user_id, ub.book_id_id AS book_id, b.name AS book_name,
+           b.author AS book_author,
+           coalesce(array_agg(g.name ORDER BY bg.id) FILTER (WHERE g.name IS NOT NULL), '{{}}') AS genres,
+           ub.condition, ub.location, ub.status
+    FROM user_books ub
+    JOIN books b ON b.book_id = ub.book_id_id
+    LEFT JOIN books_genres bg ON bg.book_id = b.book_id
+    LEFT JOIN books_genre g ON g.id = bg.genre_id
+    {where}
+    GROUP BY ub.user_book_id, b.book_id
+"""
+
+_UPSERT_LISTINGS_SQL = """
+    INSERT INTO user_book_listings
+        (user_book_id, user_id, book_id, book_name, book_author, genres, condition, location, status)
+    {select}
+    ON CONFLICT (user_book_id) DO UPDATE SET
+        user_id = EXCLUDED.user_id,
+        book_id = EXCLUDED.book_id,
+        book_name = EXCLUDED.book_name,
+        book_author = EXCLUDED.book_author,
+        genres = EXCLUDED.genres,
+        condition = EXCLUDED.condition,
+        location = EXCLUDED.location,
+        status = EXCLUDED.status
+"""
+
+_CHECK_LISTINGS_SQL = """
+    SELECT coalesce(expected.user_book_id, l.user_book_id) AS user_book_id,
+           CASE WHEN l.user_book_id IS NULL THEN 'missing'
+                WHEN expected.user_book_id IS NULL THEN 'orphan'
+                ELSE 'stale' END AS problem
+    FROM ({select}) AS expected
+    FULL OUTER JOIN (
+        SELECT * FROM user_book_listings {listing_where}
+    ) AS l ON l.user_book_id = expected.user_book_id
+    WHERE l.user_book_id IS NULL
+       OR expected.user_book_id IS NULL
+       OR (l.user_id, l.book_id, l.book_name, l.book_author, l.genres, l.condition, l.location, l.status)
+          IS DISTINCT FROM
+          (expected.user_id, expected.book_id, expected.book_name, expected.book_author,
+           expected.genres::varchar(100)[], expected.condition, expected.location, expected.status)
+    ORDER BY 1
+"""
+
+
+def _select_sql(where=''):
+    return _SELECT_LISTINGS_SQL.format(where=where)
+
+
+def refresh_listings(user_book_ids=None, book_ids=None, id_range=None):
+    """
+    Пересобирает строки витрины одним INSERT ... SELECT ... ON CONFLICT.
+    Без аргументов — для всех UserBook.
+    """
+    conditions, params = [], {}
+    if user_book_ids is not None:
+        params['user_book_ids'] = list(user_book_ids)
+        if not params['user_book_ids']:
+            return 0
+        conditions.append('ub.user_book_id = ANY(%(user_book_ids)s)')
+    if book_ids is not None:
+        params['book_ids'] = list(book_ids)
+        if not params['book_ids']:
+            return 0
+        conditions.append('ub.book_id_id = ANY(%(book_ids)s)')
+    if id_range is not None:
+        params['id_from'], params['id_to'] = id_range
+        conditions.append('ub.user_book_id >= %(id_from)s AND ub.user_book_id < %(id_to)s')
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    with connection.cursor() as cursor:
+        cursor.execute(_UPSERT_LISTINGS_SQL.format(select=_select_sql(where)), params)
+        return cursor.rowcount
+
+
+def delete_orphan_listings(id_range=None):
+    sql = """
+        DELETE FROM user_book_listings l
+        WHERE NOT EXISTS (SELECT 1 FROM user_books ub WHERE ub.user_book_id = l.user_book_id)
+    """
+    params = {}
+    if id_range is not None:
+        params['id_from'], params['id_to'] = id_range
+        sql += ' AND l.user_book_id >= %(id_from)s AND l.user_book_id < %(id_to)s'
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def find_inconsistencies(id_range=None):
+    """
+    Сравнивает витрину с исходными таблицами: [(user_book_id, 'missing'|'orphan'|'stale')].
+    """
+    params, where, listing_where = {}, '', ''
+    if id_range is not None:
+        params['id_from'], params['id_to'] = id_range
+        where = 'WHERE ub.user_book_id >= %(id_from)s AND ub.user_book_id < %(id_to)s'
+        listing_where = 'WHERE user_book_id >= %(id_from)s AND user_book_id < %(id_to)s'
+    sql = _CHECK_LISTINGS_SQL.format(select=_select_sql(where), listing_where=listing_where)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def id_ranges(batch_size):
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT least((SELECT min(user_book_id) FROM user_books), (SELECT min(user_book_id) FROM user_book_listings)),
+                   greatest((SELECT max(user_book_id) FROM user_books), (SELECT max(user_book_id) FROM user_book_listings))
+        """)
+        low, high = cursor.fetchone()
+    if low is None:
+        return
+    for start in range(low, high + 1, batch_size):
+        yield start, start + batch_size
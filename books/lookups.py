@@ -0,0 +1,119 @@
+# books/lookups.py
+import struct
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from books.metrics import record_cache
+from books.models import UserBook
+
+CACHE_PREFIX = 'user_book_lookup:'
+LOOKUP_FIELDS = ('owner', 'status', 'title')
+STATUS_CODES = {status: code for code, (status, _) in enumerate(UserBook.STATUS_CHOICES)}
+STATUSES = {code: status for status, code in STATUS_CODES.items()}
+_MISSING = ()  # отрицательный кэш: такого UserBook нет
+
+
+def cache_key(user_book_id):
+    return f'{CACHE_PREFIX}{user_book_id}'
+
+
+def lookup_user_books(user_book_ids):
+    """
+    {user_book_id: (owner_id, status, title)} для существующих id. Сначала
+    один MGET по Redis, промахи — одним SELECT по values_list, без моделей.
+    """
+    user_book_ids = list(dict.fromkeys(user_book_ids))
+    cached = cache.get_many([cache_key(user_book_id) for user_book_id in user_book_ids])
+    found = {}
+    missing = []
+    for user_book_id in user_book_ids:
+        value = cached.get(cache_key(user_book_id))
+        if value is None:
+            missing.append(user_book_id)
+        elif value != _MISSING:
+            found[user_book_id] = tuple(value)
+    record_cache('user_book_lookup', hits=len(user_book_ids) - len(missing), misses=len(missing))
+
+    if missing:
+        rows = UserBook.objects.filter(user_book_id__in=missing).values_list(
+            'user_book_id', 'user_id', 'status', 'book_id__name'
+        )
+        fetched = {row[0]: row[1:] for row in rows}
+        found.update(fetched)
+        cache.set_many(
+            {cache_key(user_book_id): fetched.get(user_book_id, _MISSING) for user_book_id in missing},
+            timeout=settings.USER_BOOK_LOOKUP_TTL,
+        )
+    return found
+
+
+def invalidate_user_book_lookups(user_book_ids):
+    # После коммита: иначе параллельный lookup закэширует старую строку заново
+    keys = [cache_key(user_book_id) for user_book_id in user_book_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def pack_lookups(found, fields):
+    """
+    Компактный бинарный ответ (little-endian), запись на каждый найденный id:
+    uint32 user_book_id, затем по порядку fields: owner — uint64,
+    status — uint8 (индекс в UserBook.STATUS_CHOICES), title — uint16 длина
+    + UTF-8.
+    """
+    chunks = []
+    for user_book_id, (owner_id, status, title) in found.items():
+        chunks.append(struct.pack('<I', user_book_id))
+        for field in fields:
+            if field == 'owner':
+                chunks.append(struct.pack('<Q', owner_id))
+            elif field == 'status':
+                chunks.append(struct.pack('<B', STATUS_CODES[status]))
+            else:
+                encoded = title.encode('utf-8')
+                chunks.append(struct.pack('<H', len(encoded)))
+                chunks.append(encoded)
+    return b''.join(chunks)
+
+
+def unpack_lookups(data, fields):
+    """
+    Обратное к pack_lookups — для клиентов на Python и тестов.
+    """
+    result, offset = {}, 0
+    while offset < len(data):
+        (user_book_id,), offset = struct.unpack_from('<I', data, offset), offset + 4
+        values = {}
+        for field in fields:
+            if field == 'owner':
+                (values['owner'],), offset = struct.unpack_from('<Q', data, offset), offset + 8
+            elif field == 'status':
+                (code,), offset = struct.unpack_from('<B', data, offset), offset + 1
+                values['status'] = STATUSES[code]
+            else:
+                (length,), offset = struct.unpack_from('<H', data, offset), offset + 2
+                values['title'] = data[offset:offset + length].decode('utf-8')
+                offset += length
+        result[user_book_id] = values
+    return result
+
+
+class UserBookLookupRenderer(BaseRenderer):
+    """
+    ?format=binary или Accept: application/x-user-book-lookup — ответ
+    в формате pack_lookups. Ошибки отдаются JSON'ом.
+    """
+    media_type = 'application/x-user-book-lookup'
+    format = 'binary'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        response = renderer_context.get('response')
+        if response is not None and response.status_code >= 400:
+            return JSONRenderer().render(data)
+        return pack_lookups(data, renderer_context['view'].lookup_fields)
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from books.geo import apply_coordinates
+from books.models import UserBook
+
+
+class Command(BaseCommand):
+    help = 'Заполняет latitude/longitude/geohash у UserBook из строкового location пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--all', action='store_true',
+                            help='Пересчитать и уже заполненные записи')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = UserBook.objects.exclude(location='')
+        if not options['all']:
+            queryset = queryset.filter(latitude__isnull=True)
+
+        last_id, updated, invalid = 0, 0, 0
+        while True:
+            # Keyset по первичному ключу: записи с нераспознанным location не зацикливают обход
+            batch = list(
+                queryset.filter(user_book_id__gt=last_id)
+                .order_by('user_book_id')
+                .only('user_book_id', 'location')[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].user_book_id
+
+            parsed = [user_book for user_book in batch if apply_coordinates(user_book)]
+            invalid += len(batch) - len(parsed)
+            with transaction.atomic():
+                UserBook.objects.bulk_update(parsed, ['latitude', 'longitude', 'geohash'])
+            updated += len(parsed)
+            self.stdout.write(f'Обработано до user_book_id={last_id}: обновлено {updated}, без координат {invalid}')
+
+        self.stdout.write(self.style.SUCCESS(f'Готово: обновлено {updated}, без координат {invalid}'))
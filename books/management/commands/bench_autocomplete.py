@@ -0,0 +1,80 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from books.autocomplete import PrefixIndex, load_books
+from books.benchmarks import summarize
+from books.datasets import FIRST_NAMES, LAST_NAMES, WORDS
+
+
+class Command(BaseCommand):
+    help = ('Замеряет локальный автокомплит (books.autocomplete.PrefixIndex): память на индекс, '
+            'время сборки, латентность поиска по префиксам и точечных обновлений')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100000,1000000', help='Число названий через запятую')
+        parser.add_argument('--from-db', action='store_true', help='Один прогон на текущем каталоге из БД')
+        parser.add_argument('--lookups', type=int, default=20000)
+        parser.add_argument('--updates', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        self.stdout.write(
+            'titles\tbuild_s\tmemory_mb\tbytes_per_title\tlookup_p50_ms\tlookup_p95_ms\t'
+            'lookup_p99_ms\tupdate_p99_ms\tadd_p99_ms'
+        )
+        if options['from_db']:
+            self._run(lambda: load_books(), rng, options)
+            return
+        for size in sorted(int(size) for size in options['sizes'].split(',')):
+            self._run(lambda: self._synthetic_rows(rng, size), rng, options)
+
+    def _synthetic_rows(self, rng, size):
+        return [
+            (i + 1, f"{' '.join(rng.sample(WORDS, rng.randint(1, 4))).title()} {i}",
+             f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}', rng.choice((0, 0, 1, 1, 2, 3, 5)))
+            for i in range(size)
+        ]
+
+    def _run(self, make_rows, rng, options):
+        rows = make_rows()
+        started = time.perf_counter()
+        index = PrefixIndex.from_rows(rows)
+        build_s = time.perf_counter() - started
+        memory = index.memory_bytes()
+
+        # Префиксы длиной 1–6 от слов реальных названий и авторов
+        prefixes = []
+        for _ in range(options['lookups']):
+            _, name, author, _ = rows[rng.randrange(len(rows))]
+            word = rng.choice((name + ' ' + author).split())
+            prefixes.append(word[:rng.randint(1, min(6, len(word)))])
+        for prefix in prefixes[:1000]:
+            index.lookup(prefix)  # прогрев: топы коротких префиксов
+        lookups = []
+        for prefix in prefixes:
+            started = time.perf_counter()
+            index.lookup(prefix)
+            lookups.append((time.perf_counter() - started) * 1000)
+
+        updates = []
+        for _ in range(options['updates']):
+            slot = rng.randrange(len(rows))
+            started = time.perf_counter()
+            index.set_weight(slot, rng.randint(0, 5))
+            updates.append((time.perf_counter() - started) * 1000)
+        adds = []
+        next_id = max(row[0] for row in rows) + 1
+        for i in range(options['updates']):
+            started = time.perf_counter()
+            index.add(next_id + i, f'{rng.choice(WORDS).title()} Added {i}', 'Bench Author', 1)
+            adds.append((time.perf_counter() - started) * 1000)
+
+        lookup_stats, update_stats, add_stats = summarize(lookups), summarize(updates), summarize(adds)
+        self.stdout.write(
+            f'{len(rows)}\t{build_s:.2f}\t{memory / 2 ** 20:.1f}\t{memory // len(rows)}\t'
+            f"{lookup_stats['p50_ms']}\t{lookup_stats['p95_ms']}\t{lookup_stats['p99_ms']}\t"
+            f"{update_stats['p99_ms']}\t{add_stats['p99_ms']}"
+        )
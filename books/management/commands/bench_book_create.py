@@ -0,0 +1,89 @@
+import time
+from contextlib import ExitStack
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.utils import timezone
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.models import User
+from books.benchmarks import count_queries, measure, summarize
+from books.management.commands.bench_endpoints import bench_cache
+from books.models import Book, GoogleVolume
+
+COLUMNS = ('case', 'status', 'queries', 'google_calls', 'p50_ms', 'p95_ms', 'mean_ms')
+
+
+def fake_volume(volume_id):
+    return {'id': volume_id, 'volumeInfo': {
+        'title': f'Bench volume {volume_id}', 'authors': ['Bench Author'],
+        'description': 'Synthetic volume for bench_book_create', 'categories': ['Fiction / Bench'],
+    }}
+
+
+class FakeGoogleBooksClient:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def get_volume(self, volume_id):
+        self.calls += 1
+        time.sleep(self.latency)
+        return fake_volume(volume_id)
+
+
+class Command(BaseCommand):
+    help = ('Латентность POST /api/books/ с book_id: неизвестный том (запрос в Google, задержка '
+            'имитируется), том из google_volumes без книги и том, книга которого уже в каталоге. '
+            'Все изменения откатываются. Печатает TSV: ' + ', '.join(COLUMNS))
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--google-latency-ms', type=float, default=150,
+                            help='Имитируемая задержка Google Books на запрос тома')
+
+    def handle(self, *args, **options):
+        client = FakeGoogleBooksClient(options['google_latency_ms'] / 1000)
+        self.stdout.write('\t'.join(COLUMNS))
+        with ExitStack() as stack:
+            stack.enter_context(mock.patch.object(APIView, 'get_throttles', return_value=[]))
+            stack.enter_context(mock.patch('books.google_volumes.get_google_books_client', return_value=client))
+            stack.enter_context(bench_cache('warm'))
+            stack.enter_context(transaction.atomic())
+            try:
+                user = User.objects.create(username='bench_book_create', email='bench_book_create@example.com')
+                http = Client(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+                GoogleVolume.objects.create(volume_id='bench-cached', data=fake_volume('bench-cached'),
+                                            fetched_at=timezone.now())
+                Book.objects.create(name='Bench known volume', author='Bench Author', overview='',
+                                    google_volume_id='bench-known')
+                for case, volume_id in (('unknown', 'bench-unknown'), ('cached_volume', 'bench-cached'),
+                                        ('known', 'bench-known')):
+                    self._bench(case, http, client, volume_id, options['repeat'])
+            finally:
+                transaction.set_rollback(True)
+
+    def _bench(self, case, http, client, volume_id, repeat):
+        data = {'book_id': volume_id, 'condition': 'Good', 'location': '55.7558,37.6173'}
+
+        def request():
+            # Каждый вызов — с чистого листа: неизвестный том остаётся неизвестным
+            savepoint = transaction.savepoint()
+            try:
+                with count_queries() as queries:
+                    response = http.post('/api/books/', data)
+                return response, queries[0]
+            finally:
+                transaction.savepoint_rollback(savepoint)
+
+        calls_before = client.calls
+        response, queries = request()
+        google_calls = client.calls - calls_before
+        stats = summarize(measure(request, repeat=repeat))
+        self.stdout.write('\t'.join(str(value) for value in (
+            case, response.status_code, queries, google_calls, stats['p50_ms'], stats['p95_ms'], stats['mean_ms']
+        )))
@@ -0,0 +1,98 @@
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from books.datasets import copy_rows, reserve_ids
+from books.dedupe import DEFAULT_THRESHOLD, READ_CHUNK, find_duplicates, merge_proposals
+from books.models import BookMergeProposal
+
+VOCABULARY_SIZE = 20000
+AUTHORS = 50000
+
+
+def pseudo_word(rng, low=3, high=9):
+    return ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(low, high)))
+
+
+def variants(rng, title, first, last):
+    # Как дубликаты выглядят в каталоге: артикль, издание в скобках или после «:», опечатка, инициалы
+    author = f'{first} {last}'
+    typo_at = rng.randrange(1, len(title) - 1)
+    return rng.choice((
+        (f'The {title}', f'{last}, {first[0]}.'),
+        (f'{title} (Deluxe Edition)', author),
+        (f'{title}: Illustrated Edition', f'{first[0]}. {last}'),
+        (title[:typo_at] + title[typo_at + 1:], author),
+    ))
+
+
+class Command(BaseCommand):
+    help = ('Время find_duplicate_books на синтетическом каталоге из --size книг, из которых у '
+            '--duplicate-share есть вариант-дубликат, качество предложений и время merge_books. Книги пишутся COPY в '
+            'транзакции и откатываются. Печатает TSV: метрика, значение')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=100000)
+        parser.add_argument('--duplicate-share', type=float, default=0.05)
+        parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+        parser.add_argument('--chunk-size', type=int, default=READ_CHUNK)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        vocabulary = [pseudo_word(rng) for _ in range(VOCABULARY_SIZE)]
+        authors = [(pseudo_word(rng, 4, 7).title(), pseudo_word(rng, 5, 10).title()) for _ in range(AUTHORS)]
+
+        # families: название -> название исходной книги; planted — сколько слияний должно найтись
+        rows, families = [], {}
+        while len(rows) < options['size']:
+            title = ' '.join(rng.choices(vocabulary, k=rng.randint(2, 4))).title()
+            if title in families:
+                continue
+            first, last = rng.choice(authors)
+            family = [(title, f'{first} {last}')]
+            if rng.random() < options['duplicate_share']:
+                duplicate = variants(rng, title, first, last)
+                if duplicate[0] not in families:
+                    family.append(duplicate)
+            for name, author in family:
+                families[name] = title
+                rows.append((name, author))
+        planted = len(rows) - len(set(families.values()))
+
+        self.stdout.write('metric\tvalue')
+        with transaction.atomic():
+            try:
+                started = time.perf_counter()
+                book_ids = reserve_ids('books', 'book_id', len(rows))
+                copy_rows('books', ('book_id', 'name', 'author', 'overview'),
+                          ((book_id, name, author, '') for book_id, (name, author) in zip(book_ids, rows)))
+                self.stdout.write(f'load_s\t{round(time.perf_counter() - started, 3)}')
+
+                started = time.perf_counter()
+                stats = find_duplicates(threshold=options['threshold'], chunk_size=options['chunk_size'])
+                self.stdout.write(f'find_duplicates_s\t{round(time.perf_counter() - started, 3)}')
+                for name, value in stats.items():
+                    self.stdout.write(f'{name}\t{value}')
+
+                names_by_id = dict(zip(book_ids, (name for name, _ in rows)))
+                correct = sum(
+                    1 for duplicate_id, canonical_id in BookMergeProposal.objects.values_list('duplicate_id',
+                                                                                              'canonical_id')
+                    if duplicate_id in names_by_id and canonical_id in names_by_id
+                    and families[names_by_id[duplicate_id]] == families[names_by_id[canonical_id]]
+                )
+                self.stdout.write(f'planted\t{planted}')
+                self.stdout.write(f'correct\t{correct}')
+                self.stdout.write(f'recall\t{round(correct / planted, 4) if planted else 0.0}')
+                self.stdout.write(f"precision\t{round(correct / stats['proposals'], 4) if stats['proposals'] else 0.0}")
+
+                started = time.perf_counter()
+                merged = merge_proposals()
+                self.stdout.write(f'merge_s\t{round(time.perf_counter() - started, 3)}')
+                self.stdout.write(f"merged_books\t{merged['books']}")
+            finally:
+                transaction.set_rollback(True)
@@ -0,0 +1,181 @@
+import csv
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.models import User
+from books import datasets
+from books.benchmarks import count_queries, measure, summarize
+
+COLUMNS = ('size', 'endpoint', 'cache', 'status', 'queries', 'p50_ms', 'p95_ms', 'p99_ms', 'mean_ms')
+CACHE_MODES = ('cold', 'warm')
+DUMMY_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+def endpoint_cases(context):
+    """
+    (имя, метод, url, тело, от чьего имени). Запросы, меняющие данные,
+    выполняются в savepoint и откатываются.
+    """
+    lat, lon = context['center']
+    owner, requester, admin = context['heavy_owner_id'], context['heavy_requester_id'], context['admin_id']
+    lookup = {'user_book_ids': context['lookup_user_book_ids']}
+    return (
+        ('search_basic', 'get', '/api/books/search/?query=dragon', None, requester),
+        ('search_basic_genres', 'get', '/api/books/search/?query=dragon&genres=Fantasy,Poetry', None, requester),
+        ('search_compact', 'get', '/api/books/search/?query=dragon&compact=true', None, requester),
+        ('search_fulltext', 'get', '/api/books/search/?query=drgon&mode=fulltext', None, requester),
+        ('search_facets', 'get', '/api/books/search/?query=dragon&facets=true', None, requester),
+        ('list_owner', 'get', f'/api/books/list/?user_id={owner}', None, requester),
+        ('list_owner_cursor', 'get', f'/api/books/list/?user_id={owner}&pagination=cursor', None, requester),
+        ('list_all', 'get', '/api/books/all/', None, admin),
+        ('list_all_page_50', 'get', '/api/books/all/?page=50', None, admin),
+        ('nearby', 'get', f'/api/books/nearby/?lat={lat}&lon={lon}&radius_km=3', None, requester),
+        ('exchanges_list', 'get', '/api/exchange-requests/list/', None, requester),
+        ('exchanges_inbox_pending', 'get', '/api/exchange-requests/list/?box=inbox&status=pending', None, owner),
+        ('exchange_create', 'post', '/api/exchange-requests/',
+         {'user_book_id': context['available_user_book_id']}, owner),
+        ('owners_lookup', 'post', '/api/books/owners/', lookup, requester),
+        ('owners_lookup_binary', 'post', '/api/books/owners/?format=binary',
+         dict(lookup, fields=['owner', 'status', 'title']), requester),
+    )
+
+
+@contextmanager
+def bench_cache(mode):
+    """
+    cold — без кэша (DummyCache): каждый запрос считается заново.
+    warm — настроенный кэш под отдельным KEY_PREFIX, после замера ключи
+    удаляются: записи об откатываемых данных не должны пережить бенчмарк.
+    """
+    if mode == 'cold':
+        with override_settings(CACHES=DUMMY_CACHES):
+            yield
+        return
+    caches = {alias: dict(config, KEY_PREFIX='bench_endpoints') for alias, config in settings.CACHES.items()}
+    with override_settings(CACHES=caches):
+        try:
+            yield
+        finally:
+            if hasattr(cache, 'delete_pattern'):
+                cache.delete_pattern('*')
+            else:
+                cache.clear()
+
+
+class Command(BaseCommand):
+    help = ('Замеряет латентность и число SQL-запросов основных эндпоинтов (поиск, списки, обмены, owners) '
+            'на синтетическом наборе books.datasets. Вывод — TSV, который можно сравнивать между коммитами')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000', help='Размеры каталога через запятую')
+        parser.add_argument('--repeat', type=int, default=30)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--endpoints', default='', help='Только эти эндпоинты (через запятую)')
+        parser.add_argument('--existing', default='',
+                            help='Замерять уже загруженный generate_dataset набор с этим префиксом')
+        parser.add_argument('--output', default='', help='Дополнительно записать TSV в файл')
+        parser.add_argument('--compare', default='', help='TSV прошлого прогона: показать регрессии')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Допустимый рост p95 при --compare (доля)')
+
+    def handle(self, *args, **options):
+        only = {name.strip() for name in options['endpoints'].split(',') if name.strip()}
+        rows = []
+        with ExitStack() as stack:
+            # Лимиты DRF (1000/day на пользователя) кончились бы посреди замера
+            stack.enter_context(mock.patch.object(APIView, 'get_throttles', return_value=[]))
+            self.stdout.write('\t'.join(COLUMNS))
+            if options['existing']:
+                with transaction.atomic():
+                    context = datasets.describe(options['existing'])
+                    rows += self._bench(self._catalog_size(options['existing']), context, only, options['repeat'])
+                    transaction.set_rollback(True)
+            else:
+                for size in sorted(int(size) for size in options['sizes'].split(',')):
+                    with transaction.atomic():
+                        stats = datasets.generate(size, seed=options['seed'], prefix='bench_endpoints',
+                                                  log=lambda message: self.stderr.write(f'{size}: {message}'))
+                        rows += self._bench(size, stats, only, options['repeat'])
+                        transaction.set_rollback(True)
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                writer = csv.writer(output, delimiter='\t', lineterminator='\n')
+                writer.writerow(COLUMNS)
+                writer.writerows([row[column] for column in COLUMNS] for row in rows)
+        if options['compare']:
+            self._compare(rows, options['compare'], options['tolerance'])
+
+    def _catalog_size(self, prefix):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM books WHERE name LIKE %s', [f'% {prefix}-%'])
+            return cursor.fetchone()[0]
+
+    def _bench(self, size, context, only, repeat):
+        # /api/books/all/ — только для админов; откатывается вместе с набором
+        admin = User.objects.create(username='bench_endpoints_admin', email='bench_endpoints_admin@example.com',
+                                    is_staff=True)
+        context = dict(context, admin_id=admin.pk)
+        tokens = {}
+        rows = []
+        for name, method, url, data, user_id in endpoint_cases(context):
+            if only and name not in only:
+                continue
+            if user_id not in tokens:
+                tokens[user_id] = str(AccessToken.for_user(User.objects.get(pk=user_id)))
+            client = Client(HTTP_AUTHORIZATION=f'Bearer {tokens[user_id]}')
+            kwargs = {'data': data, 'content_type': 'application/json'} if data else {}
+
+            def request():
+                # Изменения (exchange_create) не должны копиться между повторами
+                savepoint = transaction.savepoint()
+                try:
+                    with count_queries() as queries:
+                        response = getattr(client, method)(url, **kwargs)
+                    return response, queries[0]
+                finally:
+                    transaction.savepoint_rollback(savepoint)
+
+            for mode in CACHE_MODES:
+                with bench_cache(mode):
+                    request()  # прогрев: в warm ответ попадает в кэш
+                    response, queries = request()
+                    stats = summarize(measure(request, repeat=repeat))
+                row = {'size': size, 'endpoint': name, 'cache': mode, 'status': response.status_code,
+                       'queries': queries, **stats}
+                rows.append(row)
+                self.stdout.write('\t'.join(str(row[column]) for column in COLUMNS))
+        return rows
+
+    def _compare(self, rows, path, tolerance):
+        with open(path, newline='') as baseline_file:
+            baseline = {
+                (row['size'], row['endpoint'], row['cache']): row
+                for row in csv.DictReader(baseline_file, delimiter='\t')
+            }
+        regressions = []
+        for row in rows:
+            before = baseline.get((str(row['size']), row['endpoint'], row['cache']))
+            if before is None:
+                continue
+            problems = []
+            if row['queries'] > int(before['queries']):
+                problems.append(f"queries {before['queries']} -> {row['queries']}")
+            if row['p95_ms'] > float(before['p95_ms']) * (1 + tolerance):
+                problems.append(f"p95 {before['p95_ms']} -> {row['p95_ms']} ms")
+            if str(row['status']) != before['status']:
+                problems.append(f"status {before['status']} -> {row['status']}")
+            if problems:
+                regressions.append(f"{row['size']}\t{row['endpoint']}\t{row['cache']}\t{'; '.join(problems)}")
+        if regressions:
+            self.stderr.write('\n'.join(regressions))
+            raise CommandError(f'{len(regressions)} regression(s) against {path}')
+        self.stderr.write(f'No regressions against {path}')
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import resource
+import time
+from urllib.parse import urlsplit
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from books import events
+from books.benchmarks import percentile
+
+
+def read_rss_kb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест /api/exchange-requests/events/: держит N одновременных '
+            'SSE-подписчиков на одном воркере и замеряет задержку доставки событий')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/api/exchange-requests/events/')
+        parser.add_argument('--subscribers', type=int, default=1000)
+        parser.add_argument('--events', type=int, default=20)
+        parser.add_argument('--interval', type=float, default=0.2, help='Пауза между событиями, с')
+        parser.add_argument('--connect-timeout', type=float, default=30)
+        parser.add_argument('--username', default='bench_events')
+        parser.add_argument('--pid', type=int, help='PID воркера сервера — показать его RSS')
+
+    def handle(self, *args, **options):
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < options['subscribers'] + 100:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, options['subscribers'] + 100), hard))
+
+        user, _ = get_user_model().objects.get_or_create(
+            username=options['username'], defaults={'email': f"{options['username']}@example.com"}
+        )
+        token = str(RefreshToken.for_user(user).access_token)
+        asyncio.run(self.run(user.pk, token, options))
+
+    async def run(self, user_id, token, options):
+        url = urlsplit(options['url'])
+        count = options['subscribers']
+        rss_before = read_rss_kb(options['pid']) if options['pid'] else None
+        latencies, received = [], [0] * count
+        connected = asyncio.Semaphore(0)
+
+        async def subscriber(index):
+            reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+            writer.write((
+                f'GET {url.path} HTTP/1.1\r\nHost: {url.netloc}\r\n'
+                f'Authorization: Bearer {token}\r\nAccept: text/event-stream\r\n\r\n'
+            ).encode())
+            await writer.drain()
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        return
+                    line = line.decode().strip()
+                    if line == ': connected':
+                        connected.release()
+                    elif line.startswith('data: '):
+                        payload = json.loads(line[len('data: '):])
+                        if 'sent_at' in payload:
+                            latencies.append((time.time() - payload['sent_at']) * 1000)
+                            received[index] += 1
+            finally:
+                writer.close()
+
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(subscriber(i)) for i in range(count)]
+        try:
+            for _ in range(count):
+                await asyncio.wait_for(connected.acquire(), timeout=options['connect_timeout'])
+        except asyncio.TimeoutError:
+            failed = [task for task in tasks if task.done()]
+            raise CommandError(f'Only some subscribers connected ({count - len(failed)} alive)')
+        connect_seconds = time.perf_counter() - started
+        rss_connected = read_rss_kb(options['pid']) if options['pid'] else None
+
+        for _ in range(options['events']):
+            events.publish([user_id], 'bench', {'sent_at': time.time()})
+            await asyncio.sleep(options['interval'])
+        await asyncio.sleep(1)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        expected = count * options['events']
+        self.stdout.write(f'subscribers\t{count}')
+        self.stdout.write(f'connect_seconds\t{connect_seconds:.2f}')
+        self.stdout.write(f'delivered\t{len(latencies)}/{expected}')
+        self.stdout.write(
+            f'latency_ms\tp50={percentile(latencies, 50):.1f}\tp95={percentile(latencies, 95):.1f}\t'
+            f'p99={percentile(latencies, 99):.1f}'
+        )
+        if rss_before is not None:
+            per_connection = (rss_connected - rss_before) / count
+            self.stdout.write(
+                f'server_rss_kb\tidle={rss_before}\tconnected={rss_connected}\t'
+                f'per_subscriber={per_connection:.1f}'
+            )
@@ -0,0 +1,84 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image, ImageDraw, ImageFilter
+
+from books.benchmarks import percentile
+from books.images import PHOTO_SIZES, render_variants
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+
+
+class Command(BaseCommand):
+    help = ('Замеряет нарезку фото (books.images.render_variants): CPU-время на '
+            'изображение и размер результатов против исходных файлов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Каталог с JPEG/PNG/GIF; по умолчанию — синтетические фото')
+        parser.add_argument('--count', type=int, default=20, help='Сколько синтетических фото сгенерировать')
+        parser.add_argument('--width', type=int, default=4032)
+        parser.add_argument('--height', type=int, default=3024)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        work_dir = tempfile.mkdtemp(prefix='bench_images_')
+        try:
+            if options['dir']:
+                paths = sorted(
+                    os.path.join(options['dir'], name) for name in os.listdir(options['dir'])
+                    if name.lower().endswith(IMAGE_EXTENSIONS)
+                )
+                if not paths:
+                    raise CommandError(f"No images in {options['dir']}")
+            else:
+                rng = random.Random(options['seed'])
+                paths = [
+                    self._synthetic_photo(rng, os.path.join(work_dir, f'photo_{i}.jpg'),
+                                          options['width'], options['height'])
+                    for i in range(options['count'])
+                ]
+            self._run(paths, work_dir)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _run(self, paths, work_dir):
+        cpu_ms, original_bytes = [], 0
+        output_bytes = {size: 0 for size, _ in PHOTO_SIZES}
+        for path in paths:
+            original_bytes += os.path.getsize(path)
+            started = time.process_time()
+            variants = render_variants(path, work_dir)
+            cpu_ms.append((time.process_time() - started) * 1000)
+            for size, variant in variants.items():
+                output_bytes[size] += variant['bytes']
+                os.remove(variant['path'])
+
+        count = len(paths)
+        self.stdout.write(f'images\t{count}')
+        self.stdout.write(
+            f'cpu_ms\tp50={percentile(cpu_ms, 50):.1f}\tp95={percentile(cpu_ms, 95):.1f}\t'
+            f'max={max(cpu_ms):.1f}'
+        )
+        self.stdout.write('variant\tavg_bytes\tvs_original')
+        self.stdout.write(f'original\t{original_bytes // count}\t100.0%')
+        for size, total in output_bytes.items():
+            self.stdout.write(f'{size}\t{total // count}\t{100 * total / original_bytes:.1f}%')
+
+    def _synthetic_photo(self, rng, path, width, height):
+        # Градиент, фигуры и шум — сжимается примерно как настоящая фотография
+        image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+        draw = ImageDraw.Draw(image)
+        for _ in range(40):
+            x, y = rng.randrange(width), rng.randrange(height)
+            r = rng.randrange(50, width // 4)
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(256) for _ in range(3)))
+        noise = Image.effect_noise((width, height), 40).convert('RGB')
+        image = Image.blend(image.filter(ImageFilter.GaussianBlur(3)), noise, 0.25)
+        exif = Image.Exif()
+        exif[0x010F] = 'Bench Camera'
+        image.save(path, 'JPEG', quality=92, exif=exif)
+        return path
@@ -0,0 +1,71 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import resolve
+
+from books import metrics
+
+
+def _per_call_ns(func, iterations, rounds=1):
+    # Лучший из rounds прогонов: на общей машине остальные искажены соседями
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter_ns()
+        for _ in range(iterations):
+            func()
+        elapsed = (time.perf_counter_ns() - started) / iterations
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class Command(BaseCommand):
+    help = ('Накладные расходы books.metrics: middleware на запрос, обёртка SQL на запрос к БД '
+            'и рендер /metrics. Печатает TSV: case, without_ns, with_ns, overhead_ns')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200000)
+        parser.add_argument('--rounds', type=int, default=5, help='Повторы замера (берётся минимум)')
+        parser.add_argument('--routes', type=int, default=50, help='Маршрутов в реестре для замера рендера')
+
+    def handle(self, *args, **options):
+        self.stdout.write('case\twithout_ns\twith_ns\toverhead_ns')
+        metrics.registry.reset()
+
+        # Middleware вокруг пустого представления: чистая стоимость замера и записи
+        request = RequestFactory().get('/api/books/search/')
+        request.resolver_match = resolve('/api/books/search/')
+        response = HttpResponse()
+
+        def view(request):
+            return response
+
+        middleware = metrics.MetricsMiddleware(view)
+        iterations, rounds = options['requests'], options['rounds']
+        self._row('middleware_per_request', _per_call_ns(lambda: view(request), iterations, rounds),
+                  _per_call_ns(lambda: middleware(request), iterations, rounds))
+
+        # Обёртка SQL вокруг пустого execute: её собственная стоимость на запрос к БД
+        # (сравнивать с живым SELECT 1 бессмысленно — разброс сети больше самой обёртки)
+        def execute(sql, params, many, context):
+            return None
+
+        token = metrics._request_db.set([0, 0.0])
+        try:
+            self._row('sql_per_query', _per_call_ns(lambda: execute('SELECT 1', None, False, {}), iterations, rounds),
+                      _per_call_ns(lambda: metrics._record_query(execute, 'SELECT 1', None, False, {}),
+                                   iterations, rounds))
+        finally:
+            metrics._request_db.reset(token)
+
+        for i in range(options['routes']):
+            for status in ('2xx', '4xx', '5xx'):
+                metrics.registry.observe('http_request_duration_seconds', (f'api/route{i}/', 'GET', status), 0.01)
+            metrics.registry.observe('http_request_db_queries', (f'api/route{i}/',), 3)
+            metrics.registry.inc('db_query_duration_seconds_total', (f'api/route{i}/',), 0.002)
+        self._row(f'render_{options["routes"]}_routes', 0, _per_call_ns(metrics.registry.render, 20, rounds))
+        metrics.registry.reset()
+
+    def _row(self, case, without, with_metrics):
+        self.stdout.write(f'{case}\t{without:.0f}\t{with_metrics:.0f}\t{with_metrics - without:.0f}')
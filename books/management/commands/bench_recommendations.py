@@ -0,0 +1,99 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from books.datasets import GENRES, WORDS
+from books.genres import genre_dictionary
+from books.models import Book, ExchangeRequest, UserBook
+from books.recommendations import build, mark_books_stale, mark_users_stale
+
+
+class Command(BaseCommand):
+    help = ('Замеряет сборку рекомендаций (полную и инкрементальную) на синтетическом каталоге: '
+            'у каждого пользователя два любимых жанра, запросы — в основном по ним')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,50000', help='Размеры каталога через запятую')
+        parser.add_argument('--users-per-book', type=float, default=0.1)
+        parser.add_argument('--requests-per-user', type=int, default=10)
+        parser.add_argument('--changed', type=int, default=100,
+                            help='Сколько новых запросов перед инкрементальной сборкой')
+        parser.add_argument('--top-k', type=int, default=None)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        self.stdout.write('size\tusers\trequests\tbuild\tbook_rows\tuser_rows\tload_s\tplan_s\tbooks_s\tusers_s\ttotal_s')
+        for size in sizes:
+            with transaction.atomic():
+                rng = random.Random(options['seed'])
+                users, user_books, requests = self._generate(rng, size, options)
+                self._report(size, users, requests, build(full=True, top_k=options['top_k']))
+
+                changed = self._request(rng, users, user_books, options['changed'])
+                mark_books_stale(user_book_ids=[request.book_id for request in changed])
+                mark_users_stale([request.requester_id for request in changed])
+                self._report(size, users, requests + len(changed), build(top_k=options['top_k']))
+                transaction.set_rollback(True)
+
+    def _report(self, size, users, requests, stats):
+        total = stats['load_s'] + stats['plan_s'] + stats['books_s'] + stats['users_s']
+        self.stdout.write(
+            f"{size}\t{len(users)}\t{requests}\t{'full' if stats['full'] else 'incremental'}\t"
+            f"{stats['book_rows']}\t{stats['user_rows']}\t{stats['load_s']}\t{stats['plan_s']}\t"
+            f"{stats['books_s']}\t{stats['users_s']}\t{round(total, 3)}"
+        )
+
+    def _generate(self, rng, size, options):
+        started = time.monotonic()
+        genre_ids = list(genre_dictionary.resolve(GENRES).values())
+        books = Book.objects.bulk_create([
+            Book(name=f"{' '.join(rng.sample(WORDS, 3)).title()} rec {i}", author='Bench Author', overview='')
+            for i in range(size)
+        ], batch_size=5000)
+        by_genre = {genre_id: [] for genre_id in genre_ids}
+        links = []
+        Through = Book.genres.through
+        for book in books:
+            for genre_id in rng.sample(genre_ids, rng.randint(1, 3)):
+                by_genre[genre_id].append(book)
+                links.append(Through(book_id=book.book_id, genre_id=genre_id))
+        Through.objects.bulk_create(links, batch_size=10000)
+
+        User = get_user_model()
+        users = User.objects.bulk_create([
+            User(username=f'bench_rec_{size}_{i}', email=f'bench_rec_{size}_{i}@example.com', password='!')
+            for i in range(max(2, int(size * options['users_per_book'])))
+        ], batch_size=5000)
+        user_books = UserBook.objects.bulk_create([
+            UserBook(user=rng.choice(users), book_id=book, condition='OK', location='55.7558,37.6173')
+            for book in books
+        ], batch_size=5000)
+        copies = {user_book.book_id_id: user_book for user_book in user_books}
+
+        requests = []
+        for user in users:
+            favourites = rng.sample(genre_ids, 2)
+            for _ in range(options['requests_per_user']):
+                pool = by_genre[rng.choice(favourites)] if rng.random() < 0.8 else books
+                user_book = copies[rng.choice(pool).book_id]
+                if user_book.user_id != user.pk:
+                    requests.append(ExchangeRequest(
+                        book=user_book, requester=user, owner_id=user_book.user_id, status='rejected'
+                    ))
+        ExchangeRequest.objects.bulk_create(requests, batch_size=10000)
+        self.stderr.write(f'{size}: данные сгенерированы за {time.monotonic() - started:.1f} с')
+        return users, user_books, len(requests)
+
+    def _request(self, rng, users, user_books, count):
+        requests = []
+        while len(requests) < count:
+            user, user_book = rng.choice(users), rng.choice(user_books)
+            if user_book.user_id != user.pk:
+                requests.append(ExchangeRequest(
+                    book=user_book, requester=user, owner_id=user_book.user_id, status='rejected'
+                ))
+        return ExchangeRequest.objects.bulk_create(requests)
@@ -0,0 +1,83 @@
+import random
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from books.benchmarks import measure, summarize
+from books.datasets import FIRST_NAMES, GENRES, LAST_NAMES, WORDS
+from books.genres import genre_dictionary
+from books.models import Book, UserBook
+from books.search import SEARCH_MODES, search_user_books, update_search_vectors
+
+DEFAULT_QUERIES = ('dragon', 'silent empire', 'drgon', 'winter garden queen')
+
+
+class Command(BaseCommand):
+    help = 'Замеряет латентность /api/books/search/ (basic vs fulltext) на синтетическом каталоге'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000',
+                            help='Размеры каталога через запятую')
+        parser.add_argument('--queries', default=','.join(DEFAULT_QUERIES))
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true',
+                            help='Не откатывать сгенерированные данные')
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        queries = [q.strip() for q in options['queries'].split(',') if q.strip()]
+        rng = random.Random(options['seed'])
+
+        with transaction.atomic():
+            user, _ = get_user_model().objects.get_or_create(
+                username='bench_search', defaults={'email': 'bench_search@example.com'}
+            )
+            genres = list(genre_dictionary.resolve(GENRES).values())
+            generated = 0
+
+            self.stdout.write('size\tmode\tquery\tp50_ms\tp95_ms\tp99_ms\tmean_ms')
+            for size in sizes:
+                while generated < size:
+                    count = min(options['batch_size'], size - generated)
+                    self._generate_batch(rng, user, genres, generated, count)
+                    generated += count
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE books; ANALYZE user_books; ANALYZE books_genres')
+
+                for mode in SEARCH_MODES:
+                    for query in queries:
+                        def run():
+                            list(search_user_books(query, '', '', mode).select_related('book_id')[:10])
+
+                        stats = summarize(measure(run, repeat=options['repeat']))
+                        self.stdout.write(
+                            f"{size}\t{mode}\t{query}\t{stats['p50_ms']}\t{stats['p95_ms']}\t"
+                            f"{stats['p99_ms']}\t{stats['mean_ms']}"
+                        )
+
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+    def _generate_batch(self, rng, user, genres, offset, count):
+        books = Book.objects.bulk_create([
+            Book(
+                name=f"{' '.join(rng.sample(WORDS, 3)).title()} {offset + i}",
+                author=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                overview=' '.join(rng.choices(WORDS, k=40)),
+            )
+            for i in range(count)
+        ])
+        Through = Book.genres.through
+        Through.objects.bulk_create([
+            Through(book_id=book.book_id, genre_id=genre_id)
+            for book in books
+            for genre_id in rng.sample(genres, rng.randint(1, 3))
+        ])
+        UserBook.objects.bulk_create([
+            UserBook(user=user, book_id=book, condition='OK', location='55.7558,37.6173')
+            for book in books
+        ])
+        update_search_vectors(book.book_id for book in books)
@@ -0,0 +1,73 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from rest_framework.throttling import UserRateThrottle
+
+from books.management.commands.bench_endpoints import bench_cache
+from books.throttling import UserGCRAThrottle
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+# (имя, класс, кэш: warm — настроенный Redis под своим префиксом, local — LocMem)
+CASES = (
+    ('drf_user', UserRateThrottle, 'warm'),
+    ('gcra_redis', UserGCRAThrottle, 'warm'),
+    ('gcra_local', UserGCRAThrottle, 'local'),
+)
+
+
+def throttle_with_rate(throttle_class, rate):
+    return type(throttle_class.__name__, (throttle_class,), {'rate': rate})()
+
+
+class Command(BaseCommand):
+    help = ('Накладные расходы троттлинга на запрос: UserRateThrottle из DRF (список отметок в кэше) '
+            'против GCRA в Redis и в памяти, и сколько запросов пропускают параллельные потоки при '
+            'исчерпанном бюджете. Печатает TSV: case, per_request_us, allowed, attempts, budget')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--history', type=int, default=1000,
+                            help='Отметок в окне DRF перед замером (пользователь у лимита 1000/day)')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--budget', type=int, default=100)
+
+    def handle(self, *args, **options):
+        self.stdout.write('case\tper_request_us\tallowed\tattempts\tbudget')
+        request = RequestFactory().get('/api/books/list/')
+        request.user = SimpleNamespace(pk=1, is_authenticated=True)
+        for name, throttle_class, mode in CASES:
+            with bench_cache(mode) if mode == 'warm' else override_settings(CACHES=LOCMEM_CACHES):
+                per_request = self._per_request_us(throttle_class, request, options)
+                allowed, attempts = self._concurrent(throttle_class, request, options)
+            self.stdout.write(f'{name}\t{per_request:.1f}\t{allowed}\t{attempts}\t{options["budget"]}')
+
+    def _per_request_us(self, throttle_class, request, options):
+        # Бюджет с запасом: замеряется стоимость пропущенного запроса
+        throttle = throttle_with_rate(throttle_class, f'{options["requests"] + options["history"] + 1}/day')
+        key = throttle.get_cache_key(request, None)
+        cache.delete(key)
+        if throttle_class is UserRateThrottle:
+            cache.set(key, [time.time()] * options['history'], throttle.duration)
+        started = time.perf_counter()
+        for _ in range(options['requests']):
+            throttle.allow_request(request, None)
+        elapsed = time.perf_counter() - started
+        cache.delete(key)
+        return elapsed / options['requests'] * 1_000_000
+
+    def _concurrent(self, throttle_class, request, options):
+        # Гонка get/set в DRF теряет отметки и пропускает больше бюджета
+        rate = f'{options["budget"]}/day'
+        attempts = options['budget'] * 4
+        cache.delete(throttle_with_rate(throttle_class, rate).get_cache_key(request, None))
+
+        def attempt(_):
+            return throttle_with_rate(throttle_class, rate).allow_request(request, None)
+
+        with ThreadPoolExecutor(options['threads']) as executor:
+            allowed = sum(executor.map(attempt, range(attempts)))
+        return allowed, attempts
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from books.recommendations import build
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рекомендации (похожие книги и топы пользователей); по умолчанию — только изменившееся'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Пересчитать все книги и всех пользователей')
+        parser.add_argument('--top-k', type=int, default=None)
+
+    def handle(self, *args, **options):
+        stats = build(full=options['full'], top_k=options['top_k'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Полная' if stats['full'] else 'Инкрементальная'} сборка: книг {stats['book_rows']} из {stats['books']}, "
+            f"пользователей {stats['user_rows']}; загрузка {stats['load_s']} с, план {stats['plan_s']} с, "
+            f"книги {stats['books_s']} с, пользователи {stats['users_s']} с"
+        ))
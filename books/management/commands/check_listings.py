@@ -0,0 +1,38 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from books.listings import delete_orphan_listings, find_inconsistencies, id_ranges, refresh_listings
+
+
+class Command(BaseCommand):
+    help = 'Проверяет, что user_book_listings совпадает с user_books/books/жанрами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--fix', action='store_true', help='Исправить найденные расхождения')
+        parser.add_argument('--show', type=int, default=20, help='Сколько id вывести')
+
+    def handle(self, *args, **options):
+        problems = []
+        for id_range in id_ranges(options['batch_size']):
+            found = find_inconsistencies(id_range=id_range)
+            if found and options['fix']:
+                with transaction.atomic():
+                    refresh_listings(user_book_ids=[pk for pk, problem in found if problem != 'orphan'])
+                    delete_orphan_listings(id_range=id_range)
+            problems.extend(found)
+
+        if not problems:
+            self.stdout.write(self.style.SUCCESS('Витрина согласована'))
+            return
+
+        counts = Counter(problem for _, problem in problems)
+        summary = ', '.join(f'{problem}: {count}' for problem, count in sorted(counts.items()))
+        sample = ', '.join(f'{pk} ({problem})' for pk, problem in problems[:options['show']])
+        self.stdout.write(f'Расхождения — {summary}. Например: {sample}')
+        if options['fix']:
+            self.stdout.write(self.style.SUCCESS('Расхождения исправлены'))
+        else:
+            raise CommandError('user_book_listings рассогласована, запустите с --fix')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from books.dedupe import DEFAULT_THRESHOLD, READ_CHUNK, find_duplicates
+
+
+class Command(BaseCommand):
+    help = ('Ищет дубликаты в каталоге (нормализованные название и автор, MinHash/LSH по названиям) и '
+            'заменяет предложения слияния в book_merge_proposals. Применяет их merge_books')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='Минимальное оценённое сходство названий (Жаккар по 3-граммам)')
+        parser.add_argument('--chunk-size', type=int, default=READ_CHUNK, help='Книг за один SELECT')
+
+    def handle(self, *args, **options):
+        stats = find_duplicates(threshold=options['threshold'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Книг {stats['books']}: кандидатов {stats['candidates']}, совпало {stats['matched']}, "
+            f"групп {stats['groups']}, предложений {stats['proposals']}; сигнатуры {stats['signatures_s']} с, "
+            f"пары {stats['candidates_s']} с, запись {stats['write_s']} с"
+        ))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from books import datasets
+from books.response_cache import TAG_BOOKS, TAG_USER_BOOK_COUNTS, TAG_USER_BOOKS, invalidate_on_commit
+
+
+class Command(BaseCommand):
+    help = ('Загружает синтетический набор books.datasets (пользователи, книги, жанры, экземпляры с '
+            'координатами, фото, история обменов) через COPY. Для нагрузочных прогонов на отдельной базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=10000, help='Число книг (10000, 100000, 1000000)')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='bench',
+                            help='Префикс имён пользователей и книг, см. bench_endpoints --existing')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            try:
+                stats = datasets.generate(options['size'], seed=options['seed'], prefix=options['prefix'],
+                                          log=self.stderr.write)
+            except ValueError as e:
+                raise CommandError(str(e))
+            # COPY не шлёт сигналов — кэш ответов сбрасываем сами
+            invalidate_on_commit(TAG_BOOKS, TAG_USER_BOOKS, TAG_USER_BOOK_COUNTS)
+        for name in ('users', 'books', 'user_books', 'photos', 'exchange_requests',
+                     'heavy_owner_id', 'heavy_owner_copies', 'heavy_requester_id'):
+            self.stdout.write(f'{name}\t{stats[name]}')
@@ -0,0 +1,37 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from books.ingest import run_ingest_worker
+
+
+class Command(BaseCommand):
+    help = ('Воркер загрузки каталога: забирает файлы, принятые /api/books/ingest/, из '
+            'catalog_ingest_jobs. Можно запускать несколько экземпляров параллельно')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Параллельных запросов к Google Books')
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+                            help='Пауза в секундах, когда очередь пуста')
+        parser.add_argument('--once', action='store_true',
+                            help='Обработать текущие задачи и выйти')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        # Дорабатываем текущий файл и выходим; убитый воркер продолжит с checkpoint после аренды
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        processed = run_ingest_worker(
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            poll_interval=options['poll_interval'],
+            once=options['once'],
+            stop=lambda: self.stopping,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Обработано задач: {processed}'))
+
+    def stop(self, signum, frame):
+        self.stopping = True
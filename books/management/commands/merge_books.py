@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from books.dedupe import merge_proposals
+from books.models import BookMergeProposal
+
+
+class Command(BaseCommand):
+    help = ('Сливает дубликаты из book_merge_proposals (см. find_duplicate_books): экземпляры и жанры '
+            'переходят к канонической книге, дубликаты удаляются')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-score', type=float, default=0.0, help='Сливать только предложения не ниже')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет слито')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            proposals = BookMergeProposal.objects.filter(score__gte=options['min_score']).select_related(
+                'duplicate', 'canonical'
+            ).order_by('canonical_id', 'duplicate_id')
+            for proposal in proposals.iterator():
+                self.stdout.write(f'{proposal.score:.2f}\t{proposal.duplicate.name!r} -> {proposal.canonical.name!r}')
+            return
+        stats = merge_proposals(min_score=options['min_score'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Слито книг {stats['books']}, перенесено экземпляров {stats['user_books']}, "
+            f"связей с жанрами {stats['genre_links']}"
+        ))
@@ -0,0 +1,35 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from books.photo_jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = ('Воркер фоновой загрузки фото: забирает задачи из photo_jobs и выгружает '
+            'файлы в хранилище. Можно запускать несколько экземпляров параллельно')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1,
+                            help='Сколько задач забирать за раз')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Пауза в секундах, когда очередь пуста')
+        parser.add_argument('--once', action='store_true',
+                            help='Обработать текущие задачи и выйти')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        # Дорабатываем текущую задачу и выходим, а не обрываем загрузку посередине
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        processed = run_worker(
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+            once=options['once'],
+            stop=lambda: self.stopping,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Обработано задач: {processed}'))
+
+    def stop(self, signum, frame):
+        self.stopping = True
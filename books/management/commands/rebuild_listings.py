@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from books.listings import delete_orphan_listings, id_ranges, refresh_listings
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает витрину user_book_listings пачками по диапазонам user_book_id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        upserted = deleted = 0
+        for id_range in id_ranges(options['batch_size']):
+            with transaction.atomic():
+                upserted += refresh_listings(id_range=id_range)
+                deleted += delete_orphan_listings(id_range=id_range)
+            self.stdout.write(f'user_book_id {id_range[0]}..{id_range[1] - 1}: обновлено {upserted}, удалено {deleted}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.monotonic() - started:.1f} с: обновлено {upserted}, удалено {deleted}'
+        ))
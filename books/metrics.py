@@ -0,0 +1,256 @@
+# books/metrics.py
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Границы бакетов гистограмм (верхние, включительно), как в клиентах Prometheus
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+UNMATCHED_ROUTE = '<unmatched>'
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # последний — +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """
+    Метрики процесса: счётчики и гистограммы с метками, одна блокировка на
+    запись. Каждый воркер считает своё, Prometheus собирает их по отдельности.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}  # имя -> (тип, описание, имена меток, {значения меток: Histogram | число})
+
+    def register(self, name, kind, help_text, labels, bounds=None):
+        self._metrics[name] = (kind, help_text, labels, bounds, {})
+
+    def inc(self, name, labels, value=1):
+        self.record(increments=((name, labels, value),))
+
+    def observe(self, name, labels, value):
+        self.record(observations=((name, labels, value),))
+
+    def record(self, observations=(), increments=()):
+        """
+        Несколько обновлений под одной блокировкой: (имя, метки, значение).
+        """
+        with self._lock:
+            for name, labels, value in observations:
+                _, _, _, bounds, series = self._metrics[name]
+                histogram = series.get(labels)
+                if histogram is None:
+                    histogram = series[labels] = Histogram(bounds)
+                histogram.observe(value)
+            for name, labels, value in increments:
+                series = self._metrics[name][4]
+                series[labels] = series.get(labels, 0) + value
+
+    def reset(self):
+        with self._lock:
+            for metric in self._metrics.values():
+                metric[4].clear()
+
+    def snapshot(self, name):
+        """
+        {значения меток: число | (накопленные бакеты, сумма, количество)} — для тестов и бенчмарков.
+        """
+        with self._lock:
+            return {
+                labels: (_cumulative(value.counts), value.sum, sum(value.counts))
+                if isinstance(value, Histogram) else value
+                for labels, value in self._metrics[name][4].items()
+            }
+
+    def render(self):
+        """
+        Текстовый формат Prometheus (text/plain; version=0.0.4). Под блокировкой
+        только копирование: форматирование не задерживает запись из запросов.
+        """
+        with self._lock:
+            copied = [
+                (name, kind, help_text, label_names, bounds, [
+                    (labels, (list(value.counts), value.sum) if isinstance(value, Histogram) else value)
+                    for labels, value in series.items()
+                ])
+                for name, (kind, help_text, label_names, bounds, series) in self._metrics.items()
+            ]
+        lines = []
+        for name, kind, help_text, label_names, bounds, series in copied:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(series):
+                pairs = list(zip(label_names, labels))
+                if kind == 'counter':
+                    lines.append(f'{name}{_labels(pairs)} {_number(value)}')
+                    continue
+                counts, total = value
+                for bound, count in zip((*bounds, '+Inf'), _cumulative(counts)):
+                    lines.append(f'{name}_bucket{_labels(pairs + [("le", bound)])} {count}')
+                lines.append(f'{name}_sum{_labels(pairs)} {_number(total)}')
+                lines.append(f'{name}_count{_labels(pairs)} {sum(counts)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _cumulative(counts):
+    total, result = 0, []
+    for count in counts:
+        total += count
+        result.append(total)
+    return result
+
+
+def _number(value):
+    return repr(round(value, 6)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+registry = MetricsRegistry()
+registry.register('http_request_duration_seconds', 'histogram', 'Request latency by route',
+                  ('route', 'method', 'status'), LATENCY_BUCKETS)
+registry.register('http_request_db_queries', 'histogram', 'SQL queries per request by route',
+                  ('route',), QUERY_COUNT_BUCKETS)
+registry.register('db_query_duration_seconds_total', 'counter', 'Time spent in SQL by route', ('route',))
+registry.register('cache_requests_total', 'counter', 'Cache lookups by cache and result', ('cache', 'result'))
+registry.register('upstream_request_duration_seconds', 'histogram', 'Outbound call latency by upstream',
+                  ('upstream', 'operation', 'outcome'), LATENCY_BUCKETS)
+
+# [число запросов, время в SQL] текущего HTTP-запроса; None — вне запроса
+_request_db = ContextVar('metrics_request_db', default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _request_db.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - started
+
+
+def install_query_hook(connection, **kwargs):
+    # Обёртка живёт на объекте соединения и переживает переподключения
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+connection_created.connect(install_query_hook)
+
+
+def record_cache(cache_name, hits=0, misses=0, stale=0):
+    # stale — отдано устаревшим, пока запись обновляется (suggestion_cache)
+    if not settings.METRICS_ENABLED:
+        return
+    if hits:
+        registry.inc('cache_requests_total', (cache_name, 'hit'), hits)
+    if misses:
+        registry.inc('cache_requests_total', (cache_name, 'miss'), misses)
+    if stale:
+        registry.inc('cache_requests_total', (cache_name, 'stale'), stale)
+
+
+@contextmanager
+def track_upstream(upstream, operation):
+    """
+    with track_upstream('google_books', 'search'): ... — латентность
+    внешнего вызова; исключение считается outcome="error" и пробрасывается.
+    """
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        if settings.METRICS_ENABLED:
+            registry.observe('upstream_request_duration_seconds', (upstream, operation, outcome),
+                             time.perf_counter() - started)
+
+
+class MetricsMiddleware:
+    """
+    Латентность, число SQL-запросов и время в SQL по маршруту (шаблон URL, а
+    не путь — иначе метки размножатся по id). Работает и в WSGI, и в ASGI:
+    для асинхронных представлений (SSE) не нужен переход в поток. У потоковых
+    ответов латентность — до заголовков.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = settings.METRICS_ENABLED
+        for connection in connections.all(initialized_only=True):
+            install_query_hook(connection)
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        started, token = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            db = _request_db.get()
+            _request_db.reset(token)
+        self._finish(request, response, started, db)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        started, token = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            db = _request_db.get()
+            _request_db.reset(token)
+        self._finish(request, response, started, db)
+        return response
+
+    def _start(self):
+        return time.perf_counter(), _request_db.set([0, 0.0])
+
+    def _finish(self, request, response, started, db):
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        route = match.route if match is not None else UNMATCHED_ROUTE
+        registry.record(
+            observations=(
+                ('http_request_duration_seconds', (route, request.method, f'{response.status_code // 100}xx'), elapsed),
+                ('http_request_db_queries', (route,), db[0]),
+            ),
+            increments=(('db_query_duration_seconds_total', (route,), db[1]),),
+        )
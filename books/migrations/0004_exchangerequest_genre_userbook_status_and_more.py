@@ -0,0 +1,127 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def split_genres(value):
+    # Как books.genres.normalize_genre_names на момент миграции: 'Fiction / Fantasy, Drama' -> 3 жанра
+    names = []
+    for genre in (value or '').split(','):
+        for part in genre.split('/'):
+            part = part.strip()[:100]
+            if part and part not in names:
+                names.append(part)
+    return names
+
+
+def copy_genres_to_genre_table(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    Genre = apps.get_model('books', 'Genre')
+    Through = Book.genres.through
+    genres_by_book = {
+        book_id: split_genres(value) for book_id, value in Book.objects.values_list('book_id', 'genres_legacy')
+    }
+    names = {name for genre_names in genres_by_book.values() for name in genre_names}
+    Genre.objects.bulk_create([Genre(name=name) for name in names], ignore_conflicts=True)
+    genre_ids = dict(Genre.objects.filter(name__in=names).values_list('name', 'id'))
+    Through.objects.bulk_create([
+        Through(book_id=book_id, genre_id=genre_ids[name])
+        for book_id, genre_names in genres_by_book.items()
+        for name in genre_names
+    ], ignore_conflicts=True, batch_size=1000)
+
+
+def copy_genres_to_char_field(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    for book in Book.objects.prefetch_related('genres'):
+        book.genres_legacy = ', '.join(genre.name for genre in book.genres.all())[:255]
+        book.save(update_fields=['genres_legacy'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_alter_book_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRequest',
+            fields=[
+                ('exchange_request_id', models.AutoField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('accepted', 'Accepted'), ('rejected', 'Rejected'), ('completed', 'Completed')], default='pending', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'exchange_requests',
+            },
+        ),
+        migrations.CreateModel(
+            name='Genre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='userbook',
+            name='status',
+            field=models.CharField(choices=[('available', 'Available'), ('requested', 'Requested'), ('exchanged', 'Exchanged')], default='available', max_length=20),
+        ),
+        # Строковое поле жанров переносится в Genre и таблицу связей, а не теряется
+        migrations.RenameField(
+            model_name='book',
+            old_name='genres',
+            new_name='genres_legacy',
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='genres',
+            field=models.ManyToManyField(blank=True, to='books.genre'),
+        ),
+        migrations.RunPython(copy_genres_to_genre_table, copy_genres_to_char_field),
+        # default — чтобы откат мог вернуть колонку в непустую таблицу
+        migrations.AlterField(
+            model_name='book',
+            name='genres_legacy',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.RemoveField(
+            model_name='book',
+            name='genres_legacy',
+        ),
+        migrations.AddIndex(
+            model_name='userbook',
+            index=models.Index(fields=['user', 'status'], name='idx_userbook_user_status'),
+        ),
+        migrations.AddIndex(
+            model_name='userbook',
+            index=models.Index(fields=['book_id'], name='idx_userbook_book_id'),
+        ),
+        migrations.AddField(
+            model_name='exchangerequest',
+            name='book',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exchange_requests', to='books.userbook'),
+        ),
+        migrations.AddField(
+            model_name='exchangerequest',
+            name='owner',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='owned_books', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='exchangerequest',
+            name='requester',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='requested_books', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['name'], name='idx_book_name'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['author'], name='idx_book_author'),
+        ),
+    ]
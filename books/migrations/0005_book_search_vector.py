@@ -0,0 +1,59 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:02
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+def backfill_search_vectors(apps, schema_editor):
+    config = getattr(settings, 'BOOK_SEARCH_CONFIG', 'simple')
+    schema_editor.execute(
+        """
+        UPDATE books AS b
+        SET search_vector =
+            setweight(to_tsvector(%(config)s::regconfig, coalesce(b.name, '')), 'A') ||
+            setweight(to_tsvector(%(config)s::regconfig, coalesce(b.author, '')), 'B') ||
+            setweight(to_tsvector(%(config)s::regconfig, coalesce(g.names, '')), 'C') ||
+            setweight(to_tsvector(%(config)s::regconfig, coalesce(b.overview, '')), 'D')
+        FROM (
+            SELECT bk.book_id AS book_pk, string_agg(gn.name, ' ') AS names
+            FROM books bk
+            LEFT JOIN books_genres bg ON bg.book_id = bk.book_id
+            LEFT JOIN books_genre gn ON gn.id = bg.genre_id
+            GROUP BY bk.book_id
+        ) AS g
+        WHERE b.book_id = g.book_pk
+        """,
+        {'config': config},
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_exchangerequest_genre_userbook_status_and_more'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='idx_book_search_vector'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='idx_book_name_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['author'], name='idx_book_author_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.RunPython(backfill_search_vectors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:11
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0007_exchange_request_created_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserBookListing',
+            fields=[
+                ('user_book', models.OneToOneField(db_column='user_book_id', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listing', serialize=False, to='books.userbook')),
+                ('user_id', models.BigIntegerField()),
+                ('book_id', models.IntegerField()),
+                ('book_name', models.CharField(max_length=255)),
+                ('book_author', models.CharField(max_length=255)),
+                ('genres', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=100), blank=True, default=list, size=None)),
+                ('condition', models.CharField(max_length=255)),
+                ('location', models.CharField(max_length=255)),
+                ('status', models.CharField(max_length=20)),
+            ],
+            options={
+                'db_table': 'user_book_listings',
+                'indexes': [models.Index(fields=['user_id', 'user_book'], name='idx_listing_user'), models.Index(fields=['book_id'], name='idx_listing_book'), models.Index(condition=models.Q(('status', 'available')), fields=['user_book'], name='idx_listing_available'), django.contrib.postgres.indexes.GinIndex(fields=['genres'], name='idx_listing_genres'), django.contrib.postgres.indexes.GinIndex(fields=['book_name'], name='idx_listing_name_trgm', opclasses=['gin_trgm_ops'])],
+            },
+        ),
+        migrations.RunSQL(
+            """
+            INSERT INTO user_book_listings
+                (user_book_id, user_id, book_id, book_name, book_author, genres, condition, location, status)
+            SELECT ub.user_book_id, ub.user_id, ub.book_id_id, b.name, b.author,
+                   coalesce(array_agg(g.name ORDER BY bg.id) FILTER (WHERE g.name IS NOT NULL), '{}'),
+                   ub.condition, ub.location, ub.status
+            FROM user_books ub
+            JOIN books b ON b.book_id = ub.book_id_id
+            LEFT JOIN books_genres bg ON bg.book_id = b.book_id
+            LEFT JOIN books_genre g ON g.id = bg.genre_id
+            GROUP BY ub.user_book_id, b.book_id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_photo_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
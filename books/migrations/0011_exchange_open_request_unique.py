@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0010_photo_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Гонка в старом ExchangeRequestView могла оставить несколько открытых
+        # запросов на один экземпляр: оставляем самый ранний, остальные отклоняем
+        migrations.RunSQL(
+            """
+            UPDATE exchange_requests SET status = 'rejected'
+            WHERE status = 'pending' AND exchange_request_id NOT IN (
+                SELECT min(exchange_request_id) FROM exchange_requests
+                WHERE status = 'pending' GROUP BY book_id
+            )
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='exchangerequest',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('book',), name='uniq_exchange_open_per_book'),
+        ),
+    ]
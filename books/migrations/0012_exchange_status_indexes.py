@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0011_exchange_open_request_unique'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='exchangerequest',
+            index=models.Index(fields=['owner', 'status', '-created_at'], name='idx_exchange_owner_status'),
+        ),
+        migrations.AddIndex(
+            model_name='exchangerequest',
+            index=models.Index(fields=['requester', 'status', '-created_at'], name='idx_exchange_requester_status'),
+        ),
+    ]
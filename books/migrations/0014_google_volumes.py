@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-18 04:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0013_recommendations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='google_volume_id',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name='GoogleVolume',
+            fields=[
+                ('volume_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.JSONField()),
+                ('fetched_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'google_volumes',
+                'indexes': [models.Index(fields=['fetched_at'], name='idx_google_volume_fetched')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-18 04:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0014_google_volumes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookMergeProposal',
+            fields=[
+                ('duplicate', models.OneToOneField(db_column='duplicate_id', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='merge_proposal', serialize=False, to='books.book')),
+                ('score', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('canonical', models.ForeignKey(db_column='canonical_id', on_delete=django.db.models.deletion.CASCADE, related_name='merge_duplicates', to='books.book')),
+            ],
+            options={
+                'db_table': 'book_merge_proposals',
+                'indexes': [models.Index(fields=['canonical'], name='idx_merge_proposal_canonical')],
+            },
+        ),
+    ]
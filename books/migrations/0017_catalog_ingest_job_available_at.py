@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-18 06:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0016_catalog_ingest_jobs'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='catalogingestjob',
+            name='idx_ingest_job_queued',
+        ),
+        migrations.AddField(
+            model_name='catalogingestjob',
+            name='available_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='catalogingestjob',
+            index=models.Index(condition=models.Q(('status', 'queued')), fields=['available_at'], name='idx_ingest_job_queued'),
+        ),
+    ]
@@ -1,4 +1,10 @@
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+import uuid
+
 from django.db import models
+from django.utils import timezone
 from accounts.models import User
 
 class Genre(models.Model):
@@ -13,17 +19,43 @@ class Book(models.Model):
     author = models.CharField(max_length=255)
     overview = models.TextField()
     genres = models.ManyToManyField(Genre, blank=True)
+    # id тома Google Books, из которого создана книга (у своих книг пользователей — NULL)
+    google_volume_id = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    # Поддерживается books.search.update_search_vectors (name, author, жанры, overview)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         db_table = 'books'
         indexes = [
             models.Index(fields=['name'], name='idx_book_name'),
             models.Index(fields=['author'], name='idx_book_author'),
+            GinIndex(fields=['search_vector'], name='idx_book_search_vector'),
+            GinIndex(fields=['name'], name='idx_book_name_trgm', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['author'], name='idx_book_author_trgm', opclasses=['gin_trgm_ops']),
         ]
 
     def __str__(self):
         return self.name
 
+class GoogleVolume(models.Model):
+    """
+    Ответ Google Books на GET /volumes/{id} как есть. Повторно за томом в
+    Google ходят, только если fetched_at старше GOOGLE_VOLUME_REFRESH_DAYS
+    (books.google_volumes).
+    """
+    volume_id = models.CharField(max_length=64, primary_key=True)
+    data = models.JSONField()
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'google_volumes'
+        indexes = [
+            models.Index(fields=['fetched_at'], name='idx_google_volume_fetched'),
+        ]
+
+    def __str__(self):
+        return self.volume_id
+
 class UserBook(models.Model):
     STATUS_CHOICES = (
         ('available', 'Available'),
@@ -37,20 +69,138 @@ class UserBook(models.Model):
     condition = models.CharField(max_length=255)
     location = models.CharField(max_length=255)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='available')
+    # Разобранный location (см. books.geo.apply_coordinates) для поиска поблизости
+    latitude = models.FloatField(null=True, blank=True, editable=False)
+    longitude = models.FloatField(null=True, blank=True, editable=False)
+    geohash = models.CharField(max_length=12, blank=True, default='', editable=False)
 
     class Meta:
         db_table = 'user_books'
         indexes = [
             models.Index(fields=['user', 'status'], name='idx_userbook_user_status'),
             models.Index(fields=['book_id'], name='idx_userbook_book_id'),
+            models.Index(
+                fields=['geohash'], name='idx_userbook_available_geohash',
+                opclasses=['varchar_pattern_ops'], condition=models.Q(status='available'),
+            ),
         ]
 
     def __str__(self):
         return f"{self.book_id.name} (User: {self.user.username})"
+class UserBookListing(models.Model):
+    """
+    Денормализованная строка списка книг: одна на UserBook, без join'ов и
+    без overview. Поддерживается books.listings (сигналы + rebuild_listings).
+    """
+    user_book = models.OneToOneField(
+        UserBook, primary_key=True, on_delete=models.CASCADE, related_name='listing', db_column='user_book_id'
+    )
+    user_id = models.BigIntegerField()
+    book_id = models.IntegerField()
+    book_name = models.CharField(max_length=255)
+    book_author = models.CharField(max_length=255)
+    genres = ArrayField(models.CharField(max_length=100), default=list, blank=True)
+    condition = models.CharField(max_length=255)
+    location = models.CharField(max_length=255)
+    status = models.CharField(max_length=20)
+
+    class Meta:
+        db_table = 'user_book_listings'
+        indexes = [
+            models.Index(fields=['user_id', 'user_book'], name='idx_listing_user'),
+            models.Index(fields=['book_id'], name='idx_listing_book'),
+            models.Index(fields=['user_book'], name='idx_listing_available', condition=models.Q(status='available')),
+            GinIndex(fields=['genres'], name='idx_listing_genres'),
+            GinIndex(fields=['book_name'], name='idx_listing_name_trgm', opclasses=['gin_trgm_ops']),
+        ]
+
+    def __str__(self):
+        return f"{self.book_name} (Listing {self.user_book_id})"
+
+class BookRecommendation(models.Model):
+    """
+    Топ-K похожих книг (по жанрам и совместным запросам на обмен), лучшие
+    первыми. Строит books.recommendations (команда build_recommendations);
+    stale_at — когда данные книги изменились после последней сборки.
+    """
+    book = models.OneToOneField(
+        Book, primary_key=True, on_delete=models.CASCADE, related_name='recommendation', db_column='book_id'
+    )
+    book_ids = ArrayField(models.IntegerField(), default=list, blank=True)
+    scores = ArrayField(models.FloatField(), default=list, blank=True)
+    stale_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'book_recommendations'
+        indexes = [
+            models.Index(fields=['stale_at'], name='idx_book_rec_stale', condition=models.Q(stale_at__isnull=False)),
+        ]
+
+    def __str__(self):
+        return f"Recommendations for book {self.book_id}"
+
+class UserRecommendation(models.Model):
+    """
+    Топ-K книг для пользователя по его запросам и полке (без его собственных
+    и уже запрошенных книг). Строит books.recommendations.
+    """
+    user = models.OneToOneField(
+        User, primary_key=True, on_delete=models.CASCADE, related_name='recommendation', db_column='user_id'
+    )
+    book_ids = ArrayField(models.IntegerField(), default=list, blank=True)
+    scores = ArrayField(models.FloatField(), default=list, blank=True)
+    stale_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'user_recommendations'
+        indexes = [
+            models.Index(fields=['stale_at'], name='idx_user_rec_stale', condition=models.Q(stale_at__isnull=False)),
+        ]
+
+    def __str__(self):
+        return f"Recommendations for user {self.user_id}"
+
+class BookMergeProposal(models.Model):
+    """
+    Предложение слить дубликат каталога в каноническую книгу. Строит
+    books.dedupe (find_duplicate_books), применяет merge_books; неверное
+    предложение достаточно удалить до слияния.
+    """
+    duplicate = models.OneToOneField(
+        Book, primary_key=True, on_delete=models.CASCADE, related_name='merge_proposal', db_column='duplicate_id'
+    )
+    canonical = models.ForeignKey(
+        Book, on_delete=models.CASCADE, related_name='merge_duplicates', db_column='canonical_id'
+    )
+    # Оценка сходства названий по MinHash (1.0 — совпали нормализованные название и автор)
+    score = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'book_merge_proposals'
+        indexes = [
+            models.Index(fields=['canonical'], name='idx_merge_proposal_canonical'),
+        ]
+
+    def __str__(self):
+        return f"Merge book {self.duplicate_id} into {self.canonical_id}"
+
 class Photo(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),  # Файл принят и ждёт загрузки в хранилище
+        ('ready', 'Ready'),  # file_path указывает на загруженный файл
+        ('failed', 'Failed'),  # Загрузка не удалась после всех попыток
+    )
+
     photo_id = models.AutoField(primary_key=True)
     user_book_id = models.ForeignKey(UserBook, on_delete=models.CASCADE)
-    file_path = models.CharField(max_length=255)
+    file_path = models.CharField(max_length=255, blank=True, default='')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='ready')
+    # {'thumb'|'medium'|'full': {'url', 'width', 'height'}} — см. books.images.PHOTO_SIZES;
+    # file_path совпадает с full. У фото, загруженных до нарезки, пусто
+    variants = models.JSONField(default=dict, blank=True)
 
     class Meta:
         db_table = 'photo'
@@ -58,6 +208,82 @@ class Photo(models.Model):
     def __str__(self):
         return f"Photo for {self.user_book_id}"
 
+class PhotoJob(models.Model):
+    """
+    Задача фоновой загрузки фото (books.photo_jobs, команда photo_worker):
+    файл уже лежит в spool_path, воркер выгружает его в хранилище.
+    """
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    job_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    photo = models.ForeignKey(Photo, on_delete=models.CASCADE, related_name='jobs')
+    spool_path = models.CharField(max_length=500)
+    # file_path, который заменяет эта загрузка (PATCH): удаляется из хранилища после успеха
+    replaces_file_path = models.CharField(max_length=255, blank=True, default='')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    available_at = models.DateTimeField()
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'photo_jobs'
+        indexes = [
+            models.Index(
+                fields=['available_at'], name='idx_photo_job_queued',
+                condition=models.Q(status='queued'),
+            ),
+        ]
+
+    def __str__(self):
+        return f"Photo job {self.job_id} ({self.status})"
+
+class CatalogIngestJob(models.Model):
+    """
+    Загрузка файла каталога, принятого /api/books/ingest/ (books.ingest,
+    команда ingest_worker). stats — счётчики CatalogIngestor; прогресс пачек
+    хранится в checkpoint рядом с input_path, так что забранная заново
+    задача продолжает с места остановки.
+    """
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    job_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    format = models.CharField(max_length=10)
+    input_path = models.CharField(max_length=500)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    stats = models.JSONField(default=dict, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    # После временной ошибки (БД, Google) задача ждёт повтора до этого момента
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'catalog_ingest_jobs'
+        indexes = [
+            models.Index(
+                fields=['available_at'], name='idx_ingest_job_queued',
+                condition=models.Q(status='queued'),
+            ),
+        ]
+
+    def __str__(self):
+        return f"Catalog ingest job {self.job_id} ({self.status})"
+
 class ExchangeRequest(models.Model):
     REQUEST_STATUS_CHOICES = (
         ('pending', 'Pending'),  # Запрос ожидает подтверждения
@@ -75,6 +301,20 @@ class ExchangeRequest(models.Model):
 
     class Meta:
         db_table = 'exchange_requests'
+        indexes = [
+            # Для курсорной пагинации списка обменов по created_at
+            models.Index(fields=['requester', '-created_at'], name='idx_exchange_requester_created'),
+            models.Index(fields=['owner', '-created_at'], name='idx_exchange_owner_created'),
+            # Входящие/исходящие с фильтром по статусу (?box=...&status=...)
+            models.Index(fields=['owner', 'status', '-created_at'], name='idx_exchange_owner_status'),
+            models.Index(fields=['requester', 'status', '-created_at'], name='idx_exchange_requester_status'),
+        ]
+        constraints = [
+            # Не больше одного открытого запроса на экземпляр (см. books.exchanges)
+            models.UniqueConstraint(
+                fields=['book'], condition=models.Q(status='pending'), name='uniq_exchange_open_per_book',
+            ),
+        ]
 
     def __str__(self):
         return f"Request for {self.book} by {self.requester.username}"
\ No newline at end of file
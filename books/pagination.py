@@ -0,0 +1,167 @@
+# books/pagination.py
+import base64
+import datetime
+import json
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f'Cannot encode {type(value).__name__} in cursor')
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по ключу (seek) без COUNT(*) и OFFSET: курсор хранит значения
+    полей сортировки последней строки страницы, следующая страница — это
+    WHERE (поля) после курсора. Стоимость страницы N равна стоимости первой.
+
+    Представление задаёт сортировку через get_keyset_ordering() или атрибут
+    keyset_ordering; последнее поле обязано быть уникальным (обычно pk).
+    Значения курсора приводятся to_python() поля (или output_field аннотации),
+    так что подделанный курсор даёт 404, а не ошибку базы.
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_ordering(self, view):
+        if hasattr(view, 'get_keyset_ordering'):
+            return tuple(view.get_keyset_ordering())
+        return tuple(view.keyset_ordering)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+        except (TypeError, ValueError, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def _ordering_field(self, queryset, name):
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        for field in queryset.model._meta.concrete_fields:
+            if name in (field.name, field.attname):
+                return field
+        raise FieldDoesNotExist(f'Cannot paginate by {name}: not a field of {queryset.model.__name__}')
+
+    def to_python(self, queryset, position):
+        values = []
+        for field_name, value in zip(self.ordering, position):
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                values.append(self._ordering_field(queryset, field_name.lstrip('-')).to_python(value))
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def encode_cursor(self, position):
+        payload = json.dumps(position, default=_json_default, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+    def _after_position(self, position):
+        # (a, b, c) > (x, y, z) с учётом направления каждого поля:
+        # a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        conditions = []
+        for index, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {f.lstrip('-'): value for f, value in zip(self.ordering[:index], position[:index])}
+            conditions.append(Q(**equal, **{f'{name}__{lookup}': position[index]}))
+        return reduce(or_, conditions)
+
+    def _page(self, queryset, position):
+        if position is not None:
+            queryset = queryset.filter(self._after_position(position))
+        return queryset.order_by(*self.ordering)[:self.page_size + 1]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(view)
+        position = self.decode_cursor(request)
+        if position is not None:
+            position = self.to_python(queryset, position)
+
+        results = list(self._page(queryset, position))
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+        self.next_position = None
+        if self.has_next:
+            last = results[-1]
+            # Страница может состоять из моделей или из dict'ов .values()
+            get = last.get if isinstance(last, dict) else lambda name: getattr(last, name)
+            self.next_position = [get(field.lstrip('-')) for field in self.ordering]
+        return results
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class OptionalKeysetPagination(PageNumberPagination):
+    """
+    PageNumberPagination по умолчанию; клиент включает курсорный режим
+    параметром ?pagination=cursor (ссылка next уже содержит его и cursor).
+    """
+    mode_query_param = 'pagination'
+    keyset_class = KeysetPagination
+
+    def use_keyset(self, request, view):
+        if view is None or not (hasattr(view, 'get_keyset_ordering') or hasattr(view, 'keyset_ordering')):
+            return False
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or self.keyset_class.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.use_keyset(request, view):
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_next_link(self):
+        if self.keyset is not None:
+            return self.keyset.get_next_link()
+        return super().get_next_link()
@@ -0,0 +1,262 @@
+# books/photo_jobs.py
+import logging
+import os
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from books.images import ImageProcessingError, render_variants
+from books.models import Photo, PhotoJob
+from books.photo_storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+
+def photo_folder(user_book_id):
+    return f"books/{user_book_id}"
+
+
+def spool_upload(upload):
+    """
+    Сохраняет загруженный файл на локальный диск по частям, не читая его
+    в память целиком.
+    """
+    spool_dir = settings.PHOTO_SPOOL_DIR
+    os.makedirs(spool_dir, exist_ok=True)
+    extension = os.path.splitext(upload.name or '')[1].lower()
+    path = os.path.join(spool_dir, f'{uuid.uuid4().hex}{extension}')
+    with open(path, 'wb') as f:
+        for chunk in upload.chunks():
+            f.write(chunk)
+    return path
+
+
+def enqueue_photo_upload(user_book, upload, photo=None):
+    """
+    Ставит загрузку в очередь: новое фото (photo=None) создаётся в статусе
+    pending, у существующего (замена файла) старый file_path остаётся
+    рабочим до успешной загрузки нового.
+    """
+    spool_path = spool_upload(upload)
+    try:
+        with transaction.atomic():
+            replaces_file_path = ''
+            if photo is None:
+                photo = Photo.objects.create(user_book_id=user_book, status='pending')
+            else:
+                replaces_file_path = photo.file_path
+                if photo.status == 'failed':
+                    photo.status = 'pending'
+                    photo.save(update_fields=['status'])
+            return PhotoJob.objects.create(
+                photo=photo, spool_path=spool_path, replaces_file_path=replaces_file_path,
+                available_at=timezone.now(),
+            )
+    except Exception:
+        os.remove(spool_path)
+        raise
+
+
+def claim_jobs(limit=1):
+    """
+    Забирает до limit задач. SKIP LOCKED позволяет запускать сколько угодно
+    воркеров без двойной обработки. Воркер продлевает аренду после каждого
+    шага (renew_lease); «running»-задача, чья аренда не продлевалась
+    PHOTO_JOB_LEASE_SECONDS (воркер умер), забирается заново, пока попыток
+    меньше PHOTO_JOB_MAX_ATTEMPTS, а после — помечается failed.
+    """
+    now = timezone.now()
+    lease_expired = now - timedelta(seconds=settings.PHOTO_JOB_LEASE_SECONDS)
+    _fail_abandoned(lease_expired)
+    with transaction.atomic():
+        jobs = list(
+            PhotoJob.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status='queued', available_at__lte=now)
+                | Q(status='running', locked_at__lt=lease_expired, attempts__lt=settings.PHOTO_JOB_MAX_ATTEMPTS)
+            )
+            .order_by('available_at')[:limit]
+        )
+        if jobs:
+            PhotoJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status='running', locked_at=now, attempts=F('attempts') + 1, updated_at=now,
+            )
+    for job in jobs:
+        job.status, job.locked_at, job.attempts = 'running', now, job.attempts + 1
+    return jobs
+
+
+def _fail_abandoned(lease_expired):
+    # Задача, на которой воркер падал PHOTO_JOB_MAX_ATTEMPTS раз, больше не забирается
+    with transaction.atomic():
+        jobs = list(
+            PhotoJob.objects.select_for_update(skip_locked=True).select_related('photo').filter(
+                status='running', locked_at__lt=lease_expired, attempts__gte=settings.PHOTO_JOB_MAX_ATTEMPTS,
+            )
+        )
+        for job in jobs:
+            _fail(job, f'Lease expired after {job.attempts} attempts', retry=False)
+
+
+def renew_lease(job):
+    job.locked_at = timezone.now()
+    PhotoJob.objects.filter(pk=job.pk, status='running').update(locked_at=job.locked_at)
+
+
+def retry_delay(attempts):
+    return min(settings.PHOTO_JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), 3600)
+
+
+def process_job(job, storage=None):
+    storage = storage or get_storage()
+    try:
+        photo = job.photo
+    except Photo.DoesNotExist:
+        # Фото удалили, пока задача ждала, — выгружать нечего
+        _remove_spool(job)
+        return False
+    folder = photo_folder(photo.user_book_id_id)
+
+    try:
+        rendered = render_variants(job.spool_path, os.path.dirname(job.spool_path))
+    except ImageProcessingError as e:
+        # Битый файл не станет лучше от повтора
+        _fail(job, e, retry=False)
+        return False
+    renew_lease(job)
+
+    uploaded = {}
+    try:
+        for size, variant in rendered.items():
+            uploaded[size] = {
+                'url': storage.save(variant['path'], folder),
+                'width': variant['width'],
+                'height': variant['height'],
+            }
+            renew_lease(job)
+    except Exception as e:
+        _delete_files(storage, [variant['url'] for variant in uploaded.values()], folder)
+        _fail(job, e)
+        return False
+    finally:
+        for variant in rendered.values():
+            remove_spool_file(variant['path'])
+
+    replaced = []
+    with transaction.atomic():
+        # Блокировка строки фото разводит нас с delete_photo: либо фото удалят уже
+        # с новыми вариантами, либо мы увидим, что его нет, и уберём свои файлы
+        photo = Photo.objects.select_for_update().filter(pk=photo.pk).first()
+        if photo is not None:
+            if job.replaces_file_path:
+                replaced = [job.replaces_file_path, *photo_files(photo)]
+            photo.file_path = uploaded['full']['url']
+            photo.variants = uploaded
+            photo.status = 'ready'
+            photo.save(update_fields=['file_path', 'variants', 'status'])
+            job.status = 'done'
+            job.last_error = ''
+            job.save(update_fields=['status', 'last_error', 'updated_at'])
+
+    if photo is None:
+        logger.info('Photo for job %s was deleted during upload, removing uploaded variants', job.pk)
+        replaced = [variant['url'] for variant in uploaded.values()]
+    _delete_files(storage, replaced, folder)
+    _remove_spool(job)
+    return photo is not None
+
+
+def photo_files(photo):
+    """
+    Все файлы фото в хранилище: file_path и варианты (full обычно совпадает с file_path).
+    """
+    return [path for path in [photo.file_path, *(variant['url'] for variant in photo.variants.values())] if path]
+
+
+def delete_photo(photo, storage=None):
+    """
+    Удаляет фото и все его варианты из хранилища. Если воркер как раз
+    сохраняет новые варианты, удаление дождётся его коммита и уберёт уже их;
+    если он не успел — воркер сам удалит выгруженное (см. process_job).
+    """
+    storage = storage or get_storage()
+    with transaction.atomic():
+        photo = Photo.objects.select_for_update().filter(pk=photo.pk).first()
+        if photo is None:
+            return False
+        files = photo_files(photo)
+        photo.delete()
+    _delete_files(storage, files, photo_folder(photo.user_book_id_id))
+    return True
+
+
+def _delete_files(storage, file_paths, folder):
+    for file_path in dict.fromkeys(file_paths):
+        try:
+            storage.delete(file_path, folder)
+        except Exception:
+            logger.warning('Failed to delete photo file %s', file_path, exc_info=True)
+
+
+def _fail(job, error, retry=True):
+    job.last_error = str(error)
+    if retry and job.attempts < settings.PHOTO_JOB_MAX_ATTEMPTS:
+        delay = retry_delay(job.attempts)
+        logger.warning('Photo job %s failed (attempt %s), retrying in %ss: %s', job.pk, job.attempts, delay, error)
+        job.status = 'queued'
+        job.available_at = timezone.now() + timedelta(seconds=delay)
+        job.save(update_fields=['status', 'available_at', 'last_error', 'updated_at'])
+        return
+
+    logger.error('Photo job %s failed permanently: %s', job.pk, error)
+    with transaction.atomic():
+        job.status = 'failed'
+        job.save(update_fields=['status', 'last_error', 'updated_at'])
+        photo = job.photo
+        # Неудачная замена не портит фото: прежний файл остаётся
+        if not job.replaces_file_path:
+            photo.status = 'failed'
+            photo.save(update_fields=['status'])
+    _remove_spool(job)
+
+
+def remove_spool_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _remove_spool(job):
+    remove_spool_file(job.spool_path)
+
+
+def run_worker(batch_size=1, poll_interval=1.0, once=False, storage=None, stop=None):
+    """
+    Цикл воркера: забрать задачи, выгрузить, повторить. once=True — обработать
+    то, что есть сейчас, и выйти. Возвращает число обработанных задач.
+    """
+    processed = 0
+    while not (stop and stop()):
+        jobs = claim_jobs(batch_size)
+        for job in jobs:
+            try:
+                process_job(job, storage=storage)
+            except Exception as e:
+                # Ошибка в самом воркере: задача не должна ронять его снова и снова
+                logger.exception('Photo job %s crashed', job.pk)
+                try:
+                    _fail(job, e, retry=False)
+                except Exception:
+                    logger.exception('Failed to mark photo job %s as failed', job.pk)
+            processed += 1
+        if not jobs:
+            if once:
+                break
+            time.sleep(poll_interval)
+    return processed
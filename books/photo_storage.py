@@ -0,0 +1,78 @@
+# books/photo_storage.py
+import os
+import threading
+import uuid
+
+import cloudinary.uploader
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.module_loading import import_string
+
+from books.metrics import track_upstream
+
+
+class PhotoStorage:
+    """
+    Куда воркер выгружает фото. save() возвращает публичный URL,
+    delete() принимает его же.
+    """
+
+    def save(self, path, folder):
+        raise NotImplementedError
+
+    def delete(self, file_path, folder):
+        raise NotImplementedError
+
+
+class CloudinaryPhotoStorage(PhotoStorage):
+    def save(self, path, folder):
+        with track_upstream('cloudinary', 'upload'):
+            upload_result = cloudinary.uploader.upload(path, folder=folder, resource_type="image")
+        return upload_result['secure_url']
+
+    def delete(self, file_path, folder):
+        public_id = file_path.split('/')[-1].split('.')[0]
+        with track_upstream('cloudinary', 'destroy'):
+            cloudinary.uploader.destroy(f"{folder}/{public_id}", resource_type="image")
+
+
+class LocalPhotoStorage(PhotoStorage):
+    """
+    Замена Cloudinary для разработки и тестов: файлы в MEDIA_ROOT (или location).
+    """
+
+    def __init__(self, location=None, base_url=None):
+        self.storage = FileSystemStorage(location=location, base_url=base_url)
+
+    def save(self, path, folder):
+        extension = os.path.splitext(path)[1].lower()
+        with open(path, 'rb') as f:
+            name = self.storage.save(f'{folder}/{uuid.uuid4().hex}{extension}', File(f))
+        return self.storage.url(name)
+
+    def delete(self, file_path, folder):
+        name = f"{folder}/{file_path.rsplit('/', 1)[-1]}"
+        self.storage.delete(name)
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                backend = import_string(
+                    getattr(settings, 'PHOTO_STORAGE_BACKEND', 'books.photo_storage.CloudinaryPhotoStorage')
+                )
+                _storage = backend(**getattr(settings, 'PHOTO_STORAGE_OPTIONS', {}))
+    return _storage
+
+
+def reset_storage():
+    global _storage
+    with _storage_lock:
+        _storage = None
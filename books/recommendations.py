@@ -0,0 +1,322 @@
+# books/recommendations.py
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.contrib.postgres.fields import ArrayField
+from django.db.models import Exists, F, Func, IntegerField, OuterRef, Value
+from django.utils import timezone
+from psycopg2.extras import execute_values
+from scipy import sparse
+
+from books.models import BookRecommendation, ExchangeRequest, UserBook, UserRecommendation
+
+# Популярность (log числа запросов) лишь разводит книги с одинаковым сходством
+POPULARITY_WEIGHT = 0.01
+# Размер плотного блока оценок (строк × книг) за один шаг: ~32 МБ float32
+BLOCK_CELLS = 8_000_000
+WRITE_BATCH_SIZE = 1000
+
+_KTH_SCORES_SQL = """
+    SELECT {key}, coalesce(array_length(scores, 1), 0), coalesce(scores[array_length(scores, 1)], 0),
+           stale_at IS NOT NULL
+    FROM {table}
+"""
+
+
+_UPSERT_SQL = """
+    INSERT INTO {table} ({key}, book_ids, scores, updated_at) VALUES %s
+    ON CONFLICT ({key}) DO UPDATE SET
+        book_ids = EXCLUDED.book_ids,
+        scores = EXCLUDED.scores,
+        updated_at = EXCLUDED.updated_at
+"""
+
+
+def _fetch(sql, columns):
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        rows = cursor.fetchall()
+    return np.array(rows, dtype=np.int64).reshape(-1, columns)
+
+
+def _indicator(rows, cols, shape):
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=shape)
+    matrix.data[:] = 1  # повторные запросы той же книги связь не усиливают
+    return matrix
+
+
+def _normalize_rows(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1), dtype=np.float32).ravel())
+    norms[norms == 0] = 1
+    return sparse.csr_matrix(sparse.diags(1 / norms) @ matrix, dtype=np.float32)
+
+
+class RecommendationData:
+    """
+    Матрицы для сборки, всё индексируется позицией книги в book_ids:
+    features — строки книг: нормированные жанры и нормированные «кто
+    запрашивал» с весами, так что features @ features.T — взвешенная сумма
+    косинусных сходств; interactions — пользователи × книги (запросы и полка);
+    profiles — нормированные суммы features книг пользователя.
+    """
+
+    def __init__(self, genre_weight=None):
+        genre_weight = settings.RECOMMENDATIONS_GENRE_WEIGHT if genre_weight is None else genre_weight
+        self.book_ids = _fetch('SELECT book_id FROM books ORDER BY book_id', 1).ravel()
+        genre_links = _fetch('SELECT book_id, genre_id FROM books_genres', 2)
+        requests = _fetch(
+            'SELECT er.requester_id, ub.book_id_id FROM exchange_requests er '
+            'JOIN user_books ub ON ub.user_book_id = er.book_id', 2
+        )
+        owned = _fetch('SELECT user_id, book_id_id FROM user_books', 2)
+        n_books = len(self.book_ids)
+
+        genre_ids, genre_cols = np.unique(genre_links[:, 1], return_inverse=True)
+        genres = _indicator(self.positions(genre_links[:, 0]), genre_cols, (n_books, len(genre_ids)))
+        requester_ids, requester_cols = np.unique(requests[:, 0], return_inverse=True)
+        requested_rows = self.positions(requests[:, 1])
+        co_requests = _indicator(requested_rows, requester_cols, (n_books, len(requester_ids)))
+        self.features = sparse.hstack([
+            np.sqrt(genre_weight) * _normalize_rows(genres),
+            np.sqrt(1 - genre_weight) * _normalize_rows(co_requests),
+        ], format='csr', dtype=np.float32)
+        self.features_t = self.features.T.tocsr()
+
+        popularity = np.log1p(np.bincount(requested_rows, minlength=n_books)).astype(np.float32)
+        self.popularity = popularity / popularity.max() if n_books and popularity.max() > 0 else popularity
+
+        interactions = np.vstack([requests, owned])
+        self.user_ids, user_rows = np.unique(interactions[:, 0], return_inverse=True)
+        self.interactions = _indicator(
+            user_rows, self.positions(interactions[:, 1]), (len(self.user_ids), n_books)
+        )
+        self.profiles = _normalize_rows(self.interactions @ self.features)
+
+    def positions(self, book_ids):
+        return np.searchsorted(self.book_ids, book_ids)
+
+    def rank(self, rows, row_positions, top_k, exclude_self=False, exclude=None):
+        """
+        Для строк rows[row_positions] (книги или профили пользователей) —
+        топ-K книг по rows @ features.T. Считается блоками по BLOCK_CELLS,
+        топ-K — argpartition по всему блоку сразу. exclude — матрица
+        «строка × книга», отмеченные книги не рекомендуются.
+        Возвращает [(position, book_ids, scores)].
+        """
+        n_books = len(self.book_ids)
+        block_rows = max(1, BLOCK_CELLS // max(n_books, 1))
+        top_k = min(top_k, n_books)
+        results = []
+        for start in range(0, len(row_positions), block_rows):
+            positions = row_positions[start:start + block_rows]
+            scores = (rows[positions] @ self.features_t).toarray()
+            matched = scores > 0
+            scores += POPULARITY_WEIGHT * self.popularity
+            scores[~matched] = -np.inf
+            if exclude_self:
+                scores[np.arange(len(positions)), positions] = -np.inf
+            if exclude is not None:
+                scores[exclude[positions].nonzero()] = -np.inf
+            if top_k == 0:
+                results.extend((position, [], []) for position in positions)
+                continue
+            best = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            order = np.argsort(-best_scores, axis=1, kind='stable')
+            best = np.take_along_axis(best, order, axis=1)
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+            for position, row_best, row_scores in zip(positions, best, best_scores):
+                found = np.isfinite(row_scores)
+                results.append((
+                    position,
+                    self.book_ids[row_best[found]].tolist(),
+                    np.round(row_scores[found], 6).tolist(),
+                ))
+        return results
+
+    def reached_by(self, rows, book_positions, kth_scores):
+        """
+        Строки rows, в чей топ-K могут войти книги book_positions: их оценка
+        хотя бы с одной из книг не ниже текущей K-й оценки строки.
+        """
+        if not len(book_positions):
+            return np.array([], dtype=np.int64)
+        scores = (rows @ self.features[book_positions].T).tocsr()
+        scores.data += POPULARITY_WEIGHT * self.popularity[book_positions][scores.indices]
+        best = scores.max(axis=1).toarray().ravel()
+        return np.flatnonzero((best > 0) & (best >= kth_scores))
+
+
+def _kth_scores(model, key, ids, top_k):
+    """
+    K-я (худшая) оценка сохранённого топа для каждого из ids (у кого в топе
+    меньше K книг, туда попадёт любая подходящая: -inf), есть ли строка
+    вообще и id строк со stale_at.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(_KTH_SCORES_SQL.format(key=key, table=model._meta.db_table))
+        rows = cursor.fetchall()
+    row_ids, lengths, last_scores, stale = (
+        np.array(column) for column in (zip(*rows) if rows else ([], [], [], []))
+    )
+    row_ids = row_ids.astype(np.int64)
+    positions = np.searchsorted(ids, row_ids)
+    indexed = positions < len(ids)
+    indexed[indexed] = ids[positions[indexed]] == row_ids[indexed]
+
+    kth = np.full(len(ids), -np.inf, dtype=np.float32)
+    known = np.zeros(len(ids), dtype=bool)
+    known[positions[indexed]] = True
+    filled = indexed & (lengths >= top_k)
+    kth[positions[filled]] = last_scores[filled]
+    return kth, known, row_ids[stale.astype(bool)]
+
+
+def _listing(model, book_ids):
+    # Строки, в чьём топе есть хоть одна из book_ids (оператор && по массиву)
+    return np.array(
+        list(model.objects.filter(book_ids__overlap=book_ids).values_list('pk', flat=True)), dtype=np.int64
+    )
+
+
+def _plan_books(data, top_k):
+    """
+    Изменившиеся книги (без строки или со stale_at) и все книги, которые
+    нужно пересчитать из-за них.
+    """
+    kth, known, stale_ids = _kth_scores(BookRecommendation, 'book_id', data.book_ids, top_k)
+    dirty = np.union1d(np.flatnonzero(~known), data.positions(stale_ids)).astype(np.int64)
+    positions = np.union1d(dirty, data.reached_by(data.features, dirty, kth))
+    positions = np.union1d(positions, data.positions(_listing(BookRecommendation, data.book_ids[dirty].tolist())))
+    return dirty, positions.astype(np.int64)
+
+
+def _plan_users(data, dirty, top_k):
+    """
+    Позиции пользователей для пересчёта и id тех, у кого взаимодействий
+    больше нет (их топ очищается).
+    """
+    kth, known, stale_ids = _kth_scores(UserRecommendation, 'user_id', data.user_ids, top_k)
+    listed_ids = _listing(UserRecommendation, data.book_ids[dirty].tolist())
+    ids = np.union1d(stale_ids, listed_ids)
+    indexed = np.isin(ids, data.user_ids)
+    positions = np.union1d(np.flatnonzero(~known), np.searchsorted(data.user_ids, ids[indexed]))
+    # Профиль — сумма признаков книг пользователя: поменялась книга — поменялся профиль
+    positions = np.union1d(positions, data.interactions[:, dirty].nonzero()[0])
+    positions = np.union1d(positions, data.reached_by(data.profiles, dirty, kth))
+    return positions.astype(np.int64), ids[~indexed].tolist()
+
+
+def _array(values):
+    # Литерал массива Postgres строкой: psycopg2 адаптирует списки чисел поэлементно и заметно медленнее
+    return '{' + ','.join(map(str, values)) + '}'
+
+
+def _save(model, results, started):
+    """
+    Upsert топов пачками по WRITE_BATCH_SIZE строк одним INSERT ... ON CONFLICT.
+    stale_at сбрасывается, только если отметка поставлена до начала сборки:
+    изменения во время сборки не теряются.
+    """
+    sql = _UPSERT_SQL.format(table=model._meta.db_table, key=model._meta.pk.column)
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        for start in range(0, len(results), WRITE_BATCH_SIZE):
+            batch = results[start:start + WRITE_BATCH_SIZE]
+            execute_values(
+                cursor, sql, [(pk, _array(book_ids), _array(scores), now) for pk, book_ids, scores in batch],
+                template='(%s, %s::integer[], %s::double precision[], %s)', page_size=WRITE_BATCH_SIZE,
+            )
+        # Отметки, поставленные до начала сборки, этой сборкой учтены
+        model.objects.filter(pk__in=[pk for pk, _, _ in results], stale_at__lte=started).update(stale_at=None)
+
+
+def build(full=False, top_k=None, genre_weight=None):
+    """
+    Пересчитывает рекомендации. Инкрементально (по умолчанию) — только
+    затронутые строки: книги без топа или со stale_at, книги, у которых
+    изменившаяся книга в топе или может в него войти; так же для
+    пользователей, плюс все, кто взаимодействовал с изменившимися книгами.
+    Возвращает статистику сборки (число строк и время этапов).
+    """
+    top_k = top_k or settings.RECOMMENDATIONS_TOP_K
+    started = timezone.now()
+    stats = {}
+    timer = time.perf_counter()
+    data = RecommendationData(genre_weight)
+    stats['load_s'] = round(time.perf_counter() - timer, 3)
+    full = full or not BookRecommendation.objects.exists()
+
+    timer = time.perf_counter()
+    if full:
+        book_positions = np.arange(len(data.book_ids))
+        user_positions, cleared_users = np.arange(len(data.user_ids)), []
+    else:
+        dirty, book_positions = _plan_books(data, top_k)
+        user_positions, cleared_users = _plan_users(data, dirty, top_k)
+    stats['plan_s'] = round(time.perf_counter() - timer, 3)
+
+    timer = time.perf_counter()
+    book_results = data.rank(data.features, book_positions, top_k, exclude_self=True)
+    _save(BookRecommendation, [(data.book_ids[p].item(), ids, scores) for p, ids, scores in book_results], started)
+    stats['books_s'] = round(time.perf_counter() - timer, 3)
+
+    timer = time.perf_counter()
+    user_results = data.rank(data.profiles, user_positions, top_k, exclude=data.interactions)
+    _save(
+        UserRecommendation,
+        [(data.user_ids[p].item(), ids, scores) for p, ids, scores in user_results]
+        + [(user_id, [], []) for user_id in cleared_users],
+        started,
+    )
+    if full:
+        # Топы тех, у кого не осталось ни книг, ни запросов
+        UserRecommendation.objects.exclude(
+            Exists(UserBook.objects.filter(user=OuterRef('pk')))
+            | Exists(ExchangeRequest.objects.filter(requester=OuterRef('pk')))
+        ).delete()
+    stats['users_s'] = round(time.perf_counter() - timer, 3)
+
+    stats.update({
+        'full': full,
+        'books': len(data.book_ids),
+        'users': len(data.user_ids),
+        'book_rows': len(book_results),
+        'user_rows': len(user_results) + len(cleared_users),
+    })
+    return stats
+
+
+def mark_books_stale(book_ids=None, user_book_ids=None):
+    # Строк ещё нет — книга и так попадёт в ближайшую инкрементальную сборку
+    queryset = BookRecommendation.objects.all()
+    if book_ids is not None:
+        queryset = queryset.filter(book_id__in=list(book_ids))
+    if user_book_ids is not None:
+        queryset = queryset.filter(book__userbook__user_book_id__in=list(user_book_ids))
+    queryset.update(stale_at=timezone.now())
+
+
+def mark_users_stale(user_ids):
+    UserRecommendation.objects.filter(user_id__in=list(user_ids)).update(stale_at=timezone.now())
+
+
+def mark_exchange_requested(user_book_id, requester_id):
+    # Новый запрос меняет совместные запросы книги и профиль запросившего
+    mark_books_stale(user_book_ids=[user_book_id])
+    mark_users_stale([requester_id])
+
+
+def available_copies(book_ids, user):
+    """
+    Доступные чужие экземпляры книг book_ids в порядке списка (array_position).
+    """
+    rank = Func(
+        Value(list(book_ids), output_field=ArrayField(IntegerField())), F('book_id'),
+        function='array_position', output_field=IntegerField(),
+    )
+    return UserBook.objects.filter(book_id__in=book_ids, status='available').exclude(user=user).annotate(
+        recommendation_rank=rank
+    ).order_by('recommendation_rank', 'user_book_id')
@@ -0,0 +1,148 @@
+# books/response_cache.py
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from books.metrics import record_cache
+
+TAG_PREFIX = 'response_cache:tag:'
+ENTRY_PREFIX = 'response_cache:entry:'
+STATS_PREFIX = 'response_cache:stats:'
+STATS = ('hits', 'misses', 'invalidations')
+
+# Теги, от которых зависят закэшированные ответы. Изменения строк, уже
+# попавших в ответ, сбрасывают теги этих строк (user_book_tag, book_tag);
+# глобальные теги — только то, что может добавить в ответ новые строки
+TAG_USER_BOOKS = 'user_books'  # появился доступный экземпляр (новый, освободившийся, сменил книгу)
+TAG_USER_BOOK_COUNTS = 'user_books:counts'  # любой экземпляр создан, удалён или сменил статус — count, фасеты
+TAG_BOOKS = 'books'  # названия/авторы/жанры книг, у которых есть экземпляры
+
+
+def user_tag(user_id):
+    return f'user:{user_id}'
+
+
+def user_book_tag(user_book_id):
+    return f'user_book:{user_book_id}'
+
+
+def book_tag(book_id):
+    return f'book:{book_id}'
+
+
+class TaggedCache:
+    """
+    Кэш с инвалидацией по тегам поверх django-redis. У каждого тега есть
+    версия в Redis; запись хранит версии своих тегов на момент вычисления и
+    считается устаревшей, как только хоть одна из них изменилась. Сброс тега —
+    один INCR, перебирать и удалять записи не нужно: устаревшие вытеснятся
+    по TTL.
+
+    Если ключ тега пропал из Redis (вытеснение), версия создаётся заново из
+    time_ns, а не с нуля, — старые записи не могут случайно совпасть с ней.
+    """
+
+    def __init__(self, alias='default', timeout=None):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_timeout(self):
+        if self.timeout is not None:
+            return self.timeout
+        return getattr(settings, 'RESPONSE_CACHE_TTL', 6 * 3600)
+
+    def versions(self, tags):
+        tags = list(dict.fromkeys(tags))
+        if not tags:
+            return {}
+        keys = {f'{TAG_PREFIX}{tag}': tag for tag in tags}
+        found = self.cache.get_many(list(keys))
+        versions = {keys[key]: version for key, version in found.items()}
+        for key, tag in keys.items():
+            if tag not in versions:
+                self.cache.add(key, time.time_ns(), timeout=None)
+                versions[tag] = self.cache.get(key)
+        return versions
+
+    def make_key(self, *parts):
+        digest = hashlib.sha256('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+        return f'{ENTRY_PREFIX}{digest}'
+
+    def get(self, key):
+        entry = self.cache.get(key)
+        if entry is not None:
+            versions = entry['versions']
+            if self.versions(versions) == versions:
+                self._incr_stat('hits')
+                record_cache('response', hits=1)
+                return entry['value']
+        self._incr_stat('misses')
+        record_cache('response', misses=1)
+        return None
+
+    def set(self, key, value, versions, timeout=None):
+        """
+        versions — результат versions(), прочитанный ДО вычисления value:
+        если тег сбросят, пока ответ считается, запись сразу будет устаревшей.
+        """
+        self.cache.set(
+            key, {'versions': dict(versions), 'value': value},
+            timeout=self.get_timeout() if timeout is None else timeout,
+        )
+
+    def invalidate(self, *tags):
+        tags = list(dict.fromkeys(tags))
+        for tag in tags:
+            self._incr(f'{TAG_PREFIX}{tag}', default=time.time_ns())
+        if tags:
+            self._incr_stat('invalidations', len(tags))
+
+    def stats(self):
+        found = self.cache.get_many([f'{STATS_PREFIX}{name}' for name in STATS])
+        stats = {name: found.get(f'{STATS_PREFIX}{name}', 0) for name in STATS}
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def reset_stats(self):
+        self.cache.delete_many([f'{STATS_PREFIX}{name}' for name in STATS])
+
+    def _incr_stat(self, name, delta=1):
+        self._incr(f'{STATS_PREFIX}{name}', delta=delta, default=0)
+
+    def _incr(self, key, delta=1, default=0):
+        try:
+            self.cache.incr(key, delta)
+        except ValueError:
+            if not self.cache.add(key, default + delta, timeout=None):
+                self.cache.incr(key, delta)
+
+
+response_cache = TaggedCache()
+
+
+def user_book_result_tags(rows):
+    """
+    Теги строк в форме UserBookSerializer/UserBookListingSerializer.
+    """
+    tags = []
+    for row in rows:
+        tags.append(user_book_tag(row['user_book_id']))
+        tags.append(book_tag(row['book']['book_id']))
+    return tags
+
+
+def invalidate_on_commit(*tags):
+    """
+    Сброс после коммита: иначе параллельный запрос успеет закэшировать
+    ещё не закоммиченное состояние под новой версией тега.
+    """
+    if tags:
+        transaction.on_commit(lambda: response_cache.invalidate(*tags))
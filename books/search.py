@@ -0,0 +1,240 @@
+# books/search.py
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import Exists, F, FloatField, OuterRef, Q, Value
+from django.db.models.functions import Cast, Coalesce
+
+from books.models import Book, Genre, UserBook, UserBookListing
+
+SEARCH_MODE_BASIC = 'basic'
+SEARCH_MODE_FULLTEXT = 'fulltext'
+SEARCH_MODES = (SEARCH_MODE_BASIC, SEARCH_MODE_FULLTEXT)
+DEFAULT_ORDERING = ('user_book_id',)
+FULLTEXT_ORDERING = ('-rank', '-similarity', 'user_book_id')
+
+# Веса: название важнее автора, автор важнее жанров, описание — наименее важно
+_UPDATE_SEARCH_VECTOR_SQL = """
+    UPDATE {books} AS b
+    SET search_vector =
+        setweight(to_tsvector(%(config)s::regconfig, coalesce(b.name, '')), 'A') ||
+        setweight(to_tsvector(%(config)s::regconfig, coalesce(b.author, '')), 'B') ||
+        setweight(to_tsvector(%(config)s::regconfig, coalesce(g.names, '')), 'C') ||
+        setweight(to_tsvector(%(config)s::regconfig, coalesce(b.overview, '')), 'D')
+    FROM (
+        SELECT bk.{book_pk} AS book_pk, string_agg(gn.name, ' ') AS names
+        FROM {books} bk
+        LEFT JOIN {through} bg ON bg.{through_book} = bk.{book_pk}
+        LEFT JOIN {genres} gn ON gn.id = bg.{through_genre}
+        {where}
+        GROUP BY bk.{book_pk}
+    ) AS g
+    WHERE b.{book_pk} = g.book_pk
+"""
+
+
+def search_config():
+    return getattr(settings, 'BOOK_SEARCH_CONFIG', 'simple')
+
+
+def _update_sql(where=''):
+    through = Book.genres.through
+    return _UPDATE_SEARCH_VECTOR_SQL.format(
+        books=connection.ops.quote_name(Book._meta.db_table),
+        book_pk=Book._meta.pk.column,
+        through=connection.ops.quote_name(through._meta.db_table),
+        through_book=through._meta.get_field('book').column,
+        through_genre=through._meta.get_field('genre').column,
+        genres=connection.ops.quote_name(Genre._meta.db_table),
+        where=where,
+    )
+
+
+def update_search_vectors(book_ids=None):
+    """
+    Пересчитывает search_vector одним UPDATE. Без book_ids — для всего каталога.
+    """
+    params = {'config': search_config()}
+    if book_ids is None:
+        sql = _update_sql()
+    else:
+        book_ids = list(book_ids)
+        if not book_ids:
+            return 0
+        sql = _update_sql(where=f'WHERE bk.{Book._meta.pk.column} = ANY(%(book_ids)s)')
+        params['book_ids'] = book_ids
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def parse_genres(genres):
+    return [genre.strip() for genre in genres.split(',') if genre.strip()] if genres else []
+
+
+def basic_search(query='', genres='', author=''):
+    """
+    Исходный поиск через icontains (теперь его ускоряют trigram GIN индексы).
+    """
+    books = Book.objects.all()
+
+    if query:
+        books = books.filter(name__icontains=query)
+
+    genre_list = parse_genres(genres)
+    if genre_list:
+        books = books.filter(genres__name__in=genre_list).distinct()
+
+    if author:
+        books = books.filter(author__icontains=author)
+
+    if not books.exists():
+        return UserBook.objects.none()
+
+    return UserBook.objects.filter(
+        book_id__in=books,
+        status='available'
+    )
+
+
+def listing_search(query='', genres='', author=''):
+    """
+    Базовый поиск по витрине user_book_listings: один запрос без join'ов.
+    """
+    listings = UserBookListing.objects.filter(status='available')
+    if query:
+        listings = listings.filter(book_name__icontains=query)
+    genre_list = parse_genres(genres)
+    if genre_list:
+        listings = listings.filter(genres__overlap=genre_list)
+    if author:
+        listings = listings.filter(book_author__icontains=author)
+    return listings.order_by(*DEFAULT_ORDERING)
+
+
+def fulltext_search(query='', genres='', author=''):
+    """
+    Ранжированный поиск: совпадение по search_vector или по триграммам слов
+    названия (оператор <%, порог pg_trgm.word_similarity_threshold — ловит
+    опечатки), сортировка по SearchRank, затем по word_similarity.
+    """
+    user_books = UserBook.objects.filter(status='available')
+
+    if query:
+        search_query = SearchQuery(query, config=search_config(), search_type='websearch')
+        user_books = user_books.filter(
+            Q(book_id__search_vector=search_query) | Q(book_id__name__trigram_word_similar=query)
+        ).annotate(
+            # ts_rank/similarity возвращают real; double нужен, чтобы значение
+            # из курсора keyset-пагинации сравнивалось в SQL без потери точности.
+            # Книга без search_vector находится только по триграммам — ранг 0, а не NULL
+            rank=Coalesce(
+                Cast(SearchRank(F('book_id__search_vector'), search_query), FloatField()), Value(0.0),
+                output_field=FloatField(),
+            ),
+            similarity=Cast(TrigramWordSimilarity(query, 'book_id__name'), FloatField()),
+        )
+        ordering = FULLTEXT_ORDERING
+    else:
+        ordering = DEFAULT_ORDERING
+
+    genre_list = parse_genres(genres)
+    if genre_list:
+        # Подзапрос вместо JOIN, чтобы не плодить дубликаты строк и не делать distinct()
+        user_books = user_books.filter(
+            book_id__in=Book.genres.through.objects.filter(
+                genre__name__in=genre_list
+            ).values('book_id')
+        )
+
+    if author:
+        user_books = user_books.filter(book_id__author__icontains=author)
+
+    return user_books.order_by(*ordering)
+
+
+def search_ordering(query='', mode=SEARCH_MODE_BASIC):
+    if mode == SEARCH_MODE_FULLTEXT and query:
+        return FULLTEXT_ORDERING
+    return DEFAULT_ORDERING
+
+
+def search_user_books(query='', genres='', author='', mode=SEARCH_MODE_BASIC):
+    if mode == SEARCH_MODE_FULLTEXT:
+        return fulltext_search(query, genres, author)
+    return basic_search(query, genres, author)
+
+
+# Бакеты всех фасетов одним запросом. Фасет жанров считается без фильтра по
+# жанрам (видно, сколько даст выбор другого жанра), фасет статусов — без
+# фильтра status = 'available'; авторы — со всеми фильтрами, как выдача.
+_FACETS_SQL = """
+    WITH matched AS ({matched})
+    SELECT facet, value, count, total_buckets FROM (
+        SELECT facet, value, count,
+               row_number() OVER (PARTITION BY facet ORDER BY count DESC, value) AS position,
+               count(*) OVER (PARTITION BY facet) AS total_buckets
+        FROM (
+            SELECT 'genres' AS facet, g.name AS value, count(*) AS count
+            FROM matched m
+            JOIN books_genres bg ON bg.book_id = m.facet_book
+            JOIN books_genre g ON g.id = bg.genre_id
+            WHERE m.facet_status = 'available'
+            GROUP BY g.name
+            UNION ALL
+            SELECT 'authors', m.facet_author, count(*)
+            FROM matched m
+            WHERE m.facet_status = 'available' AND m.in_genres
+            GROUP BY m.facet_author
+            UNION ALL
+            SELECT 'status', m.facet_status, count(*)
+            FROM matched m
+            WHERE m.in_genres
+            GROUP BY m.facet_status
+        ) AS buckets
+    ) AS ranked
+    WHERE position <= %s
+    ORDER BY facet, position
+"""
+FACETS = ('genres', 'authors', 'status')
+
+
+def _facet_matches(query='', genres='', author='', mode=SEARCH_MODE_BASIC):
+    """
+    Экземпляры, подходящие под query и author (любого статуса), и признак
+    in_genres — подходит ли книга под фильтр жанров.
+    """
+    user_books = UserBook.objects.all()
+    if query:
+        if mode == SEARCH_MODE_FULLTEXT:
+            search_query = SearchQuery(query, config=search_config(), search_type='websearch')
+            user_books = user_books.filter(
+                Q(book_id__search_vector=search_query) | Q(book_id__name__trigram_word_similar=query)
+            )
+        else:
+            user_books = user_books.filter(book_id__name__icontains=query)
+    if author:
+        user_books = user_books.filter(book_id__author__icontains=author)
+
+    genre_list = parse_genres(genres)
+    in_genres = Exists(
+        Book.genres.through.objects.filter(book_id=OuterRef('book_id'), genre__name__in=genre_list)
+    ) if genre_list else Value(True)
+    return user_books.annotate(
+        facet_book=F('book_id'), facet_author=F('book_id__author'), facet_status=F('status'), in_genres=in_genres,
+    ).values('facet_book', 'facet_author', 'facet_status', 'in_genres')
+
+
+def search_facets(query='', genres='', author='', mode=SEARCH_MODE_BASIC, limit=10):
+    """
+    {'genres'|'authors'|'status': {'buckets': [{'value', 'count'}], 'total_buckets'}}
+    — не больше limit бакетов на фасет, самые большие первыми. Один запрос.
+    """
+    matched_sql, params = _facet_matches(query, genres, author, mode).query.sql_with_params()
+    facets = {facet: {'buckets': [], 'total_buckets': 0} for facet in FACETS}
+    with connection.cursor() as cursor:
+        cursor.execute(_FACETS_SQL.format(matched=matched_sql), (*params, limit))
+        for facet, value, count, total_buckets in cursor.fetchall():
+            facets[facet]['buckets'].append({'value': value, 'count': count})
+            facets[facet]['total_buckets'] = total_buckets
+    return facets
@@ -1,6 +1,10 @@
 # books/serializers.py
+from collections import defaultdict
+
 from rest_framework import serializers
-from books.models import Book, UserBook, Photo, ExchangeRequest
+from books.genres import genre_dictionary, normalize_genre_names
+from books.geo import parse_location
+from books.models import Book, UserBook, UserBookListing, Photo, PhotoJob, ExchangeRequest
 from accounts.models import User
 
 class BookSuggestionSerializer(serializers.Serializer):
@@ -31,22 +35,26 @@ class BookCreateSerializer(serializers.ModelSerializer):
         return super().to_internal_value(data)
 
     def normalize_genres(self, genres_list):
-        normalized = []
-        seen = set()
-        for genre in genres_list:
-            if isinstance(genre, str):
-                parts = [part.strip() for part in genre.split('/') if part.strip()]
-                for part in parts:
-                    if part and part not in seen:
-                        seen.add(part)
-                        normalized.append(part)
-        return ', '.join(normalized) if normalized else ''
+        return ', '.join(normalize_genre_names(genres_list))
+
+    def create(self, validated_data):
+        genres = validated_data.pop('genres', '')
+        book = Book.objects.create(**validated_data)
+        genre_dictionary.set_book_genres(book, normalize_genre_names(genres))
+        return book
+
+    def update(self, instance, validated_data):
+        genres = validated_data.pop('genres', None)
+        instance = super().update(instance, validated_data)
+        if genres is not None:
+            genre_dictionary.set_book_genres(instance, normalize_genre_names(genres))
+        return instance
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        # Возвращаем жанры как список
-        genres = instance.genres.values_list('name', flat=True)
-        representation['genres'] = list(genres) if genres else ['Unknown']
+        # Возвращаем жанры как список; .all() берёт данные из prefetch_related, если он был
+        genres = [genre.name for genre in instance.genres.all()]
+        representation['genres'] = genres or ['Unknown']
         return representation
 
 class UserBookCreateSerializer(serializers.ModelSerializer):
@@ -70,14 +78,10 @@ class UserBookCreateSerializer(serializers.ModelSerializer):
     def validate_location(self, value):
         if not value or not isinstance(value, str):
             raise serializers.ValidationError("Location is required and must be a string")
-        if value:
-            try:
-                lat, lon = map(float, value.split(','))
-                if not (-90 <= lat <= 90 and -180 <= lon <= 180):
-                    raise ValueError
-                return value
-            except (ValueError, AttributeError):
-                raise serializers.ValidationError("Location must be 'lat,lon' (e.g., '55.7558,37.6173')")
+        try:
+            parse_location(value)
+        except ValueError:
+            raise serializers.ValidationError("Location must be 'lat,lon' (e.g., '55.7558,37.6173')")
         return value
 
     def create(self, validated_data):
@@ -93,19 +97,87 @@ class UserBookSerializer(serializers.ModelSerializer):
         model = UserBook
         fields = ['user_book_id', 'book', 'condition', 'location', 'status']
 
+USER_BOOK_ROW_FIELDS = (
+    'user_book_id', 'condition', 'location', 'status',
+    'book_id', 'book_id__name', 'book_id__author', 'book_id__overview',
+)
+
+
+def user_book_rows(queryset, *extra_fields):
+    """
+    queryset UserBook -> .values() со всем, что нужно serialize_user_book_rows.
+    extra_fields — аннотации, которые должны остаться в строках (например, для курсора).
+    """
+    return queryset.select_related(None).prefetch_related(None).values(*USER_BOOK_ROW_FIELDS, *extra_fields)
+
+
+def genre_names_by_book(book_ids):
+    names = defaultdict(list)
+    rows = Book.genres.through.objects.filter(book_id__in=book_ids).order_by('id').values_list('book_id', 'genre__name')
+    for book_id, name in rows:
+        names[book_id].append(name)
+    return names
+
+
+def serialize_user_book_rows(rows):
+    """
+    Быстрый read-only аналог UserBookSerializer(many=True).data для строк из
+    user_book_rows(): обычные dict'ы без полей DRF, жанры всей страницы —
+    одним запросом.
+    """
+    rows = list(rows)
+    genres = genre_names_by_book({row['book_id'] for row in rows})
+    return [
+        {
+            'user_book_id': row['user_book_id'],
+            'book': {
+                'book_id': row['book_id'],
+                'name': row['book_id__name'],
+                'author': row['book_id__author'],
+                'overview': row['book_id__overview'],
+                'genres': genres.get(row['book_id']) or ['Unknown'],
+            },
+            'condition': row['condition'],
+            'location': row['location'],
+            'status': row['status'],
+        }
+        for row in rows
+    ]
+
+class UserBookListingSerializer(serializers.ModelSerializer):
+    """
+    Компактное представление для списков из витрины user_book_listings:
+    та же форма, что у UserBookSerializer, но без overview.
+    """
+    class Meta:
+        model = UserBookListing
+        fields = ['user_book', 'book_id', 'book_name', 'book_author', 'genres', 'condition', 'location', 'status']
+
     def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        if 'book' in representation and 'genres' in representation['book']:
-            genres = representation['book']['genres']
-            if not genres or genres == ['Unknown']:
-                representation['book']['genres'] = ['Unknown']
-            # Уже список, оставляем как есть
-        return representation
+        return {
+            'user_book_id': instance.user_book_id,
+            'book': {
+                'book_id': instance.book_id,
+                'name': instance.book_name,
+                'author': instance.book_author,
+                'genres': instance.genres or ['Unknown'],
+            },
+            'condition': instance.condition,
+            'location': instance.location,
+            'status': instance.status,
+        }
+
+class NearbyUserBookSerializer(UserBookSerializer):
+    distance_km = serializers.FloatField(read_only=True)
+
+    class Meta(UserBookSerializer.Meta):
+        fields = UserBookSerializer.Meta.fields + ['distance_km']
 
 class PhotoSerializer(serializers.ModelSerializer):
     class Meta:
         model = Photo
-        fields = ['photo_id', 'user_book_id', 'file_path']
+        fields = ['photo_id', 'user_book_id', 'file_path', 'status', 'variants']
+        read_only_fields = ['status', 'variants']
 
     def validate(self, data):
         user_book = data.get('user_book_id')
@@ -146,6 +218,16 @@ class PhotoUploadSerializer(serializers.Serializer):
 
         return data
 
+class PhotoJobSerializer(serializers.ModelSerializer):
+    photo_id = serializers.IntegerField(source='photo.photo_id', read_only=True)
+    photo_status = serializers.CharField(source='photo.status', read_only=True)
+    file_path = serializers.CharField(source='photo.file_path', read_only=True)
+    variants = serializers.JSONField(source='photo.variants', read_only=True)
+
+    class Meta:
+        model = PhotoJob
+        fields = ['job_id', 'photo_id', 'status', 'photo_status', 'file_path', 'variants', 'attempts', 'last_error']
+
 class ExchangeRequestSerializer(serializers.ModelSerializer):
     book = UserBookSerializer(read_only=True)
     requester = serializers.StringRelatedField(read_only=True)
@@ -0,0 +1,165 @@
+# books/signals.py
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from books import genres
+from books.autocomplete import record_changes as record_autocomplete_changes
+from books.geo import apply_coordinates
+from books.listings import refresh_listings
+from books.lookups import invalidate_user_book_lookups
+from books.recommendations import mark_books_stale, mark_exchange_requested, mark_users_stale
+from books.models import Book, ExchangeRequest, Genre, Photo, PhotoJob, UserBook
+from books.photo_jobs import remove_spool_file
+from books.response_cache import (
+    TAG_BOOKS, TAG_USER_BOOK_COUNTS, TAG_USER_BOOKS, book_tag, invalidate_on_commit, user_book_tag, user_tag
+)
+from books.search import update_search_vectors
+
+
+def invalidate_book_responses(book_ids):
+    book_ids = list(book_ids)
+    tags = [book_tag(book_id) for book_id in book_ids]
+    # Книга без экземпляров не попадёт ни в поиск, ни в фасеты, что в ней ни меняй
+    if book_ids and UserBook.objects.filter(book_id__in=book_ids).exists():
+        tags.append(TAG_BOOKS)
+    invalidate_on_commit(*tags)
+
+
+@receiver(post_save, sender=Book)
+def refresh_book_read_models(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    update_search_vectors([instance.pk])
+    record_autocomplete_changes(book_ids=[instance.pk])
+    if not created:
+        refresh_listings(book_ids=[instance.pk])
+        invalidate_book_responses([instance.pk])
+        # В пакетном lookup есть название книги
+        invalidate_user_book_lookups(UserBook.objects.filter(book_id=instance.pk).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Book)
+def invalidate_deleted_book_responses(sender, instance, **kwargs):
+    invalidate_book_responses([instance.pk])
+    record_autocomplete_changes(book_ids=[instance.pk])
+
+
+@receiver(m2m_changed, sender=Book.genres.through)
+def refresh_book_read_models_on_genres(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # Изменили книги у жанра: pk_set — это id книг, при clear запоминаем их заранее
+        if action == 'pre_clear':
+            instance._cleared_book_ids = list(instance.book_set.values_list('pk', flat=True))
+            return
+        if action == 'post_clear':
+            book_ids = getattr(instance, '_cleared_book_ids', [])
+        elif action in ('post_add', 'post_remove'):
+            book_ids = pk_set or []
+        else:
+            return
+        update_search_vectors(book_ids)
+        refresh_listings(book_ids=book_ids)
+        invalidate_book_responses(book_ids)
+        mark_books_stale(book_ids=book_ids)
+        return
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        update_search_vectors([instance.pk])
+        refresh_listings(book_ids=[instance.pk])
+        invalidate_book_responses([instance.pk])
+        mark_books_stale(book_ids=[instance.pk])
+
+
+@receiver(pre_save, sender=UserBook)
+def sync_user_book_coordinates(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    apply_coordinates(instance)
+    # Прежние статус и книга: по ним post_save решает, какие глобальные теги сбросить
+    instance._previous_state = None
+    if not instance._state.adding:
+        instance._previous_state = (
+            UserBook.objects.filter(pk=instance.pk).values_list('status', 'book_id').first()
+        )
+
+
+@receiver(post_save, sender=UserBook)
+def refresh_user_book_listing(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    refresh_listings(user_book_ids=[instance.pk])
+    tags = [user_tag(instance.user_id), user_book_tag(instance.pk)]
+    if getattr(instance, '_previous_state', None) != (instance.status, instance.book_id_id):
+        tags.append(TAG_USER_BOOK_COUNTS)
+        if instance.status == 'available':
+            tags.append(TAG_USER_BOOKS)
+    invalidate_on_commit(*tags)
+    invalidate_user_book_lookups([instance.pk])
+    # Вес книги в автокомплите — число доступных экземпляров
+    record_autocomplete_changes(book_ids=[instance.book_id_id])
+    if created:
+        # Полка входит в профиль рекомендаций пользователя
+        mark_users_stale([instance.user_id])
+
+
+@receiver(post_delete, sender=UserBook)
+def invalidate_deleted_user_book_responses(sender, instance, **kwargs):
+    invalidate_on_commit(TAG_USER_BOOK_COUNTS, user_tag(instance.user_id), user_book_tag(instance.pk))
+    invalidate_user_book_lookups([instance.pk])
+    record_autocomplete_changes(book_ids=[instance.book_id_id])
+    mark_users_stale([instance.user_id])
+
+
+@receiver(post_save, sender=Photo)
+@receiver(post_delete, sender=Photo)
+def invalidate_photo_responses(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    owner_ids = UserBook.objects.filter(pk=instance.user_book_id_id).values_list('user_id', flat=True)
+    invalidate_on_commit(user_book_tag(instance.user_book_id_id), *(user_tag(owner_id) for owner_id in owner_ids))
+
+
+@receiver(post_delete, sender=PhotoJob)
+def remove_photo_job_spool(sender, instance, **kwargs):
+    # Фото удалили вместе с невыполненной задачей — файл в spool больше не нужен
+    if instance.status in ('queued', 'running'):
+        transaction.on_commit(lambda: remove_spool_file(instance.spool_path))
+
+
+@receiver(post_save, sender=ExchangeRequest)
+@receiver(post_delete, sender=ExchangeRequest)
+def invalidate_exchange_responses(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    invalidate_on_commit(
+        user_tag(instance.requester_id), user_tag(instance.owner_id), user_book_tag(instance.book_id)
+    )
+    if kwargs.get('created'):
+        mark_exchange_requested(instance.book_id, instance.requester_id)
+
+
+@receiver(post_save, sender=Genre)
+def invalidate_genre_dictionary_on_save(sender, instance, created, raw=False, **kwargs):
+    # Новые жанры словари подхватят сами при промахе; сбрасывать нужно на переименование
+    if not created and not raw:
+        genres.invalidate()
+        book_ids = list(instance.book_set.values_list('pk', flat=True))
+        update_search_vectors(book_ids)
+        refresh_listings(book_ids=book_ids)
+        invalidate_book_responses(book_ids)
+
+
+@receiver(pre_delete, sender=Genre)
+def remember_genre_books(sender, instance, **kwargs):
+    # Связи удалятся каскадом без m2m_changed — запоминаем книги заранее
+    instance._book_ids = list(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Genre)
+def invalidate_genre_dictionary_on_delete(sender, instance, **kwargs):
+    genres.invalidate()
+    book_ids = getattr(instance, '_book_ids', [])
+    update_search_vectors(book_ids)
+    refresh_listings(book_ids=book_ids)
+    invalidate_book_responses(book_ids)
+    mark_books_stale(book_ids=book_ids)
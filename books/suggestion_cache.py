@@ -0,0 +1,167 @@
+# books/suggestion_cache.py
+import hashlib
+import json
+import logging
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from books import metrics
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'suggestions:v2:'
+REFRESH_LOCK_PREFIX = 'suggestions:refresh:'
+REFRESH_LOCK_TIMEOUT = 30
+_MISSING = object()
+# Названия уровней в cache_requests_total{cache=...}
+TIER_LOCAL = 'suggestions_local'
+TIER_REDIS = 'suggestions'
+
+
+def normalize_query(query):
+    """
+    «Harry Potter», «harry  potter » и «HARRY POTTER» — один ключ и один запрос в Google.
+    """
+    return ' '.join(unicodedata.normalize('NFKC', query).casefold().split())
+
+
+def cache_key(normalized):
+    return KEY_PREFIX + hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def _pack(value):
+    return zlib.compress(json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def _unpack(payload):
+    return json.loads(zlib.decompress(payload))
+
+
+class SuggestionCache:
+    """
+    Кэш подсказок Google Books в два уровня: LRU процесса
+    (SUGGESTION_LOCAL_SIZE записей, не дольше SUGGESTION_LOCAL_TTL секунд)
+    перед Redis, где подсказки лежат сжатым JSON.
+
+    Запись свежа SUGGESTION_CACHE_TTL секунд (пустой ответ —
+    SUGGESTION_NEGATIVE_TTL), после этого ещё SUGGESTION_STALE_TTL секунд
+    отдаётся как есть, а обновляется в фоне: популярный ключ не истекает
+    у всех разом, и пользователь не ждёт Google. Фоновое обновление ключа
+    одно на все воркеры (блокировка в Redis). Ошибки Google не кэшируются.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = OrderedDict()  # ключ -> (истекает локально, свежа до, подсказки)
+        self._refreshing = set()
+
+    def get(self, query, loader):
+        """
+        Подсказки для query; loader(нормализованный запрос) ходит в Google.
+        Возвращаемый список общий для запросов — не менять.
+        """
+        normalized = normalize_query(query)
+        key = cache_key(normalized)
+        now = time.time()
+
+        value = self._local_get(key, now)
+        if value is not _MISSING:
+            metrics.record_cache(TIER_LOCAL, hits=1)
+            return value
+        metrics.record_cache(TIER_LOCAL, misses=1)
+
+        entry = cache.get(key)
+        if entry is None:
+            metrics.record_cache(TIER_REDIS, misses=1)
+            return self._load(key, normalized, loader)
+
+        fresh_until, payload = entry
+        value = _unpack(payload)
+        if fresh_until > now:
+            metrics.record_cache(TIER_REDIS, hits=1)
+        else:
+            metrics.record_cache(TIER_REDIS, stale=1)
+            self._refresh(key, normalized, loader)
+        self._remember(key, fresh_until, value)
+        return value
+
+    def _local_get(self, key, now):
+        # Устаревшую локальную копию не отдаём: в Redis её, возможно, уже обновили
+        with self._lock:
+            local = self._local.get(key)
+            if local is None or local[0] <= time.monotonic() or local[1] <= now:
+                return _MISSING
+            self._local.move_to_end(key)
+            return local[2]
+
+    def _load(self, key, normalized, loader):
+        value = loader(normalized)
+        fresh_ttl = settings.SUGGESTION_CACHE_TTL if value else settings.SUGGESTION_NEGATIVE_TTL
+        fresh_until = time.time() + fresh_ttl
+        cache.set(key, (fresh_until, _pack(value)), timeout=fresh_ttl + settings.SUGGESTION_STALE_TTL)
+        self._remember(key, fresh_until, value)
+        return value
+
+    def _remember(self, key, fresh_until, value):
+        if settings.SUGGESTION_LOCAL_SIZE <= 0:
+            return
+        with self._lock:
+            self._local[key] = (time.monotonic() + settings.SUGGESTION_LOCAL_TTL, fresh_until, value)
+            self._local.move_to_end(key)
+            while len(self._local) > settings.SUGGESTION_LOCAL_SIZE:
+                self._local.popitem(last=False)
+
+    def _refresh(self, key, normalized, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        # Блокировка живёт до таймаута: при ошибке Google следующая попытка не раньше чем через 30 с
+        if not cache.add(REFRESH_LOCK_PREFIX + key, 1, timeout=REFRESH_LOCK_TIMEOUT):
+            with self._lock:
+                self._refreshing.discard(key)
+            return
+        if not settings.SUGGESTION_REFRESH_IN_BACKGROUND:
+            self._refresh_now(key, normalized, loader)
+            return
+        threading.Thread(target=self._refresh_now, args=(key, normalized, loader),
+                         name='suggestion-refresh', daemon=True).start()
+
+    def _refresh_now(self, key, normalized, loader):
+        try:
+            self._load(key, normalized, loader)
+        except Exception:
+            logger.exception('Failed to refresh suggestions for %r', normalized)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def stats(self):
+        """
+        Попадания по уровням в этом процессе (из cache_requests_total):
+        {уровень: {hits, stale, misses, hit_ratio}}; stale — отдано устаревшим
+        с обновлением в фоне, считается попаданием.
+        """
+        counters = metrics.registry.snapshot('cache_requests_total')
+        stats = {}
+        for tier, name in (('local', TIER_LOCAL), ('redis', TIER_REDIS)):
+            tier_stats = {field: counters.get((name, result), 0)
+                          for field, result in (('hits', 'hit'), ('stale', 'stale'), ('misses', 'miss'))}
+            lookups = sum(tier_stats.values())
+            served = tier_stats['hits'] + tier_stats['stale']
+            tier_stats['hit_ratio'] = round(served / lookups, 4) if lookups else 0.0
+            stats[tier] = tier_stats
+        return stats
+
+
+suggestion_cache = SuggestionCache()
@@ -1,3 +1,1598 @@
-from django.test import TestCase
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+import requests
+from rest_framework.test import APITestCase
+from rest_framework.throttling import SimpleRateThrottle
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.authentication import CachedJWTAuthentication
+from accounts.models import User
+from books import datasets, dedupe, events, exchanges, geo, lookups, metrics, recommendations
+from books.autocomplete import PrefixIndex, autocomplete
+from books.benchmarks import count_queries
+from books.genres import genre_dictionary
+from books.google_books import GoogleBooksClient, GoogleBooksError, RedisSingleFlight, SingleFlight
+from books.images import render_variants
+from books.ingest import CatalogIngestor, claim_ingest_job, iter_records, run_ingest_worker
+from books.listings import find_inconsistencies
+from books.models import (
+    Book, BookMergeProposal, BookRecommendation, CatalogIngestJob, ExchangeRequest, Genre, GoogleVolume, Photo,
+    PhotoJob, UserBook, UserBookListing, UserRecommendation,
+)
+from books.photo_jobs import claim_jobs, run_worker
+from books.photo_storage import LocalPhotoStorage
+from books.response_cache import response_cache
+from books.search import search_user_books
+from books.serializers import UserBookSerializer, serialize_user_book_rows, user_book_rows
+from books.suggestion_cache import cache_key, suggestion_cache
+from books.throttling import limiter
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+# Настроенный кэш (Redis) под своим префиксом — для проверок, которым нужен настоящий Redis
+REDIS_CACHES = {alias: dict(config, KEY_PREFIX='tests') for alias, config in settings.CACHES.items()}
+
+
+def create_user_books(user, count, prefix):
+    user_books = []
+    for i in range(count):
+        book = Book.objects.create(name=f'{prefix} {i}', author='Author', overview='Overview')
+        genre_dictionary.set_book_genres(book, ['Fiction', f'{prefix} genre'])
+        user_books.append(UserBook.objects.create(
+            user=user, book_id=book, condition='OK', location='55.7558,37.6173'
+        ))
+    return user_books
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FullTextSearchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        genre_dictionary.clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.reader = User.objects.create_user('reader', 'reader@example.com', 'password')
+        self.client.force_authenticate(self.reader)
+
+    def add(self, name, author='Author', overview='', genres=('Fiction',)):
+        book = Book.objects.create(name=name, author=author, overview=overview)
+        genre_dictionary.set_book_genres(book, genres)
+        UserBook.objects.create(user=self.owner, book_id=book, condition='OK', location='55.7558,37.6173')
+        return book
+
+    def search(self, query, url='/api/books/search/?mode=fulltext&query={}'):
+        response = self.client.get(url.format(query))
+        self.assertEqual(response.status_code, 200)
+        return [row['book']['name'] for row in response.data['results']]
+
+    def test_title_ranks_above_author_genre_and_overview(self):
+        self.add('Sandworm Notes', overview='A companion to dune')
+        self.add('Desert Planet', author='Dune Society')
+        self.add('Spice Atlas', genres=['Dune'])
+        self.add('Dune')
+        self.add('Unrelated')
+        self.assertEqual(self.search('dune'), ['Dune', 'Desert Planet', 'Spice Atlas', 'Sandworm Notes'])
+
+    def test_title_typo_is_matched_by_trigram_similarity(self):
+        self.add('Dune Messiah')
+        self.add('Children of Dune')
+        self.assertEqual(self.search('Mesiah'), ['Dune Messiah'])
+        self.assertEqual(self.search('Mesiah', '/api/books/search/?query={}'), [])  # icontains опечаток не прощает
+
+    def test_search_vector_follows_book_and_genre_changes(self):
+        book = self.add('Dune', genres=['Fiction'])
+        # Сигналы сбрасывают и кэш ответов — после коммита
+        with self.captureOnCommitCallbacks(execute=True):
+            book.name = 'Arrakis'
+            book.save()
+        self.assertEqual((self.search('arrakis'), self.search('dune')), (['Arrakis'], []))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            genre_dictionary.set_book_genres(book, ['Fiction', 'Ecology'])
+        self.assertEqual(self.search('ecology'), ['Arrakis'])
+        genre = Genre.objects.get(name='Ecology')
+        with self.captureOnCommitCallbacks(execute=True):
+            genre.name = 'Planetology'
+            genre.save()
+        self.assertEqual((self.search('ecology'), self.search('planetology')), ([], ['Arrakis']))
+        with self.captureOnCommitCallbacks(execute=True):
+            genre.delete()
+        self.assertEqual(self.search('planetology'), [])
+
+    def test_cursor_pages_follow_rank(self):
+        for i in range(12):
+            self.add(f'Dune {i}', overview='dune ' * (i % 3))
+        self.add('Dune Encyclopedia', author='Dune Fans')
+        names, url = [], '/api/books/search/?mode=fulltext&query=dune&pagination=cursor'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            names += [row['book']['name'] for row in response.data['results']]
+            url = response.data['next']
+        numbered = self.search('dune') + self.search('dune', '/api/books/search/?mode=fulltext&query={}&page=2')
+        self.assertEqual((len(set(names)), names), (13, numbered))
+
+
+    def test_cursor_pages_through_trigram_only_matches(self):
+        for i in range(12):
+            self.add(f'Dune {i}')
+        # Вектор ещё не посчитан — книга находится только по триграммам, ts_rank даёт NULL
+        Book.objects.exclude(name='Dune 0').update(search_vector=None)
+        names, url = [], '/api/books/search/?mode=fulltext&query=dune&pagination=cursor'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            names += [row['book']['name'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(sorted(names), sorted(f'Dune {i}' for i in range(12)))
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GenreDictionaryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        genre_dictionary.clear()
+
+    def test_known_genres_are_resolved_without_queries(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = genre_dictionary.resolve(['Fiction', 'Drama'])
+        with self.assertNumQueries(0):
+            self.assertEqual(genre_dictionary.resolve(['Drama', 'Fiction']), first)
+        with self.assertNumQueries(2):  # SELECT и INSERT только для нового жанра
+            self.assertEqual(set(genre_dictionary.resolve(['Fiction', 'Poetry'])), {'Fiction', 'Poetry'})
+
+    def test_renamed_genre_is_dropped_from_the_dictionary(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            drama_id = genre_dictionary.resolve(['Drama'])['Drama']
+        genre = Genre.objects.get(pk=drama_id)
+        genre.name = 'Stage'
+        genre.save()
+        self.assertNotEqual(genre_dictionary.resolve(['Drama'])['Drama'], drama_id)
+        self.assertEqual(genre_dictionary.resolve(['Stage'])['Stage'], drama_id)
+
+    def test_genres_created_in_rolled_back_transaction_are_not_cached(self):
+        with transaction.atomic():
+            genre_dictionary.resolve(['Rolled back'])
+            transaction.set_rollback(True)
+
+        genre_id = genre_dictionary.resolve(['Rolled back'])['Rolled back']
+        book = Book.objects.create(name='Dune', author='Frank Herbert', overview='Spice')
+        genre_dictionary.set_book_genres(book, ['Rolled back'])
+        self.assertEqual(list(book.genres.values_list('pk', flat=True)), [genre_id])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class UserBookListingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        genre_dictionary.clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.user_books = []
+        for i in range(3):
+            book = Book.objects.create(name=f'Listed {i}', author='Author', overview='Overview')
+            genre_dictionary.set_book_genres(book, ['Fiction'])
+            self.user_books.append(UserBook.objects.create(
+                user=self.owner, book_id=book, condition='OK', location='55.7558,37.6173'
+            ))
+
+    def listing(self, user_book):
+        return UserBookListing.objects.values(
+            'book_name', 'book_author', 'genres', 'condition', 'status'
+        ).get(pk=user_book.pk)
+
+    def test_listings_follow_user_book_book_and_genre_writes(self):
+        user_book, other, removed = self.user_books
+        user_book.condition = 'Worn'
+        user_book.save()
+        book = user_book.book_id
+        book.name, book.author = 'Renamed', 'New Author'
+        book.save()
+        genre_dictionary.set_book_genres(book, ['Fiction', 'Poetry'])
+        Genre.objects.get(name='Fiction').delete()
+        self.assertEqual(self.listing(user_book), {
+            'book_name': 'Renamed', 'book_author': 'New Author', 'genres': ['Poetry'],
+            'condition': 'Worn', 'status': 'available',
+        })
+
+        other.status = 'reserved'
+        other.save()
+        self.assertEqual(self.listing(other)['status'], 'reserved')
+
+        removed.delete()
+        self.assertFalse(UserBookListing.objects.filter(pk=removed.pk).exists())
+        self.assertEqual(find_inconsistencies(), [])
+
+    def test_compact_list_is_read_from_listings_without_joins(self):
+        self.client.force_authenticate(self.owner)
+        with self.assertNumQueries(2):  # COUNT и строки — без JOIN и prefetch жанров
+            response = self.client.get('/api/books/list/?compact=true')
+        self.assertEqual(response.status_code, 200)
+        first = response.data['results'][0]
+        self.assertEqual(first['book']['name'], 'Listed 0')
+        self.assertNotIn('overview', first['book'])
+
+    def test_check_listings_reports_and_fixes_drift(self):
+        stale, missing, _ = self.user_books
+        UserBookListing.objects.filter(pk=stale.pk).update(book_name='Wrong')
+        # Сырой UPDATE мимо сигналов — витрина его не видит
+        UserBook.objects.filter(pk=missing.pk).update(condition='Worn')
+        UserBookListing.objects.filter(pk=missing.pk).delete()
+        self.assertEqual(find_inconsistencies(), [(stale.pk, 'stale'), (missing.pk, 'missing')])
+
+        with self.assertRaises(CommandError):
+            call_command('check_listings', stdout=io.StringIO())
+        out = io.StringIO()
+        call_command('check_listings', '--fix', stdout=out)
+        self.assertIn('missing: 1, stale: 1', out.getvalue())
+        self.assertEqual(find_inconsistencies(), [])
+        self.assertEqual(self.listing(missing)['condition'], 'Worn')
+
+    def test_rebuild_restores_empty_listings(self):
+        UserBookListing.objects.all().delete()
+        call_command('rebuild_listings', '--batch-size', '2', stdout=io.StringIO())
+        self.assertEqual(UserBookListing.objects.count(), 3)
+        self.assertEqual(find_inconsistencies(), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.other = User.objects.create_user('other', 'other@example.com', 'password')
+        self.user_books = []
+        for i in range(12):
+            book = Book.objects.create(name=f'Keyset {i}', author='Author', overview='Overview')
+            self.user_books.append(UserBook.objects.create(
+                user=self.owner, book_id=book, condition='OK', location='55.7558,37.6173'
+            ))
+        self.client.force_authenticate(self.owner)
+
+    def pages(self, url):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            pages.append(response.data['results'])
+            url = response.data['next']
+        return pages
+
+    def test_cursor_pages_cover_the_list_and_tampered_cursor_is_not_found(self):
+        pages = self.pages('/api/books/list/?pagination=cursor')
+        self.assertEqual([len(page) for page in pages], [10, 2])
+        ids = [row['user_book_id'] for page in pages for row in page]
+        self.assertEqual(ids, [user_book.pk for user_book in self.user_books])
+
+        for position in ('["abc"]', '[null]', '[1, 2]', '[{"id": 1}]', '{}'):
+            cursor = base64.urlsafe_b64encode(position.encode()).decode()
+            response = self.client.get(f'/api/books/list/?cursor={cursor}')
+            self.assertEqual((response.status_code, response.data['detail']), (404, 'Invalid cursor'))
+        self.assertEqual(self.client.get('/api/books/list/?cursor=not-a-cursor!').status_code, 404)
+
+    def test_exchange_cursor_pages_follow_created_at_across_both_boxes(self):
+        now = timezone.now()
+        for i, user_book in enumerate(self.user_books):
+            # Чётные — входящие запросы, нечётные — исходящие
+            requester, owner = (self.other, self.owner) if i % 2 else (self.owner, self.other)
+            request = ExchangeRequest.objects.create(book=user_book, requester=requester, owner=owner)
+            ExchangeRequest.objects.filter(pk=request.pk).update(created_at=now - timedelta(minutes=i % 5))
+        rows = [row for page in self.pages('/api/exchange-requests/list/?pagination=cursor') for row in page]
+        self.assertEqual(len({row['exchange_request_id'] for row in rows}), 12)
+        expected = ExchangeRequest.objects.order_by('-created_at', '-exchange_request_id')
+        self.assertEqual([row['exchange_request_id'] for row in rows], list(expected.values_list('pk', flat=True)))
+
+        cursor = base64.urlsafe_b64encode(b'["yesterday", 1]').decode()
+        response = self.client.get(f'/api/exchange-requests/list/?cursor={cursor}')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class NearbyUserBooksTests(APITestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user('reader', 'reader@example.com', 'password')
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.client.force_authenticate(self.reader)
+
+    def place(self, *locations):
+        ids = []
+        for i, location in enumerate(locations):
+            book = Book.objects.create(name=f'Nearby {i}', author='Author', overview='Overview')
+            ids.append(UserBook.objects.create(
+                user=self.owner, book_id=book, condition='OK', location=location
+            ).pk)
+        return ids
+
+    def nearby(self, query):
+        response = self.client.get(f'/api/books/nearby/?{query}')
+        self.assertEqual(response.status_code, 200, response.data)
+        return [row['user_book_id'] for row in response.data['results']]
+
+    def test_geohash_and_covering_prefixes(self):
+        self.assertEqual(geo.geohash_encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(geo.geohash_cell_size(1), (45.0, 45.0))
+
+        box = geo.bounding_box(55.7558, 37.6173, 3)
+        prefixes = geo.covering_prefixes(*box)
+        self.assertTrue(1 <= len(prefixes) <= 4)
+        for corner_lat in (box[0], box[2]):
+            for corner_lon in (box[1], box[3]):
+                self.assertTrue(geo.geohash_encode(corner_lat, corner_lon).startswith(tuple(prefixes)))
+        self.assertEqual(geo.covering_prefixes(-80, -170, 80, 170), [])
+
+    def test_bounding_box_wraps_antimeridian_and_covers_poles(self):
+        min_lat, min_lon, max_lat, max_lon = geo.bounding_box(0, 179.99, 5)
+        self.assertGreater(min_lon, max_lon)
+        self.assertAlmostEqual(geo.box_center(min_lat, min_lon, max_lat, max_lon)[1], 179.99)
+        self.assertEqual(geo.bounding_box(89.99, 0, 5)[1::2], (-180.0, 180.0))
+
+    def test_nearest_first_and_own_or_unavailable_copies_excluded(self):
+        far, near, reserved = self.place('55.7600,37.6500', '55.7558,37.6173', '55.7559,37.6174')
+        UserBook.objects.filter(pk=reserved).update(status='reserved')
+        mine = Book.objects.create(name='Mine', author='Author', overview='')
+        UserBook.objects.create(user=self.reader, book_id=mine, condition='OK', location='55.7558,37.6173')
+        self.assertEqual(self.nearby('lat=55.7558&lon=37.6173&radius_km=5'), [near, far])
+        self.assertEqual(self.nearby('lat=55.7558&lon=37.6173&radius_km=1'), [near])
+
+    def test_radius_and_bbox_search_across_antimeridian(self):
+        east, west, far = self.place('0.0,179.99', '0.0,-179.99', '0.0,179.0')
+        self.assertEqual(self.nearby('lat=0&lon=179.995&radius_km=5'), [east, west])
+        self.assertEqual(self.nearby('lat=0&lon=-179.999&radius_km=5'), [west, east])
+        self.assertEqual(self.nearby('bbox=-0.1,179.95,0.1,-179.9'), [west, east])
+        self.assertEqual(self.nearby('lat=0&lon=179.8&radius_km=30'), [east, west])
+
+    def test_oversized_bbox_and_radius_are_rejected(self):
+        for query in ('bbox=0,0,10,10', 'bbox=-80,-180,80,180', 'bbox=0,179,0.1,-179', 'radius_km=51&lat=0&lon=0',
+                      'bbox=1,0,0,1', 'bbox=0,0,91,1'):
+            self.assertEqual(self.client.get(f'/api/books/nearby/?{query}').status_code, 400, query)
+        self.assertEqual(self.client.get('/api/books/nearby/?bbox=0,0,0.8,0.8').status_code, 200)
+
+
+class GoogleBooksClientTests(APITestCase):
+    def coalesce(self, flights, fn, callers=8):
+        barrier = threading.Barrier(callers)
+
+        def call(index):
+            barrier.wait()
+            return flights[index % len(flights)].do('volume:dune', fn)
+
+        with ThreadPoolExecutor(max_workers=callers) as executor:
+            return list(executor.map(call, range(callers)))
+
+    def slow_fetch(self, calls, result):
+        def fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            return result
+        return fetch
+
+    def test_retry_after_header_is_not_honoured(self):
+        retry = GoogleBooksClient(api_key='key').session.get_adapter('https://').max_retries
+        self.assertFalse(retry.respect_retry_after_header)
+        self.assertIn(429, retry.status_forcelist)
+
+    def test_invalid_json_is_bad_gateway(self):
+        client = GoogleBooksClient(api_key='key')
+        response = requests.Response()
+        response.status_code, response._content = 200, b'<html>Service Unavailable</html>'
+        with mock.patch.object(client.session, 'get', return_value=response):
+            with self.assertRaises(GoogleBooksError) as raised:
+                client.get_volume('dune')
+        self.assertEqual(raised.exception.status_code, 502)
+
+    def test_concurrent_calls_share_one_request(self):
+        calls = []
+        results = self.coalesce([SingleFlight()], self.slow_fetch(calls, {'id': 'dune'}))
+        self.assertEqual((len(calls), results), (1, [{'id': 'dune'}] * 8))
+
+        def failing():
+            calls.append(1)
+            time.sleep(0.2)
+            raise GoogleBooksError('down', status_code=503)
+
+        calls.clear()
+        with self.assertRaises(GoogleBooksError):
+            self.coalesce([SingleFlight()], failing)
+        self.assertEqual(len(calls), 1)
+
+    @override_settings(CACHES=REDIS_CACHES)
+    def test_workers_share_one_request_through_redis(self):
+        calls = []
+        # Два экземпляра — как два gunicorn-воркера с общим Redis
+        flights = [RedisSingleFlight(), RedisSingleFlight()]
+        self.addCleanup(cache.delete, 'google_books:flight:volume:dune')
+        results = self.coalesce(flights, self.slow_fetch(calls, {'id': 'dune'}))
+        self.assertEqual((len(calls), results), (1, [{'id': 'dune'}] * 8))
+
+    @override_settings(CACHES=REDIS_CACHES)
+    def test_follower_fetches_itself_when_leader_is_stuck(self):
+        lock = cache.lock('google_books:flight-lock:volume:stuck', timeout=5)
+        self.assertTrue(lock.acquire(blocking=False))
+        self.addCleanup(lock.release)
+        flight = RedisSingleFlight(wait_timeout=0.2)
+        self.assertEqual(flight.do('volume:stuck', lambda: {'id': 'stuck'}), {'id': 'stuck'})
+
+
+class GenreDataMigrationTests(TransactionTestCase):
+    before, after = [('books', '0003_alter_book_name')], [('books', '0004_exchangerequest_genre_userbook_status_and_more')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def test_genre_strings_are_moved_to_genre_table(self):
+        old_apps = self.migrate(self.before)
+        old_apps.get_model('books', 'Book').objects.create(
+            name='Dune', author='Frank Herbert', overview='', genres='Fiction / Science, Classics, Fiction'
+        )
+        new_apps = self.migrate(self.after)
+        book = new_apps.get_model('books', 'Book').objects.get(name='Dune')
+        self.assertEqual(sorted(book.genres.values_list('name', flat=True)), ['Classics', 'Fiction', 'Science'])
+
+        old_apps = self.migrate(self.before)
+        genres = old_apps.get_model('books', 'Book').objects.get(name='Dune').genres
+        self.assertEqual(sorted(genres.split(', ')), ['Classics', 'Fiction', 'Science'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class UserBookListQueryCountTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        genre_dictionary.clear()
+        self.small = User.objects.create_user('small', 'small@example.com', 'password')
+        self.large = User.objects.create_user('large', 'large@example.com', 'password')
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        create_user_books(self.small, 2, 'Small')
+        create_user_books(self.large, 12, 'Large')
+
+    def count_queries(self, user, url):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_user_book_list_query_count_does_not_grow_with_page(self):
+        small_queries, small_response = self.count_queries(self.small, '/api/books/list/')
+        large_queries, large_response = self.count_queries(self.large, '/api/books/list/')
+        self.assertEqual(len(small_response.data['results']), 2)
+        self.assertEqual(len(large_response.data['results']), 10)
+        self.assertEqual(small_queries, large_queries)
+        self.assertLessEqual(large_queries, 3)  # count, строки, жанры
+
+    def test_cursor_page_query_count_is_constant(self):
+        first_queries, response = self.count_queries(self.large, '/api/books/list/?pagination=cursor')
+        next_queries, _ = self.count_queries(self.large, response.data['next'])
+        self.assertEqual(first_queries, next_queries)
+        self.assertLessEqual(first_queries, 2)  # строки, жанры — без COUNT(*)
+
+    def test_all_user_books_query_count(self):
+        with self.assertNumQueries(3):
+            self.count_queries(self.admin, '/api/books/all/')
+
+    def test_search_query_count_does_not_grow_with_page(self):
+        small_queries, small_response = self.count_queries(self.small, '/api/books/search/?query=Small')
+        large_queries, large_response = self.count_queries(self.small, '/api/books/search/?query=Large')
+        self.assertEqual(len(small_response.data['results']), 2)
+        self.assertEqual(len(large_response.data['results']), 10)
+        self.assertEqual(small_queries, large_queries)
+
+    def test_fast_rows_match_user_book_serializer(self):
+        queryset = UserBook.objects.filter(user=self.large).order_by('user_book_id')
+        expected = UserBookSerializer(
+            queryset.select_related('book_id').prefetch_related('book_id__genres'), many=True
+        ).data
+        # Порядок жанров у prefetch без ORDER BY зависит от плана запроса — сравниваем как множества
+        def genres_sorted(rows):
+            return [dict(row, book=dict(row['book'], genres=sorted(row['book']['genres']))) for row in rows]
+
+        self.assertEqual(genres_sorted(serialize_user_book_rows(user_book_rows(queryset))),
+                         genres_sorted(dict(item) for item in expected))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TaggedResponseCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        genre_dictionary.clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.reader = User.objects.create_user('reader', 'reader@example.com', 'password')
+        self.user_book, = create_user_books(self.owner, 1, 'Cached')
+        self.client.force_authenticate(self.reader)
+
+    def search(self):
+        response = self.client.get('/api/books/search/?query=Cached')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_repeated_search_is_served_from_cache(self):
+        self.assertEqual(self.search()['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search()['X-Cache'], 'HIT')
+        self.assertEqual(response_cache.stats()['hits'], 1)
+
+    def test_exchange_status_change_invalidates_search(self):
+        self.assertEqual(len(self.search().data['results']), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/exchange-requests/', {'user_book_id': self.user_book.pk})
+        self.assertEqual(response.status_code, 201)
+        response = self.search()
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'], [])  # запрошенная книга больше не доступна
+        self.assertGreater(response_cache.stats()['invalidations'], 0)
+
+    def test_cursor_search_survives_writes_outside_its_results(self):
+        url = '/api/books/search/?query=Cached&pagination=cursor'
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        other, = create_user_books(self.owner, 1, 'Other')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(
+                self.client.post('/api/exchange-requests/', {'user_book_id': other.pk}).status_code, 201
+            )
+            other.refresh_from_db()
+            other.condition = 'Worn'
+            other.save()
+            genre_dictionary.set_book_genres(
+                Book.objects.create(name='Cached without copies', author='Author', overview=''), ['Fiction']
+            )
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        # Новый доступный экземпляр может попасть в любую выдачу
+        with self.captureOnCommitCallbacks(execute=True):
+            create_user_books(self.owner, 1, 'Cached new')
+        response = self.client.get(url)
+        self.assertEqual((response['X-Cache'], len(response.data['results'])), ('MISS', 2))
+
+    def test_book_rename_invalidates_user_book_list(self):
+        url = f'/api/books/list/?user_id={self.owner.pk}'
+        self.client.get(url)
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        with self.captureOnCommitCallbacks(execute=True):
+            book = self.user_book.book_id
+            book.name = 'Renamed'
+            book.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['book']['name'], 'Renamed')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, SEARCH_FACET_MAX_BUCKETS=3)
+class SearchFacetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        genre_dictionary.clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.reader = User.objects.create_user('reader', 'reader@example.com', 'password')
+        self.user_books = create_user_books(self.owner, 12, 'Facet')
+        for i, user_book in enumerate(self.user_books[:4]):
+            Book.objects.filter(pk=user_book.book_id_id).update(author=f'Writer {i}')
+        self.client.force_authenticate(self.reader)
+
+    def facets(self, params=''):
+        response = self.client.get(f'/api/books/search/?query=Facet&facets=true{params}')
+        self.assertEqual(response.status_code, 200)
+        return response.data['facets']
+
+    def test_facets_cost_one_query_and_are_shared_by_pages(self):
+        with CaptureQueriesContext(connection) as plain:
+            self.assertNotIn('facets', self.client.get('/api/books/search/?query=Facet').data)
+        with self.assertNumQueries(len(plain) + 1):
+            facets = self.facets()
+        self.assertEqual(facets['status'], {'buckets': [{'value': 'available', 'count': 12}], 'total_buckets': 1})
+        with self.assertNumQueries(len(plain)):  # снимок фасетов уже в кэше
+            self.assertEqual(self.facets('&page=2'), facets)
+
+    def test_bucket_cap(self):
+        facets = self.facets('&facet_limit=2')
+        self.assertEqual(facets['authors']['buckets'][0], {'value': 'Author', 'count': 8})
+        self.assertEqual(len(facets['authors']['buckets']), 2)
+        self.assertEqual(facets['authors']['total_buckets'], 5)
+        self.assertEqual(self.facets('&facet_limit=2&mode=fulltext')['authors'], facets['authors'])
+        self.assertEqual(self.client.get('/api/books/search/?facets=true&facet_limit=4').status_code, 400)
+        self.assertEqual(self.client.get('/api/books/search/?facets=true&facet_limit=x').status_code, 400)
+
+    def test_genre_facet_ignores_genre_filter(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            exchanges.create_request(self.user_books[0].pk, self.reader)
+            genre_dictionary.set_book_genres(self.user_books[1].book_id, ['Poetry'])
+        facets = self.facets('&genres=Fiction')
+        self.assertEqual(facets['genres']['buckets'], [
+            {'value': 'Facet genre', 'count': 10}, {'value': 'Fiction', 'count': 10}, {'value': 'Poetry', 'count': 1},
+        ])
+        self.assertEqual(facets['status']['buckets'], [
+            {'value': 'available', 'count': 10}, {'value': 'requested', 'count': 1},
+        ])
+        self.assertEqual(facets['authors']['total_buckets'], 3)  # Writer 0 запрошен, Writer 1 не Fiction
+
+
+def jpeg_bytes(size=(2400, 1800)):
+    image = Image.new('RGB', size, (200, 120, 40))
+    exif = Image.Exif()
+    exif[0x010F] = 'Test Camera'  # Make
+    exif[0x0112] = 6  # Orientation: повернуть на 90°
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+def png_bomb_bytes(size=(20000, 10000)):
+    # Маленький PNG с подменёнными размерами в IHDR: файл в килобайты, пикселей — 200 млн
+    buffer = io.BytesIO()
+    Image.new('1', (8, 8)).save(buffer, 'PNG')
+    data = bytearray(buffer.getvalue())
+    data[16:24] = struct.pack('>II', *size)
+    data[29:33] = struct.pack('>I', zlib.crc32(bytes(data[12:29])))
+    return bytes(data)
+
+
+class FailingPhotoStorage(LocalPhotoStorage):
+    def save(self, path, folder):
+        raise ConnectionError('storage is down')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PHOTO_JOB_MAX_ATTEMPTS=2)
+class PhotoUploadPipelineTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        genre_dictionary.clear()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        spool = override_settings(PHOTO_SPOOL_DIR=os.path.join(self.tmp, 'spool'))
+        spool.enable()
+        self.addCleanup(spool.disable)
+        self.storage = LocalPhotoStorage(location=os.path.join(self.tmp, 'media'), base_url='/media/')
+
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.user_book, = create_user_books(self.owner, 1, 'Photo')
+        self.client.force_authenticate(self.owner)
+
+    def upload(self, url='/api/books/photos/', method='post', content=None):
+        file = SimpleUploadedFile('cover.jpg', content or jpeg_bytes(), content_type='image/jpeg')
+        response = getattr(self.client, method)(
+            url, {'user_book_id': self.user_book.pk, 'file': file}, format='multipart'
+        )
+        self.assertEqual(response.status_code, 202)
+        return response.data
+
+    def test_upload_is_accepted_and_stored_by_worker(self):
+        job = self.upload()
+        self.assertEqual((job['status'], job['photo_status']), ('queued', 'pending'))
+
+        self.assertEqual(run_worker(once=True, storage=self.storage), 1)
+
+        job = self.client.get(f"/api/books/photos/jobs/{job['job_id']}/").data
+        self.assertEqual((job['status'], job['photo_status']), ('done', 'ready'))
+        self.assertEqual(job['file_path'], job['variants']['full']['url'])
+        self.assertEqual(os.listdir(os.path.join(self.tmp, 'spool')), [])
+
+    def test_variants_are_resized_reencoded_and_stripped(self):
+        job = self.upload()
+        run_worker(once=True, storage=self.storage)
+        variants = Photo.objects.get(pk=job['photo_id']).variants
+
+        # Ориентация из EXIF применена: 2400x1800 стало портретным
+        expected = {'full': (1200, 1600), 'medium': (480, 640), 'thumb': (120, 160)}
+        self.assertEqual({size: (v['width'], v['height']) for size, v in variants.items()}, expected)
+        for size, variant in variants.items():
+            with Image.open(self.stored_path(variant['url'])) as image:
+                self.assertEqual((image.format, image.size), ('WEBP', expected[size]))
+                self.assertNotIn('exif', image.info)
+
+    def test_invalid_image_fails_without_retries(self):
+        content = jpeg_bytes()
+        # Не картинка, обрезанный JPEG (падает при декодировании) и «бомба» (падает в Image.open)
+        for bad in (b'not an image', content[:len(content) // 2], png_bomb_bytes()):
+            job = self.upload(content=bad)
+            run_worker(once=True, storage=self.storage)
+            job = PhotoJob.objects.get(pk=job['job_id'])
+            self.assertEqual((job.status, job.attempts, job.photo.status), ('failed', 1, 'failed'))
+            self.assertIn('Not a valid image', job.last_error)
+
+    def test_crashing_job_does_not_stop_the_worker(self):
+        first, second = self.upload(), self.upload()
+        with mock.patch('books.photo_jobs.render_variants', side_effect=[RuntimeError('boom'), mock.DEFAULT],
+                        wraps=render_variants):
+            self.assertEqual(run_worker(once=True, storage=self.storage), 2)
+        self.assertEqual(PhotoJob.objects.get(pk=first['job_id']).status, 'failed')
+        self.assertEqual(PhotoJob.objects.get(pk=second['job_id']).status, 'done')
+
+    def test_abandoned_job_is_reclaimed_until_max_attempts(self):
+        job = self.upload()
+        expired = timezone.now() - timedelta(seconds=settings.PHOTO_JOB_LEASE_SECONDS + 1)
+        # Воркер умер посреди задачи: попытка ещё есть — задачу заберут снова
+        PhotoJob.objects.filter(pk=job['job_id']).update(status='running', attempts=1, locked_at=expired)
+        self.assertEqual([claimed.pk for claimed in claim_jobs()], [uuid.UUID(job['job_id'])])
+
+        PhotoJob.objects.filter(pk=job['job_id']).update(locked_at=expired)  # и снова умер
+        self.assertEqual(claim_jobs(), [])
+        job = PhotoJob.objects.get(pk=job['job_id'])
+        self.assertEqual((job.status, job.photo.status), ('failed', 'failed'))
+        self.assertIn('Lease expired', job.last_error)
+
+    def stored_path(self, url):
+        return os.path.join(self.tmp, 'media', url[len('/media/'):])
+
+    def test_replacement_keeps_old_file_until_upload_succeeds(self):
+        first = self.upload()
+        run_worker(once=True, storage=self.storage)
+        old_path = Photo.objects.get(pk=first['photo_id']).file_path
+        old_variants = Photo.objects.get(pk=first['photo_id']).variants
+
+        job = self.upload(f"/api/books/photos/{first['photo_id']}/", method='patch')
+        self.assertEqual(job['file_path'], old_path)
+        run_worker(once=True, storage=self.storage)
+
+        photo = Photo.objects.get(pk=first['photo_id'])
+        self.assertNotEqual(photo.file_path, old_path)
+        for variant in old_variants.values():
+            self.assertFalse(os.path.exists(self.stored_path(variant['url'])))
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(os.path.join(self.tmp, 'media')) for name in names]
+
+    def test_delete_removes_every_variant(self):
+        job = self.upload()
+        run_worker(once=True, storage=self.storage)
+        photo = Photo.objects.get(pk=job['photo_id'])
+        self.assertEqual(len(self.stored_files()), 3)
+
+        with mock.patch('books.photo_jobs.get_storage', return_value=self.storage):
+            response = self.client.delete(f"/api/books/photos/{photo.pk}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Photo.objects.filter(pk=photo.pk).exists())
+        for variant in photo.variants.values():
+            self.assertFalse(os.path.exists(self.stored_path(variant['url'])))
+        self.assertEqual(self.stored_files(), [])
+
+    def test_photo_deleted_during_upload_loses_no_files(self):
+        job = self.upload()
+        save = self.storage.save
+
+        def save_then_delete_photo(path, folder):
+            url = save(path, folder)
+            if len(self.stored_files()) == 3:
+                Photo.objects.filter(pk=job['photo_id']).delete()  # владелец удалил фото посреди выгрузки
+            return url
+
+        with mock.patch.object(self.storage, 'save', side_effect=save_then_delete_photo):
+            self.assertEqual(run_worker(once=True, storage=self.storage), 1)
+        self.assertFalse(PhotoJob.objects.filter(pk=job['job_id']).exists())
+        self.assertEqual(self.stored_files(), [])
+        self.assertEqual(os.listdir(os.path.join(self.tmp, 'spool')), [])
+
+    def test_failed_upload_is_retried_then_marked_failed(self):
+        job = self.upload()
+        run_worker(once=True, storage=FailingPhotoStorage(location=self.tmp))
+        job = PhotoJob.objects.get(pk=job['job_id'])
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertEqual(run_worker(once=True, storage=self.storage), 0)  # ещё не время повтора
+
+        PhotoJob.objects.filter(pk=job.pk).update(available_at=job.created_at)
+        run_worker(once=True, storage=FailingPhotoStorage(location=self.tmp))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.photo.status), ('failed', 2, 'failed'))
+        self.assertIn('storage is down', job.last_error)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ExchangeRequestApiTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        genre_dictionary.clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.requester = User.objects.create_user('requester', 'requester@example.com', 'password')
+        self.user_book, = create_user_books(self.owner, 1, 'Exchange')
+
+    def request_book(self, user):
+        self.client.force_authenticate(user)
+        return self.client.post('/api/exchange-requests/', {'user_book_id': self.user_book.pk})
+
+    def test_second_request_for_same_copy_conflicts(self):
+        self.assertEqual(self.request_book(self.requester).status_code, 201)
+        other = User.objects.create_user('other', 'other@example.com', 'password')
+        response = self.request_book(other)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(ExchangeRequest.objects.filter(book=self.user_book).count(), 1)
+
+    def test_own_and_missing_books_are_rejected(self):
+        self.assertEqual(self.request_book(self.owner).status_code, 400)
+        self.client.force_authenticate(self.requester)
+        response = self.client.post('/api/exchange-requests/', {'user_book_id': 999999})
+        self.assertEqual(response.status_code, 404)
+
+    def test_accept_moves_request_and_copy_together(self):
+        exchange_request_id = self.request_book(self.requester).data['exchange_request_id']
+        self.client.force_authenticate(self.requester)
+        url = f'/api/exchange-requests/{exchange_request_id}/'
+        self.assertEqual(self.client.patch(url, {'action': 'accept'}).status_code, 404)  # не владелец
+
+        self.client.force_authenticate(self.owner)
+        response = self.client.patch(url, {'action': 'accept'})
+        self.assertEqual((response.status_code, response.data['status']), (200, 'accepted'))
+        self.user_book.refresh_from_db()
+        self.assertEqual(self.user_book.status, 'exchanged')
+        self.assertEqual(UserBookListing.objects.get(pk=self.user_book.pk).status, 'exchanged')
+        self.assertEqual(self.client.patch(url, {'action': 'reject'}).status_code, 409)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ExchangeRequestConcurrencyTests(TransactionTestCase):
+    requesters = 300
+    workers = 32
+
+    def test_concurrent_requests_for_one_copy_have_single_winner(self):
+        genre_dictionary.clear()
+        owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        user_book, = create_user_books(owner, 1, 'Contended')
+        User.objects.bulk_create([
+            User(username=f'requester{i}', email=f'requester{i}@example.com', password='!')
+            for i in range(self.requesters)
+        ])
+        requesters = list(User.objects.exclude(pk=owner.pk))
+        start = threading.Event()
+
+        def attempt(requester):
+            start.wait()
+            try:
+                exchanges.create_request(user_book.pk, requester)
+                return 201
+            except exchanges.ExchangeError as e:
+                return e.status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(attempt, requester) for requester in requesters]
+            start.set()
+            results = [future.result() for future in futures]
+
+        self.assertEqual(results.count(201), 1)
+        self.assertEqual(results.count(409), self.requesters - 1)
+        self.assertEqual(ExchangeRequest.objects.filter(book=user_book, status='pending').count(), 1)
+        user_book.refresh_from_db()
+        self.assertEqual(user_book.status, 'requested')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class UserExchangeListTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        genre_dictionary.clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.busy = User.objects.create_user('busy', 'busy@example.com', 'password')
+        self.quiet = User.objects.create_user('quiet', 'quiet@example.com', 'password')
+        for user_book in create_user_books(self.owner, 12, 'Exchange'):
+            exchanges.create_request(user_book.pk, self.busy)
+        exchanges.create_request(create_user_books(self.owner, 1, 'Single')[0].pk, self.quiet)
+        self.busy_book, = create_user_books(self.busy, 1, 'Busy own')
+        exchanges.create_request(self.busy_book.pk, self.owner)
+
+    def get(self, user, query=''):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/api/exchange-requests/list/{query}')
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.data
+
+    def test_query_count_does_not_depend_on_history(self):
+        quiet_queries, quiet = self.get(self.quiet)
+        busy_queries, busy = self.get(self.busy)
+        self.assertEqual((quiet['count'], busy['count']), (1, 13))
+        self.assertEqual(quiet_queries, busy_queries)
+        self.assertLessEqual(busy_queries, 3)  # count, строки, жанры
+
+        cursor_queries, _ = self.get(self.busy, '?pagination=cursor')
+        self.assertLessEqual(cursor_queries, 2)
+
+    def test_inbox_outbox_and_status_filters(self):
+        _, inbox = self.get(self.busy, '?box=inbox')
+        _, outbox = self.get(self.busy, '?box=outbox&status=pending')
+        self.assertEqual([row['requester'] for row in inbox['results']], [str(self.owner)])
+        self.assertEqual(outbox['count'], 12)
+        created = [row['created_at'] for row in outbox['results']]
+        self.assertEqual(created, sorted(created, reverse=True))
+
+        self.client.force_authenticate(self.busy)
+        self.assertEqual(self.client.get('/api/exchange-requests/list/?box=all').status_code, 400)
+        self.assertEqual(self.client.get('/api/exchange-requests/list/?status=unknown').status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, USER_BOOK_LOOKUP_MAX_BATCH=5)
+class UserBookOwnersLookupTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        genre_dictionary.clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.requester = User.objects.create_user('requester', 'requester@example.com', 'password')
+        self.user_books = create_user_books(self.owner, 3, 'Lookup')
+        self.ids = [user_book.pk for user_book in self.user_books]
+        self.client.force_authenticate(self.requester)
+
+    def lookup(self, payload, url='/api/books/owners/', **extra):
+        return self.client.post(url, payload, format='json', **extra)
+
+    def test_default_response_is_owner_map_and_cached(self):
+        with self.assertNumQueries(1):
+            response = self.lookup({'user_book_ids': self.ids + [999999]})
+        self.assertEqual(response.json(), {str(pk): self.owner.pk for pk in self.ids})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.lookup({'user_book_ids': self.ids + [999999]}).json(), response.json())
+
+    def test_fields_and_invalidation(self):
+        payload = {'user_book_ids': self.ids[:1], 'fields': ['status', 'title']}
+        self.assertEqual(self.lookup(payload).json(), {str(self.ids[0]): {'status': 'available', 'title': 'Lookup 0'}})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            exchanges.create_request(self.ids[0], self.requester)
+        self.assertEqual(self.lookup(payload).json()[str(self.ids[0])]['status'], 'requested')
+
+        book = self.user_books[0].book_id
+        book.name = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            book.save()
+        self.assertEqual(self.lookup(payload).json()[str(self.ids[0])]['title'], 'Renamed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user_books[0].delete()
+        self.assertEqual(self.lookup(payload).json(), {})
+
+    def test_binary_format(self):
+        fields = ['owner', 'status', 'title']
+        response = self.lookup({'user_book_ids': self.ids, 'fields': fields}, url='/api/books/owners/?format=binary')
+        self.assertEqual(response['Content-Type'], 'application/x-user-book-lookup')
+        self.assertEqual(lookups.unpack_lookups(response.content, fields), {
+            pk: {'owner': self.owner.pk, 'status': 'available', 'title': f'Lookup {i}'} for i, pk in enumerate(self.ids)
+        })
+        response = self.lookup({'user_book_ids': self.ids}, HTTP_ACCEPT='application/x-user-book-lookup')
+        self.assertEqual(len(response.content), 3 * (4 + 8))
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.lookup({'user_book_ids': list(range(1, 7))}).status_code, 400)
+        self.assertEqual(self.lookup({'user_book_ids': ['1']}).status_code, 400)
+        self.assertEqual(self.lookup({'user_book_ids': self.ids, 'fields': ['email']}).status_code, 400)
+        response = self.lookup({'user_book_ids': ['1']}, url='/api/books/owners/?format=binary')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', json.loads(response.content))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, RECOMMENDATIONS_TOP_K=5)
+class RecommendationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        genre_dictionary.clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.reader = User.objects.create_user('reader', 'reader@example.com', 'password')
+        self.copies = {
+            name: self.create_copy(name, genres)
+            for name, genres in (('Dragon', ['Fantasy']), ('Elves', ['Fantasy']), ('War', ['History']),
+                                 ('Wizard', ['Fantasy']))
+        }
+        UserBook.objects.filter(pk=self.copies['Wizard'].pk).update(status='exchanged')
+        self.client.force_authenticate(self.reader)
+
+    def create_copy(self, name, genres):
+        book = Book.objects.create(name=name, author='Author', overview='Overview')
+        genre_dictionary.set_book_genres(book, genres)
+        return UserBook.objects.create(user=self.owner, book_id=book, condition='OK', location='55.7558,37.6173')
+
+    def recommended(self, query=''):
+        response = self.client.get(f'/api/books/recommendations/{query}')
+        self.assertEqual(response.status_code, 200)
+        return [row['book']['name'] for row in response.data['results']]
+
+    def book_id(self, name):
+        return self.copies[name].book_id_id
+
+    def test_similar_books_by_genre_and_co_requests(self):
+        recommendations.build(full=True)
+        # Wizard похож, но его экземпляр уже обменян; War — другой жанр
+        self.assertEqual(self.recommended(f"?book_id={self.book_id('Dragon')}"), ['Elves'])
+
+        ExchangeRequest.objects.create(book=self.copies['Dragon'], requester=self.reader, owner=self.owner, status='rejected')
+        ExchangeRequest.objects.create(book=self.copies['War'], requester=self.reader, owner=self.owner, status='rejected')
+        recommendations.build(full=True)
+        self.assertEqual(set(self.recommended(f"?book_id={self.book_id('Dragon')}")), {'Elves', 'War'})
+        # Свои запросы в личные рекомендации не попадают
+        self.assertEqual(self.recommended(), ['Elves'])
+        self.client.force_authenticate(self.owner)
+        self.assertEqual(self.recommended(f"?book_id={self.book_id('Dragon')}"), [])  # свои экземпляры
+
+    def test_incremental_build_recomputes_only_affected_rows(self):
+        poems = self.create_copy('Poems', ['Poetry'])
+        recommendations.build(full=True)
+        self.assertFalse(BookRecommendation.objects.filter(stale_at__isnull=False).exists())
+        orc = self.create_copy('Orc', ['Fantasy'])
+        exchanges.create_request(self.copies['War'].pk, self.reader)
+        self.assertIsNotNone(BookRecommendation.objects.get(pk=self.book_id('War')).stale_at)
+
+        stats = recommendations.build()
+        self.assertFalse(stats['full'])
+        self.assertEqual(stats['book_rows'], stats['books'] - 1)  # кроме Poems: с изменившимися не связана
+        self.assertNotIn(poems.book_id_id, BookRecommendation.objects.get(pk=self.book_id('Dragon')).book_ids)
+        self.assertIn(orc.book_id_id, BookRecommendation.objects.get(pk=self.book_id('Dragon')).book_ids)
+        self.assertFalse(BookRecommendation.objects.filter(stale_at__isnull=False).exists())
+        self.assertEqual(UserRecommendation.objects.get(pk=self.reader.pk).book_ids, [])  # истории нет в History
+
+    def test_query_count_and_validation(self):
+        recommendations.build(full=True)
+        with self.assertNumQueries(4):  # книга, топ, экземпляры, жанры
+            self.recommended(f"?book_id={self.book_id('Dragon')}&limit=1")
+        self.assertEqual(self.client.get('/api/books/recommendations/?book_id=999999').status_code, 404)
+        self.assertEqual(self.client.get('/api/books/recommendations/?limit=0').status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, AUTOCOMPLETE_BUILD_IN_BACKGROUND=False, AUTOCOMPLETE_SYNC_SECONDS=0)
+class BookAutocompleteTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        genre_dictionary.clear()
+        autocomplete.reset()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.reader = User.objects.create_user('reader', 'reader@example.com', 'password')
+        self.hobbit = Book.objects.create(name='The Hobbit', author='J.R.R. Tolkien', overview='')
+        self.tales = Book.objects.create(name='Hobbit  Tales', author='Someone Else', overview='')
+        self.copies = [
+            UserBook.objects.create(user=self.owner, book_id=self.hobbit, condition='OK', location='Moscow')
+            for _ in range(2)
+        ]
+        self.client.force_authenticate(self.reader)
+
+    def complete(self, query):
+        response = self.client.get('/api/books/autocomplete/', {'query': query})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['source'], 'local')
+        return [(row['name'], row['available_copies']) for row in response.data['results']]
+
+    def test_prefix_of_any_word_ranked_by_available_copies(self):
+        self.assertEqual(self.complete('HOB'), [('The Hobbit', 2), ('Hobbit Tales', 0)])
+        self.assertEqual(self.complete('tolk'), [('The Hobbit', 2)])
+        self.assertEqual(self.complete('hobbit ta'), [('Hobbit Tales', 0)])
+
+    def test_signals_update_built_index(self):
+        self.complete('hob')
+        with self.captureOnCommitCallbacks(execute=True):
+            exchanges.create_request(self.copies[0].pk, self.reader)
+            self.copies[1].delete()
+        self.assertEqual(self.complete('hob'), [('The Hobbit', 0), ('Hobbit Tales', 0)])
+
+        self.tales.name = 'Dragon Tales'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tales.save()
+            self.hobbit.delete()
+        self.assertEqual(self.complete('tales'), [('Dragon Tales', 0)])
+        with mock.patch('books.views.get_google_books_client') as client:
+            client.return_value.search_volumes.return_value = {'items': [
+                {'id': 'vol1', 'volumeInfo': {'title': 'The Hobbit', 'authors': ['J.R.R. Tolkien']}}
+            ]}
+            response = self.client.get('/api/books/autocomplete/', {'query': 'hob'})
+        self.assertEqual(response.data['source'], 'google')
+        self.assertEqual(response.data['results'][0]['id'], 'vol1')
+
+    def test_prefix_heads_match_brute_force(self):
+        rng = random.Random(7)
+        words = ['alpha', 'alps', 'beta', 'bet', 'gamma']
+        rows = [
+            (i, f'{rng.choice(words)} {rng.choice(words)} {i}', rng.choice(words), rng.randint(0, 5))
+            for i in range(1, 301)
+        ]
+        with mock.patch('books.autocomplete.SCAN_LIMIT', 10), mock.patch('books.autocomplete.HEAD_SIZE', 30):
+            index = PrefixIndex.from_rows(rows)
+            for step in range(300):
+                if step % 3 == 0:
+                    index.set_weight(rng.randrange(len(rows)), rng.randint(0, 5))
+                elif step % 3 == 1:
+                    index.add(1000 + step, f'{rng.choice(words)} new {step}', rng.choice(words), rng.randint(0, 5))
+                else:
+                    index.remove(rng.choice(rows)[0])
+                prefix = rng.choice(words)[:rng.randint(1, 3)]
+                live = [
+                    (index.weights[slot], -slot) for slot in range(len(index.texts))
+                    if index.weights[slot] >= 0 and any(
+                        word.startswith(prefix) for word in index.texts[slot].casefold().replace('\x1f', ' ').split()
+                    )
+                ]
+                expected = [-slot for _, slot in sorted(live, reverse=True)[:10]]
+                self.assertEqual(
+                    [index.slot(book_id) for book_id, *_ in index.lookup(prefix, 10)], expected, prefix
+                )
+
+
+    def test_weight_change_checks_only_prefixes_with_heads(self):
+        long_name = ' '.join(f'word{i}' for i in range(300))
+        rows = [(i, f'alpha {i}', 'Author', 1) for i in range(1, 30)] + [(100, long_name, 'Author', 1)]
+        with mock.patch('books.autocomplete.SCAN_LIMIT', 10), mock.patch('books.autocomplete.HEAD_SIZE', 5):
+            index = PrefixIndex.from_rows(rows)
+            index.lookup('al', 3)
+            index.lookup('auth', 3)
+            index.heads = mock.MagicMock(wraps=index.heads)
+            index.set_weight(index.slot(100), 5)
+        # По префиксу длиной 1..4 от начала каждого слова, а не все O(L²) подстрок
+        self.assertLessEqual(index.heads.get.call_count, 4 * (300 + 1))
+        self.assertEqual(index.lookup('auth', 1)[0][0], 100)
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BenchmarkDatasetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        genre_dictionary.clear()
+
+    def test_generated_dataset_is_consistent(self):
+        stats = datasets.generate(300, seed=1, prefix='ds')
+        self.assertEqual((stats['books'], stats['user_books'], stats['users']), (300, 360, 15))
+        user_books = UserBook.objects.filter(user__username__startswith='ds_')
+        self.assertEqual(user_books.count(), 360)
+        self.assertFalse(user_books.filter(latitude__isnull=True).exists())
+        self.assertEqual(Photo.objects.filter(user_book_id__in=user_books).count(), stats['photos'])
+        # Статус экземпляра согласован с последним запросом на него
+        pending = ExchangeRequest.objects.filter(book__in=user_books, status='pending')
+        self.assertEqual(set(pending.values_list('book_id', flat=True)),
+                         set(user_books.filter(status='requested').values_list('pk', flat=True)))
+        self.assertFalse(ExchangeRequest.objects.filter(book__in=user_books, requester=F('owner')).exists())
+        self.assertEqual(UserBookListing.objects.filter(user_book__in=user_books).count(), 360)
+        self.assertEqual(search_user_books('', '', '').filter(user__username__startswith='ds_').count(),
+                         user_books.filter(status='available').count())
+        with self.assertRaises(ValueError):
+            datasets.generate(10, prefix='ds')
+
+    def test_bench_endpoints_output_and_compare(self):
+        output = os.path.join(tempfile.mkdtemp(), 'bench.tsv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        call_command('bench_endpoints', sizes='200', repeat=1, endpoints='search_basic,exchange_create',
+                     output=output, stdout=io.StringIO(), stderr=io.StringIO())
+        with open(output) as f:
+            rows = [line.split('\t') for line in f.read().splitlines()]
+        self.assertEqual([row[1:4] for row in rows[1:]], [
+            ['search_basic', 'cold', '200'], ['search_basic', 'warm', '200'],
+            ['exchange_create', 'cold', '201'], ['exchange_create', 'warm', '201'],
+        ])
+        self.assertEqual(rows[2][4], '0')  # warm: ответ и пользователь JWT из кэша
+        self.assertFalse(UserBook.objects.exists())  # набор откатывается
+
+        rows[1][4] = '1'  # «раньше» холодный поиск делал один запрос
+        with open(output, 'w') as f:
+            f.write('\n'.join('\t'.join(row) for row in rows))
+        with self.assertRaises(CommandError):
+            call_command('bench_endpoints', sizes='200', repeat=1, endpoints='search_basic',
+                         compare=output, stdout=io.StringIO(), stderr=io.StringIO())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, METRICS_TOKEN='')
+class MetricsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        genre_dictionary.clear()
+        metrics.registry.reset()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        create_user_books(self.owner, 2, 'Metered')
+        self.client.force_authenticate(self.owner)
+
+    def test_request_latency_and_sql_by_route(self):
+        with count_queries() as queries:
+            self.assertEqual(self.client.get('/api/books/search/?query=Metered').status_code, 200)
+        self.client.get('/api/books/search/?query=Metered')
+        self.client.get('/api/no-such-page/')
+
+        latency = metrics.registry.snapshot('http_request_duration_seconds')
+        self.assertEqual(latency[('api/books/search/', 'GET', '2xx')][2], 2)
+        self.assertEqual(latency[(metrics.UNMATCHED_ROUTE, 'GET', '4xx')][2], 1)
+        buckets, total, count = metrics.registry.snapshot('http_request_db_queries')[('api/books/search/',)]
+        self.assertEqual((total, count), (queries[0], 2))  # второй ответ из кэша — без SQL
+        self.assertEqual(buckets[0], 1)
+        self.assertEqual(metrics.registry.snapshot('cache_requests_total'),
+                         {('response', 'miss'): 1, ('response', 'hit'): 1})
+
+    def test_prometheus_endpoint(self):
+        self.client.get('/api/books/search/?query=Metered')
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_request_duration_seconds_bucket{route="api/books/search/",method="GET",'
+                      'status="2xx",le="+Inf"} 1', body)
+        self.assertIn('cache_requests_total{cache="response",result="miss"} 1', body)
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    def test_metrics_without_token_are_served_only_to_allowed_networks(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.5').status_code, 403)
+        with override_settings(METRICS_ALLOWED_NETWORKS=['10.0.0.0/8']):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.1.2.3').status_code, 200)
+            self.assertEqual(self.client.get('/metrics').status_code, 403)  # 127.0.0.1 больше не в списке
+        with override_settings(METRICS_ALLOWED_NETWORKS=[]):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_upstream_latency(self):
+        client = GoogleBooksClient(api_key='key', single_flight=None)
+        client.session = mock.Mock()
+        client.session.get.return_value = mock.Mock(status_code=200, json=lambda: {'items': []})
+        client.search_volumes('dune')
+        client.session.get.side_effect = requests.Timeout
+        with self.assertRaises(GoogleBooksError):
+            client.get_volume('abc')
+        upstream = metrics.registry.snapshot('upstream_request_duration_seconds')
+        self.assertEqual({labels: value[2] for labels, value in upstream.items()}, {
+            ('google_books', 'search', 'ok'): 1, ('google_books', 'volume', 'error'): 1,
+        })
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GoogleVolumeTests(APITestCase):
+    VOLUME = {'id': 'vol1', 'volumeInfo': {
+        'title': 'Dune', 'authors': ['Frank Herbert'], 'description': 'Spice', 'categories': ['Fiction / Science'],
+    }}
+
+    def setUp(self):
+        cache.clear()
+        genre_dictionary.clear()
+        self.reader = User.objects.create_user('reader', 'reader@example.com', 'password')
+        self.other = User.objects.create_user('other', 'other@example.com', 'password')
+
+    def add(self, user, volume_id='vol1'):
+        self.client.force_authenticate(user)
+        return self.client.post('/api/books/', {'book_id': volume_id, 'condition': 'OK', 'location': '55.7558,37.6173'})
+
+    def test_known_volume_is_added_without_google(self):
+        with mock.patch('books.google_volumes.get_google_books_client') as client:
+            client.return_value.get_volume.return_value = self.VOLUME
+            self.assertEqual(self.add(self.reader).status_code, 201)
+            response = self.add(self.other)
+        self.assertEqual(response.status_code, 201)
+        client.return_value.get_volume.assert_called_once_with('vol1')
+        book = Book.objects.get(google_volume_id='vol1')
+        self.assertEqual((response.data['book_id'], sorted(response.data['genres'])),
+                         (book.pk, ['Fiction', 'Science']))
+        self.assertEqual(UserBook.objects.filter(book_id=book).count(), 2)
+
+    def test_existing_title_is_linked_and_stale_volume_survives_outage(self):
+        book = Book.objects.create(name='Dune', author='Frank Herbert', overview='Custom')
+        with mock.patch('books.google_volumes.get_google_books_client') as client:
+            client.return_value.get_volume.return_value = self.VOLUME
+            self.assertEqual(self.add(self.reader).status_code, 201)
+        book.refresh_from_db()
+        self.assertEqual((book.google_volume_id, book.overview), ('vol1', 'Custom'))
+
+        # Сохранённый том без книги: старше GOOGLE_VOLUME_REFRESH_DAYS, а Google недоступен
+        book.delete()
+        GoogleVolume.objects.filter(volume_id='vol1').update(fetched_at=F('fetched_at') - timedelta(days=365))
+        with mock.patch('books.google_volumes.get_google_books_client') as client:
+            client.return_value.get_volume.side_effect = GoogleBooksError('down', status_code=503)
+            self.assertEqual(self.add(self.other).status_code, 201)
+            self.assertEqual(self.add(self.other, 'vol2').status_code, 503)
+        self.assertEqual(Book.objects.get(google_volume_id='vol1').overview, 'Spice')
+
+
+@override_settings(CATALOG_INGEST_MAX_ATTEMPTS=2)
+class CatalogIngestTests(APITestCase):
+    CSV = 'name,author,overview,genres\nDune,Frank Herbert,Spice,Fiction\nEmma,Jane Austen,Match,"Romance, Fiction"\n'
+
+    def setUp(self):
+        cache.clear()
+        genre_dictionary.clear()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        ingest_dir = override_settings(CATALOG_INGEST_DIR=self.tmp)
+        ingest_dir.enable()
+        self.addCleanup(ingest_dir.disable)
+        self.admin = User.objects.create_user('admin', 'admin@example.com', 'password', is_staff=True)
+        self.client.force_authenticate(self.admin)
+
+    def upload(self, content=None, name='catalog.csv'):
+        file = SimpleUploadedFile(name, (content or self.CSV).encode(), content_type='text/plain')
+        response = self.client.post('/api/books/ingest/', {'file': file}, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        return response.data['job_id']
+
+    def test_upload_is_queued_and_loaded_by_worker(self):
+        job_id = self.upload()
+        self.assertEqual(self.client.get(f'/api/books/ingest/{job_id}/').data['state'], 'queued')
+
+        self.assertEqual(run_ingest_worker(once=True), 1)
+
+        job = self.client.get(f'/api/books/ingest/{job_id}/').data
+        self.assertEqual((job['state'], job['processed'], job['books_created'], job['skipped']), ('done', 2, 2, 0))
+        self.assertEqual(set(Book.objects.get(name='Emma').genres.values_list('name', flat=True)),
+                         {'Romance', 'Fiction'})
+        self.assertEqual(os.listdir(self.tmp), [])
+        self.assertEqual(self.client.get(f'/api/books/ingest/{uuid.uuid4()}/').status_code, 404)
+
+    def test_abandoned_job_is_reclaimed_until_max_attempts(self):
+        job_id = self.upload()
+        # Воркер забрал задачу и умер, не продлив аренду
+        self.assertEqual(claim_ingest_job().pk, uuid.UUID(job_id))
+        expired = timezone.now() - timedelta(seconds=settings.CATALOG_INGEST_LEASE_SECONDS + 1)
+        CatalogIngestJob.objects.filter(pk=job_id).update(locked_at=expired)
+        self.assertEqual(claim_ingest_job().attempts, 2)
+
+        CatalogIngestJob.objects.filter(pk=job_id).update(locked_at=expired)
+        self.assertIsNone(claim_ingest_job())
+        job = self.client.get(f'/api/books/ingest/{job_id}/').data
+        self.assertEqual(job['state'], 'failed')
+        self.assertIn('Lease expired', job['error'])
+
+    def test_transient_error_requeues_job_and_resumes_from_checkpoint(self):
+        job_id = self.upload('vol1\nvol2\nmissing\n', name='volumes.txt')
+        calls = []
+
+        def get_volume(volume_id, client):
+            calls.append(volume_id)
+            if volume_id == 'missing':
+                raise GoogleBooksError('Google Books API error', status_code=404)
+            if calls.count('vol2') == 1 and volume_id == 'vol2':
+                raise GoogleBooksError('Google Books API is unavailable', status_code=503)
+            return {'id': volume_id, 'volumeInfo': {'title': f'Title {volume_id}', 'authors': ['Author']}}
+
+        with mock.patch('books.ingest.google_volumes.get_volume', side_effect=get_volume):
+            run_ingest_worker(once=True, batch_size=1)
+            job = CatalogIngestJob.objects.get(pk=job_id)
+            self.assertEqual((job.status, job.attempts, job.stats['processed']), ('queued', 1, 1))
+            self.assertGreater(job.available_at, timezone.now())
+            self.assertEqual(run_ingest_worker(once=True, batch_size=1), 0)  # ещё не время повтора
+
+            CatalogIngestJob.objects.filter(pk=job_id).update(available_at=timezone.now())
+            self.assertEqual(run_ingest_worker(once=True, batch_size=1), 1)
+
+        job = self.client.get(f'/api/books/ingest/{job_id}/').data
+        self.assertEqual((job['state'], job['processed'], job['books_created'], job['failed']), ('done', 3, 2, 1))
+        self.assertEqual(calls, ['vol1', 'vol2', 'vol2', 'missing'])
+
+    def test_unparseable_file_fails_without_retries(self):
+        for content in ('[{"name": "Dune"}, oops]', '["Dune"]'):
+            job_id = self.upload(content, name='catalog.json')
+            run_ingest_worker(once=True)
+            job = CatalogIngestJob.objects.get(pk=job_id)
+            self.assertEqual((job.status, job.attempts), ('failed', 1))
+
+    def test_json_array_is_read_in_chunks(self):
+        records = [{'name': f'Book {i}', 'overview': 'x' * 50, 'genres': ['Fiction']} for i in range(20)]
+        stream = io.StringIO(json.dumps(records, indent=2))
+        with mock.patch('books.ingest.JSON_CHUNK_SIZE', 7):
+            self.assertEqual(next(iter_records(stream, 'json')), records[0])
+            # Первая запись получена без чтения всего файла
+            self.assertLess(stream.tell(), 200)
+            self.assertEqual(list(iter_records(io.StringIO(json.dumps(records)), 'json')), records)
+
+        for content in ('[{"name": "Dune"}', '[{"name": "Dune"}] []', '[{"name": "Dune"},]'):
+            with self.assertRaises(ValueError):
+                list(iter_records(io.StringIO(content), 'json'))
+
+    def test_existing_titles_are_linked_and_volume_conflicts_reported(self):
+        dune = Book.objects.create(name='Dune', author='Frank Herbert', overview='Custom')
+        Book.objects.create(name='Dune (1965)', author='Frank Herbert', overview='', google_volume_id='vol2')
+        titles = {'vol1': 'Dune', 'vol2': 'Dune: Deluxe Edition', 'vol3': 'Dune Messiah'}
+
+        def get_volume(volume_id, client):
+            return {'id': volume_id, 'volumeInfo': {'title': titles[volume_id], 'authors': ['Frank Herbert']}}
+
+        with mock.patch('books.ingest.google_volumes.get_volume', side_effect=get_volume):
+            stats = CatalogIngestor(workers=2).run({'volume_id': volume_id} for volume_id in titles)
+
+        self.assertEqual(
+            {key: stats[key] for key in ('processed', 'books_created', 'books_linked', 'skipped', 'failed')},
+            {'processed': 3, 'books_created': 1, 'books_linked': 1, 'skipped': 1, 'failed': 0},
+        )
+        dune.refresh_from_db()
+        self.assertEqual((dune.google_volume_id, dune.overview), ('vol1', 'Custom'))
+        self.assertFalse(Book.objects.filter(name='Dune: Deluxe Edition').exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, SUGGESTION_REFRESH_IN_BACKGROUND=False)
+class SuggestionCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        suggestion_cache.clear_local()
+        self.client.force_authenticate(User.objects.create_user('reader', 'reader@example.com', 'password'))
+
+    def test_normalized_queries_share_one_upstream_call(self):
+        with mock.patch('books.views.get_google_books_client') as client:
+            client.return_value.search_volumes.return_value = {'items': [
+                {'id': 'vol1', 'volumeInfo': {'title': 'Harry Potter', 'authors': ['J. K. Rowling']}}
+            ]}
+            for query in ('Harry Potter', 'harry  potter ', 'HARRY POTTER'):
+                response = self.client.get('/api/books/suggestions/', {'query': query})
+                self.assertEqual(response.data[0]['id'], 'vol1')
+        client.return_value.search_volumes.assert_called_once_with('harry potter')
+        self.assertEqual(suggestion_cache.stats()['local'], {'hits': 2, 'stale': 0, 'misses': 1, 'hit_ratio': 0.6667})
+
+    def test_empty_results_are_cached(self):
+        loader = mock.Mock(return_value=[])
+        self.assertEqual(suggestion_cache.get('zzxq', loader), [])
+        suggestion_cache.clear_local()
+        self.assertEqual(suggestion_cache.get('ZZXQ', loader), [])
+        loader.assert_called_once_with('zzxq')
+        self.assertEqual(suggestion_cache.stats()['redis']['hits'], 1)
+
+    @override_settings(SUGGESTION_LOCAL_SIZE=0)
+    def test_stale_entry_is_served_while_refreshed(self):
+        suggestion_cache.get('dune', mock.Mock(return_value=[{'id': 'old'}]))
+        _, payload = cache.get(cache_key('dune'))
+        cache.set(cache_key('dune'), (0, payload))  # свежесть истекла
+        loader = mock.Mock(return_value=[{'id': 'new'}])
+        self.assertEqual(suggestion_cache.get('Dune', loader), [{'id': 'old'}])  # без ожидания Google
+        loader.assert_called_once_with('dune')
+        self.assertEqual(suggestion_cache.get('dune', loader), [{'id': 'new'}])
+        self.assertEqual(suggestion_cache.stats()['redis'], {'hits': 1, 'stale': 1, 'misses': 1, 'hit_ratio': 0.6667})
+
+
+THROTTLE_RATES = {'anon': '100/day', 'user': '1000/day', 'suggestions': '2/min', 'photo_uploads': '60/hour'}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@mock.patch.object(SimpleRateThrottle, 'THROTTLE_RATES', THROTTLE_RATES)
+class ThrottleTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('reader', 'reader@example.com', 'password')
+        self.client.force_authenticate(self.user)
+
+    def test_expensive_endpoint_has_its_own_budget(self):
+        with mock.patch('books.views.google_suggestions', return_value=[]):
+            statuses = [self.client.get('/api/books/suggestions/?query=dune').status_code for _ in range(3)]
+            self.assertEqual(statuses, [200, 200, 429])
+            retry_after = int(self.client.get('/api/books/suggestions/?query=dune')['Retry-After'])
+        self.assertTrue(25 <= retry_after <= 30)  # 2/min: следующий через ~30 с
+        self.assertEqual(self.client.get('/api/books/list/').status_code, 200)
+        self.assertEqual(self.client.get('/api/books/photos/?user_book_id=1').status_code, 404)  # GET без scope
+
+    def test_autocomplete_spends_budget_only_on_google_fallback(self):
+        with mock.patch('books.views.autocomplete.suggest', return_value=[(1, 'Dune', 'Frank Herbert', 1)]):
+            statuses = [self.client.get('/api/books/autocomplete/?query=du').status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 200])
+        with mock.patch('books.views.autocomplete.suggest', return_value=[]), \
+                mock.patch('books.views.google_suggestions', return_value=[]) as google:
+            statuses = [self.client.get('/api/books/autocomplete/?query=zz').status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(google.call_count, 2)
+
+    def test_gcra_admits_exactly_the_budget(self):
+        with ThreadPoolExecutor(8) as executor:
+            waits = list(executor.map(lambda _: limiter.acquire('throttle:test:1', 20, 3600), range(60)))
+        self.assertEqual(waits.count(0), 20)
+        self.assertTrue(all(0 < wait <= 180 for wait in waits if wait))
+
+    def test_redis_script(self):
+        with override_settings(CACHES=REDIS_CACHES):
+            cache.delete('throttle:test:redis')
+            try:
+                waits = [limiter.acquire('throttle:test:redis', 3, 60) for _ in range(4)]
+            finally:
+                cache.delete('throttle:test:redis')
+        self.assertEqual(waits[:3], [0, 0, 0])
+        self.assertTrue(19 < waits[3] <= 20)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BookDedupeTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        genre_dictionary.clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+
+    def create_book(self, name, author, genres=(), copies=0, **fields):
+        book = Book.objects.create(name=name, author=author, overview='Overview', **fields)
+        genre_dictionary.set_book_genres(book, list(genres))
+        for _ in range(copies):
+            UserBook.objects.create(user=self.owner, book_id=book, condition='OK', location='55.7558,37.6173')
+        return book
+
+    def test_normalization(self):
+        self.assertEqual({dedupe.normalize_title(name) for name in (
+            'The Hobbit', 'Hobbit, The', 'The Hobbit (75th Anniversary Edition)', 'THE HOBBIT: Illustrated Edition',
+        )}, {'hobbit'})
+        self.assertEqual(dedupe.normalize_title('Star Wars: A New Hope'), 'star wars a new hope')
+        self.assertEqual(dedupe.normalize_title('Les Misérables'), 'les miserables')
+        self.assertNotEqual(dedupe.number_key('dragon tale 1'), dedupe.number_key('dragon tale 2'))
+        self.assertNotEqual(dedupe.number_key('rocky ii'), dedupe.number_key('rocky iii'))
+        self.assertEqual(dedupe.number_key('dune'), 0)
+        self.assertEqual(dedupe.normalize_author('Tolkien, J. R. R.'), dedupe.normalize_author('J.R.R. Tolkien'))
+        self.assertEqual(dedupe.normalize_author('Unknown'), '')
+
+    def test_proposals_and_merge(self):
+        hobbit = self.create_book('The Hobbit', 'J.R.R. Tolkien', ['Fantasy'], copies=2)
+        reissue = self.create_book('Hobbit, The', 'Tolkien', ['Classics'], copies=1, google_volume_id='vol1')
+        # Автор неизвестен, а «Hobbit» есть у двух авторов — не сливается ни с одним
+        deluxe = self.create_book('The Hobbit (Deluxe Edition)', 'Unknown')
+        other_author = self.create_book('Hobbit', 'Jane Smith')
+        new_hope = self.create_book('Star Wars: A New Hope', 'George Lucas')
+        new_hope_copy = self.create_book('Star Wars: A New Hope (Illustrated)', 'Unknown')
+        empire = self.create_book('Star Wars: The Empire Strikes Back', 'George Lucas')
+
+        stats = dedupe.find_duplicates()
+        self.assertEqual(stats['proposals'], 2)
+        # Каноническая — с наибольшим числом экземпляров
+        self.assertEqual(dict(BookMergeProposal.objects.values_list('duplicate_id', 'canonical_id')),
+                         {reissue.pk: hobbit.pk, new_hope_copy.pk: new_hope.pk})
+        self.assertEqual(BookMergeProposal.objects.get(pk=reissue.pk).score, 1.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = dedupe.merge_proposals()
+        self.assertEqual((stats['books'], stats['user_books']), (2, 1))
+        self.assertEqual(set(Book.objects.values_list('pk', flat=True)),
+                         {hobbit.pk, deluxe.pk, other_author.pk, new_hope.pk, empire.pk})
+        self.assertEqual(UserBook.objects.filter(book_id=hobbit).count(), 3)
+        hobbit.refresh_from_db()
+        self.assertEqual(hobbit.google_volume_id, 'vol1')
+        self.assertEqual(sorted(hobbit.genres.values_list('name', flat=True)), ['Classics', 'Fantasy'])
+        listings = UserBookListing.objects.filter(book_id=hobbit.pk)
+        self.assertEqual({(row.book_name, tuple(sorted(row.genres))) for row in listings},
+                         {('The Hobbit', ('Classics', 'Fantasy'))})
+        self.assertEqual(listings.count(), 3)
+        self.assertFalse(BookMergeProposal.objects.exists())
+        self.assertEqual(dedupe.merge_proposals()['books'], 0)
+
+
+class ExchangeEventStreamTests(TransactionTestCase):
+    async def test_stream_requires_authentication(self):
+        response = await self.async_client.get('/api/exchange-requests/events/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_stream_uses_configured_authentication_and_needs_asgi(self):
+        user = User.objects.create_user('reader', 'reader@example.com', 'password')
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+        self.assertEqual(self.client.get('/api/exchange-requests/events/', headers=headers).status_code, 501)
+
+        with mock.patch.object(CachedJWTAuthentication, 'get_user', autospec=True,
+                               side_effect=CachedJWTAuthentication.get_user) as get_user:
+            response = async_to_sync(self.async_client.get)('/api/exchange-requests/events/', headers=headers)
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'text/event-stream'))
+        get_user.assert_called_once()
+
+    def test_redis_hub_delivers_published_events(self):
+        user_id = uuid.uuid4().hex  # свой канал — не пересечься с другими процессами на этом Redis
+
+        async def deliver():
+            hub = events.EventHub(REDIS_CACHES['default']['LOCATION'], queue_size=2)
+            queue, other = hub.subscribe(user_id), hub.subscribe('someone-else')
+            try:
+                await asyncio.wait_for(hub.ready.wait(), timeout=5)
+                with mock.patch.object(hub, 'dispatch', wraps=hub.dispatch) as dispatch:
+                    for n in range(3):
+                        await sync_to_async(events.publish)([user_id, user_id], 'exchange_request.created', {'n': n})
+                    while dispatch.call_count < 3:
+                        await asyncio.sleep(0.01)
+                return [json.loads(queue.get_nowait()) for _ in range(queue.qsize())], other.qsize()
+            finally:
+                hub._listener.cancel()
+                await asyncio.gather(hub._listener, return_exceptions=True)
+
+        with override_settings(CACHES=REDIS_CACHES):
+            received, other_size = async_to_sync(deliver)()
+        # Повтор user_id — одна публикация; в полной очереди вытеснено самое старое событие
+        self.assertEqual([(event['type'], event['data']) for event in received],
+                         [('exchange_request.created', {'n': 1}), ('exchange_request.created', {'n': 2})])
+        self.assertEqual(other_size, 0)
+
+    def test_event_is_formatted_as_server_sent_event(self):
+        message = json.dumps({'id': 'abc', 'type': 'exchange_request.accepted', 'data': {'status': 'accepted'}})
+        self.assertEqual(
+            events.format_sse(message),
+            'id: abc\nevent: exchange_request.accepted\ndata: {"status":"accepted"}\n\n',
+        )
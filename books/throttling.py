@@ -0,0 +1,137 @@
+# books/throttling.py
+import logging
+import math
+import threading
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.throttling import AnonRateThrottle, ScopedRateThrottle, SimpleRateThrottle, UserRateThrottle
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = 'default'
+
+# GCRA: в ключе одно число — «теоретическое время прихода» (TAT) следующего
+# запроса в микросекундах. Запрос пропускается, если TAT опережает текущее
+# время не больше чем на tolerance; тогда TAT сдвигается на interval. Время —
+# из Redis (TIME), чтобы часы всех воркеров совпадали. Ответ — {пропущен, ждать мкс}
+GCRA_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000000 + tonumber(now_parts[2])
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local stored = redis.call('GET', KEYS[1])
+local tat = stored and tonumber(stored) or now
+if tat < now then
+    tat = now
+end
+if tat - now > tolerance then
+    return {0, tat - now - tolerance}
+end
+local new_tat = tat + interval
+redis.call('SET', KEYS[1], string.format('%d', new_tat), 'PX', math.ceil((new_tat - now) / 1000))
+return {1, 0}
+"""
+
+
+class GCRALimiter:
+    """
+    Проверка и списание одного запроса из бюджета «limit за period секунд»
+    (до limit запросов подряд, дальше — по одному в period / limit).
+
+    На django-redis — один вызов Lua-скрипта: атомарно для всех воркеров и
+    без гонок get/set. На другом кэше (LocMem в тестах) — та же арифметика
+    поверх cache.get/set под блокировкой процесса. Если Redis недоступен,
+    лимиты временно считаются в памяти процесса.
+    """
+
+    def __init__(self, alias=CACHE_ALIAS):
+        self.alias = alias
+        self._lock = threading.Lock()
+        self._scripts = {}  # id клиента Redis -> Script
+        self._fallback = LocMemCache('books-throttling', {'OPTIONS': {'MAX_ENTRIES': 100000}})
+
+    def acquire(self, key, limit, period):
+        """
+        0, если запрос пропущен, иначе сколько секунд ждать.
+        """
+        interval = period * 1_000_000 // limit
+        tolerance = interval * (limit - 1)
+        cache = caches[self.alias]
+        if not hasattr(cache, 'client') or not hasattr(cache.client, 'get_client'):
+            return self._acquire_local(cache, key, interval, tolerance)
+
+        from redis.exceptions import RedisError
+
+        try:
+            client = cache.client.get_client(write=True)
+            script = self._scripts.get(id(client))
+            if script is None:
+                script = self._scripts[id(client)] = client.register_script(GCRA_SCRIPT)
+            allowed, wait_us = script(keys=[cache.make_key(key)], args=[interval, tolerance], client=client)
+        except RedisError as e:
+            logger.warning('Throttle falls back to process memory: %s', e)
+            return self._acquire_local(self._fallback, key, interval, tolerance)
+        return 0 if allowed else wait_us / 1_000_000
+
+    def _acquire_local(self, cache, key, interval, tolerance):
+        now = time.time_ns() // 1000
+        with self._lock:
+            tat = max(cache.get(key) or now, now)
+            if tat - now > tolerance:
+                return (tat - now - tolerance) / 1_000_000
+            tat += interval
+            cache.set(key, tat, timeout=math.ceil((tat - now) / 1_000_000))
+        return 0
+
+
+limiter = GCRALimiter()
+
+
+class GCRAThrottle(SimpleRateThrottle):
+    """
+    SimpleRateThrottle с GCRA вместо списка отметок времени в кэше: одно
+    число на ключ, одно обращение к Redis на запрос. Бюджет — тот же
+    DEFAULT_THROTTLE_RATES[scope].
+    """
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        self.wait_seconds = limiter.acquire(self.key, self.num_requests, self.duration)
+        return self.wait_seconds == 0
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class AnonGCRAThrottle(GCRAThrottle, AnonRateThrottle):
+    pass
+
+
+class UserGCRAThrottle(GCRAThrottle, UserRateThrottle):
+    pass
+
+
+class ScopedGCRAThrottle(GCRAThrottle, ScopedRateThrottle):
+    """
+    Отдельный бюджет дорогих эндпоинтов сверх общего: throttle_scope
+    представления — строка или {метод: scope}, например {'post': 'photo_uploads'}.
+    Представления без throttle_scope не ограничивает.
+    """
+
+    def allow_request(self, request, view):
+        scope = getattr(view, self.scope_attr, None)
+        if isinstance(scope, dict):
+            scope = scope.get(request.method.lower())
+        if not scope:
+            return True
+        self.scope = scope
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().allow_request(request, view)
@@ -1,21 +1,31 @@
 from django.urls import path
 from .views import (
-    BookSuggestionView, BookCreateView, UserBookListView,
+    BookSuggestionView, BookAutocompleteView, BookCreateView, UserBookListView,
     UserBookDetailView, BookSearchView, PhotoView, PhotoDetailView,
-    ExchangeRequestView, ExchangeRequestDetailView, UserExchangeListView, UserBookOwnersView, AllUserBooksView
+    ExchangeRequestView, ExchangeRequestDetailView, UserExchangeListView, UserBookOwnersView, AllUserBooksView,
+    NearbyUserBooksView, CatalogIngestView, CatalogIngestStatusView, ResponseCacheStatsView,
+    PhotoJobView, ExchangeEventStreamView, RecommendationView
 )
 
 urlpatterns = [
     path('books/suggestions/', BookSuggestionView.as_view(), name='book-suggestions'),
+    path('books/autocomplete/', BookAutocompleteView.as_view(), name='book-autocomplete'),
     path('books/', BookCreateView.as_view(), name='book-create'),
     path('books/list/', UserBookListView.as_view(), name='user-book-list'),
     path('books/<int:user_book_id>/', UserBookDetailView.as_view(), name='user-book-detail'),
     path('books/search/', BookSearchView.as_view(), name='book-search'),
+    path('books/nearby/', NearbyUserBooksView.as_view(), name='book-nearby'),
+    path('books/recommendations/', RecommendationView.as_view(), name='book-recommendations'),
     path('books/photos/', PhotoView.as_view(), name='photo-list-create'),
     path('books/photos/<int:photo_id>/', PhotoDetailView.as_view(), name='photo-detail'),
+    path('books/photos/jobs/<uuid:job_id>/', PhotoJobView.as_view(), name='photo-job'),
     path('exchange-requests/', ExchangeRequestView.as_view(), name='exchange-request-create'),
     path('exchange-requests/<int:exchange_request_id>/', ExchangeRequestDetailView.as_view(), name='exchange-request-detail'),
     path('exchange-requests/list/', UserExchangeListView.as_view(), name='user-exchange-list'),
+    path('exchange-requests/events/', ExchangeEventStreamView.as_view(), name='exchange-events'),
     path('books/owners/', UserBookOwnersView.as_view(), name='user-book-owners'),
     path('books/all/', AllUserBooksView.as_view(), name='all-user-books'),
+    path('books/ingest/', CatalogIngestView.as_view(), name='catalog-ingest'),
+    path('books/ingest/<uuid:job_id>/', CatalogIngestStatusView.as_view(), name='catalog-ingest-status'),
+    path('books/cache-stats/', ResponseCacheStatsView.as_view(), name='response-cache-stats'),
 ]
\ No newline at end of file
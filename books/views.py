@@ -1,66 +1,254 @@
 # books/views.py
-import requests
+import hmac
+import ipaddress
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, generics
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
-from django.core.cache import cache
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
 from django.conf import settings
+from django.db import connection
+from django.db.models import Q
 from books.serializers import (
     BookSuggestionSerializer, BookCreateSerializer, UserBookCreateSerializer,
-    UserBookSerializer, PhotoSerializer, PhotoUploadSerializer, ExchangeRequestSerializer
+    UserBookSerializer, PhotoSerializer, PhotoUploadSerializer, PhotoJobSerializer, ExchangeRequestSerializer,
+    NearbyUserBookSerializer, UserBookListingSerializer, serialize_user_book_rows, user_book_rows
+)
+from books import events, exchanges, geo, google_volumes, ingest, lookups, metrics, photo_jobs, recommendations
+from books.autocomplete import MAX_LIMIT as MAX_AUTOCOMPLETE_LIMIT, autocomplete
+from books.genres import genre_dictionary
+from books.lookups import UserBookLookupRenderer
+from books.google_books import GoogleBooksError, get_client as get_google_books_client
+from books.models import (
+    Book, BookRecommendation, UserBook, UserBookListing, UserRecommendation, Photo, PhotoJob, ExchangeRequest,
+    CatalogIngestJob,
+)
+from books.pagination import OptionalKeysetPagination
+from books.response_cache import (
+    TAG_BOOKS, TAG_USER_BOOK_COUNTS, TAG_USER_BOOKS, response_cache, user_book_result_tags, user_tag
 )
-from books.models import Book, UserBook, Photo, ExchangeRequest, Genre
+from books.search import (
+    SEARCH_MODE_BASIC, SEARCH_MODES, listing_search, search_facets, search_ordering, search_user_books
+)
+from books.suggestion_cache import suggestion_cache
+from books.throttling import ScopedGCRAThrottle
 from accounts.models import User
 from django.contrib.auth import get_user_model
-import cloudinary.uploader
-from django.views.decorators.cache import cache_page
-from django.utils.decorators import method_decorator
 
 
-class AllUserBooksView(generics.ListAPIView):
+def wants_facets(request):
+    return request.query_params.get('facets', '').lower() in ('1', 'true', 'yes')
+
+
+def wants_compact(request):
+    # ?compact=true — читать список из витрины user_book_listings (без overview)
+    return request.query_params.get('compact', '').lower() in ('1', 'true', 'yes')
+
+
+class CompactListMixin:
+    def get_serializer_class(self):
+        if wants_compact(self.request):
+            return UserBookListingSerializer
+        return super().get_serializer_class()
+
+
+class TaggedResponseCacheMixin:
+    """
+    Кэширует ответ list() в response_cache с тегами: get_cache_tags() —
+    от чего зависит состав списка (известно до запроса), get_result_cache_tags()
+    — от чего зависят строки страницы. Записи живут RESPONSE_CACHE_TTL и
+    сбрасываются сигналами из books/signals.py, а не по времени.
+    """
+    cache_tags = ()
+    cache_per_user = False
+
+    def get_cache_tags(self):
+        return self.cache_tags
+
+    def get_result_cache_tags(self, rows):
+        return user_book_result_tags(rows)
+
+    def get_cache_key(self):
+        parts = [self.__class__.__name__, self.request.build_absolute_uri()]
+        if self.cache_per_user:
+            parts.append(self.request.user.pk)
+        return response_cache.make_key(*parts)
+
+    def list(self, request, *args, **kwargs):
+        key = self.get_cache_key()
+        data = response_cache.get(key)
+        if data is not None:
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        versions = response_cache.versions(self.get_cache_tags())
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            rows = response.data.get('results', []) if isinstance(response.data, dict) else response.data
+            versions.update(response_cache.versions(self.get_result_cache_tags(rows)))
+            response_cache.set(key, response.data, versions)
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+class FastUserBookListMixin:
+    """
+    list() для UserBookSerializer через .values() и serialize_user_book_rows:
+    страница — это константное число запросов (count, строки, жанры),
+    без экземпляров моделей и полей DRF.
+    """
+    def get_row_extra_fields(self):
+        return ()
+
+    def list(self, request, *args, **kwargs):
+        if self.get_serializer_class() is not UserBookSerializer:
+            return super().list(request, *args, **kwargs)
+
+        queryset = user_book_rows(self.filter_queryset(self.get_queryset()), *self.get_row_extra_fields())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serialize_user_book_rows(page))
+        return Response(serialize_user_book_rows(queryset))
+
+
+class SearchFacetsMixin:
+    """
+    ?facets=true — рядом со страницей результатов отдаёт facets (см.
+    books.search.search_facets). Снимок фасетов кэшируется на запрос без
+    учёта страницы: листание не пересчитывает агрегаты.
+    """
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if wants_facets(request) and response.status_code == status.HTTP_200_OK and isinstance(response.data, dict):
+            response.data['facets'] = self.get_facets()
+        return response
+
+    def get_facet_limit(self):
+        max_buckets = settings.SEARCH_FACET_MAX_BUCKETS
+        try:
+            limit = int(self.request.query_params.get(
+                'facet_limit', min(settings.SEARCH_FACET_BUCKETS, max_buckets)
+            ))
+        except ValueError:
+            raise ValidationError({"facet_limit": "Must be an integer"})
+        if not 1 <= limit <= max_buckets:
+            raise ValidationError({"facet_limit": f"Must be between 1 and {max_buckets}"})
+        return limit
+
+    def get_facets(self):
+        params = self.request.query_params
+        args = (params.get('query', ''), params.get('genres', ''), params.get('author', ''),
+                self.get_search_mode(), self.get_facet_limit())
+        key = response_cache.make_key('search_facets', *args)
+        facets = response_cache.get(key)
+        if facets is None:
+            versions = response_cache.versions((TAG_USER_BOOK_COUNTS, TAG_BOOKS))
+            facets = search_facets(*args)
+            response_cache.set(key, facets, versions)
+        return facets
+
+
+class AllUserBooksView(TaggedResponseCacheMixin, FastUserBookListMixin, CompactListMixin, generics.ListAPIView):
     permission_classes = [IsAdminUser]  # Только для суперпользователей
     serializer_class = UserBookSerializer
+    pagination_class = OptionalKeysetPagination
+    keyset_ordering = ('user_book_id',)
+    cache_tags = (TAG_USER_BOOK_COUNTS,)
 
     def get_queryset(self):
+        if wants_compact(self.request):
+            return UserBookListing.objects.order_by('user_book_id')
         return UserBook.objects.all().select_related('book_id').prefetch_related('book_id__genres')
 
 # Существующие представления (оставляем без изменений)
+def google_suggestions(query):
+    """
+    Подсказки Google Books для query через suggestion_cache; GoogleBooksError — наружу.
+    """
+    return suggestion_cache.get(query, fetch_google_suggestions)
+
+
+def fetch_google_suggestions(query):
+    data = get_google_books_client().search_volumes(query)
+    suggestions = []
+    for item in data.get('items', []):
+        volume_info = item.get('volumeInfo', {})
+        genres = volume_info.get('categories', ['Unknown'])
+        normalized_genres = ', '.join(g.split('/')[-1].strip() for g in genres if '/' in g)
+        if not normalized_genres and genres:
+            normalized_genres = genres[0].split('/')[-1].strip()
+        suggestion = {
+            'id': item.get('id'),
+            'name': volume_info.get('title', ''),
+            'author': ', '.join(volume_info.get('authors', ['Unknown'])),
+            'overview': volume_info.get('description', ''),
+            'genres': normalized_genres,
+        }
+        suggestions.append(suggestion)
+    return suggestions
+
+
 class BookSuggestionView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_scope = 'suggestions'
 
     def get(self, request):
         query = request.query_params.get('query', '')
         if not query:
             return Response({"error": "Query parameter is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        cache_key = f'suggestion_{query}'
-        cached_response = cache.get(cache_key)
-        if cached_response:
-            return Response(cached_response)
-
-        url = f"https://www.googleapis.com/books/v1/volumes?q={query}&key={settings.GOOGLE_API_KEY}"
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json()
-            suggestions = []
-            for item in data.get('items', []):
-                volume_info = item.get('volumeInfo', {})
-                genres = volume_info.get('categories', ['Unknown'])
-                normalized_genres = ', '.join(g.split('/')[-1].strip() for g in genres if '/' in g)
-                if not normalized_genres and genres:
-                    normalized_genres = genres[0].split('/')[-1].strip()
-                suggestion = {
-                    'id': item.get('id'),
-                    'name': volume_info.get('title', ''),
-                    'author': ', '.join(volume_info.get('authors', ['Unknown'])),
-                    'overview': volume_info.get('description', ''),
-                    'genres': normalized_genres,
-                }
-                suggestions.append(suggestion)
-            cache.set(cache_key, suggestions, timeout=3600)
-            return Response(suggestions)
-        return Response({"error": "Failed to fetch suggestions"}, status=response.status_code)
+        try:
+            suggestions = google_suggestions(query)
+        except GoogleBooksError as e:
+            return Response({"error": "Failed to fetch suggestions"}, status=e.status_code)
+        return Response(suggestions)
+
+
+class BookAutocompleteView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        GET /api/books/autocomplete/?query=<prefix>&limit=<n> - Книги каталога по началу слова
+        в названии или авторе; если локально ничего нет — подсказки Google Books
+        """
+        query = request.query_params.get('query', '').strip()
+        if not query:
+            return Response({"error": "Query parameter is required"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= limit <= MAX_AUTOCOMPLETE_LIMIT:
+            return Response(
+                {"error": f"limit must be between 1 and {MAX_AUTOCOMPLETE_LIMIT}"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # None — индекс этого воркера ещё строится: тоже идём в Google
+        matches = autocomplete.suggest(query, limit)
+        if matches:
+            return Response({"source": "local", "results": [
+                {'book_id': book_id, 'name': name, 'author': author, 'available_copies': available_copies}
+                for book_id, name, author, available_copies in matches
+            ]})
+
+        # Локальные подсказки — в общем бюджете, поход в Google — в бюджете suggestions
+        self.throttle_scope = 'suggestions'
+        throttle = ScopedGCRAThrottle()
+        if not throttle.allow_request(request, self):
+            self.throttled(request, throttle.wait())
+        try:
+            suggestions = google_suggestions(query)
+        except GoogleBooksError as e:
+            return Response({"error": "Failed to fetch suggestions"}, status=e.status_code)
+        return Response({"source": "google", "results": suggestions})
 
 
 class BookCreateView(APIView):
@@ -71,13 +259,15 @@ class BookCreateView(APIView):
         data = request.data
 
         book_id = data.get('book_id')
-        if book_id:
-            url = f"https://www.googleapis.com/books/v1/volumes/{book_id}?key={settings.GOOGLE_API_KEY}"
-            response = requests.get(url)
-            if response.status_code != 200:
-                return Response({"error": "Invalid book ID"}, status=response.status_code)
+        # Книга этого тома уже в каталоге — без Google и без разбора метаданных
+        book = Book.objects.filter(google_volume_id=book_id).first() if book_id else None
+        if book_id and book is None:
+            try:
+                volume = google_volumes.get_volume(book_id)
+            except GoogleBooksError as e:
+                return Response({"error": "Invalid book ID"}, status=e.status_code)
 
-            book_data = response.json().get('volumeInfo', {})
+            book_data = volume.get('volumeInfo', {})
             name = book_data.get('title', '')
             genres = book_data.get('categories', ['Unknown'])
             # Разбиваем жанры по слешам и сохраняем все уникальные части
@@ -91,8 +281,9 @@ class BookCreateView(APIView):
                 'author': ', '.join(book_data.get('authors', ['Unknown'])),
                 'overview': book_data.get('description', ''),
                 'genres': normalized_genres,
+                'google_volume_id': book_id,
             }
-        else:
+        elif not book_id:
             required_fields = ['name', 'author', 'overview', 'genres']
             for field in required_fields:
                 if field not in data or not data[field]:
@@ -106,50 +297,70 @@ class BookCreateView(APIView):
                 'genres': data['genres'],
             }
 
+        if book is None:
+            book = self.save_book(book_data_to_save)
+
+        user_book_data = {
+            'user': user.id,
+            'book_id': book.book_id,
+            'condition': data.get('condition', ''),
+            'location': data.get('location', ''),
+        }
+        user_book_serializer = UserBookCreateSerializer(data=user_book_data)
+        if user_book_serializer.is_valid():
+            user_book_serializer.save()
+            return Response({"message": "Book added successfully", "book_id": book.book_id, "genres": list(book.genres.values_list('name', flat=True))},
+                            status=status.HTTP_201_CREATED)
+        return Response(user_book_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    def save_book(self, book_data_to_save):
         # Создаем книгу
+        volume_id = book_data_to_save.get('google_volume_id')
         book, created = Book.objects.get_or_create(
             name=book_data_to_save['name'],
             defaults={
                 'author': book_data_to_save['author'],
                 'overview': book_data_to_save['overview'],
+                'google_volume_id': volume_id,
             }
         )
+        if not created and volume_id and book.google_volume_id is None:
+            # Книга с таким названием была раньше тома: привязываем, следующий раз — без Google
+            Book.objects.filter(pk=book.pk, google_volume_id__isnull=True).update(google_volume_id=volume_id)
 
         # Обрабатываем жанры
         if 'genres' in book_data_to_save and book_data_to_save['genres']:
             genres_str = book_data_to_save['genres']
             genre_names = [g.strip() for g in genres_str.split(',') if g.strip()]
             if genre_names:
-                genres_objects = []
-                for name in genre_names:
-                    genre, _ = Genre.objects.get_or_create(name=name)
-                    genres_objects.append(genre)
-                book.genres.set(genres_objects)
-
-        user_book_data = {
-            'user': user.id,
-            'book_id': book.book_id,
-            'condition': data.get('condition', ''),
-            'location': data.get('location', ''),
-        }
-        user_book_serializer = UserBookCreateSerializer(data=user_book_data)
-        if user_book_serializer.is_valid():
-            user_book_serializer.save()
-            return Response({"message": "Book added successfully", "book_id": book.book_id, "genres": list(book.genres.values_list('name', flat=True))},
-                            status=status.HTTP_201_CREATED)
-        return Response(user_book_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+                # Один запрос на все жанры (или ни одного, если все уже в словаре)
+                genre_dictionary.set_book_genres(book, genre_names)
+        return book
 
 User = get_user_model()
 
-class UserBookListView(generics.ListAPIView):
+class UserBookListView(TaggedResponseCacheMixin, FastUserBookListMixin, CompactListMixin, generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = UserBookSerializer
+    pagination_class = OptionalKeysetPagination
+    keyset_ordering = ('user_book_id',)
+    cache_per_user = True
 
     def get(self, request, *args, **kwargs):
         return super().get(request, *args, **kwargs)
 
+    def get_cache_tags(self):
+        user_id = self.request.query_params.get('user_id') or self.request.user.pk
+        return [user_tag(user_id)]
+
     def get_queryset(self):
         user_id = self.request.query_params.get('user_id')
+        if wants_compact(self.request):
+            if not user_id:
+                user_id = self.request.user.id
+            elif not str(user_id).isdigit():
+                return UserBookListing.objects.none()
+            return UserBookListing.objects.filter(user_id=user_id).order_by('user_book_id')
         if user_id:
             try:
                 target_user = User.objects.get(id=user_id)
@@ -202,66 +413,145 @@ class UserBookDetailView(APIView):
         user_book.delete()
         return Response({"message": "Book deleted successfully"}, status=status.HTTP_204_NO_CONTENT)
 
-class BookSearchView(generics.ListAPIView):
+class BookSearchView(
+    TaggedResponseCacheMixin, SearchFacetsMixin, FastUserBookListMixin, CompactListMixin, generics.ListAPIView
+):
     permission_classes = [IsAuthenticated]
     serializer_class = UserBookSerializer
+    pagination_class = OptionalKeysetPagination
 
-    @method_decorator(cache_page(60 * 15))  # Кэш на 15 минут
     def get(self, request, *args, **kwargs):
         return super().get(request, *args, **kwargs)
 
+    def get_cache_tags(self):
+        # Страницу по курсору меняют только новые строки: доступный экземпляр или
+        # переименованная книга; номер страницы и count — любое изменение состава
+        if self.paginator.use_keyset(self.request, self):
+            return (TAG_USER_BOOKS, TAG_BOOKS)
+        return (TAG_USER_BOOK_COUNTS, TAG_BOOKS)
+
     def get_queryset(self):
         query = self.request.query_params.get('query', '')
         genres = self.request.query_params.get('genres', '')
         author = self.request.query_params.get('author', '')
+        mode = self.get_search_mode()
+
+        if wants_compact(self.request) and mode == SEARCH_MODE_BASIC:
+            return listing_search(query, genres, author)
+        return search_user_books(query, genres, author, mode).select_related(
+            'book_id'
+        ).prefetch_related('book_id__genres')
+
+    def get_search_mode(self):
+        mode = self.request.query_params.get('mode', SEARCH_MODE_BASIC)
+        if mode not in SEARCH_MODES:
+            raise ValidationError({"mode": f"Must be one of: {', '.join(SEARCH_MODES)}"})
+        return mode
+
+    def get_serializer_class(self):
+        if self.get_search_mode() != SEARCH_MODE_BASIC:
+            return UserBookSerializer
+        return super().get_serializer_class()
+
+    def get_row_extra_fields(self):
+        # Поля релевантности нужны курсору keyset-пагинации
+        return tuple(field.lstrip('-') for field in self.get_keyset_ordering() if field != 'user_book_id')
+
+    def get_keyset_ordering(self):
+        return search_ordering(self.request.query_params.get('query', ''), self.get_search_mode())
+
+class NearbyUserBooksView(generics.ListAPIView):
+    """
+    GET /api/books/nearby/?lat=<lat>&lon=<lon>&radius_km=<km>
+    GET /api/books/nearby/?bbox=<min_lat>,<min_lon>,<max_lat>,<max_lon>
+    Доступные чужие книги поблизости, от ближайшей к дальней. min_lon > max_lon —
+    bbox через 180-й меридиан.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = NearbyUserBookSerializer
 
-        books = Book.objects.all()
+    def get_queryset(self):
+        params = self.request.query_params
+        user_books = UserBook.objects.filter(status='available').exclude(user=self.request.user)
+        max_radius = getattr(settings, 'BOOK_NEARBY_MAX_RADIUS_KM', 50)
 
-        if query:
-            books = books.filter(name__icontains=query)
+        bbox = params.get('bbox')
+        if bbox:
+            try:
+                min_lat, min_lon, max_lat, max_lon = map(float, bbox.split(','))
+            except ValueError:
+                raise ValidationError({"bbox": "Must be 'min_lat,min_lon,max_lat,max_lon'"})
+            if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+                raise ValidationError({"bbox": "Coordinates out of range or min_lat exceeds max_lat"})
+            # Тот же предел, что у radius_km: bbox не больше круга максимального радиуса
+            if max(geo.box_size_km(min_lat, min_lon, max_lat, max_lon)) > 2 * max_radius:
+                raise ValidationError({"bbox": f"Must be at most {2 * max_radius:g} km across"})
+            center_lat, center_lon = geo.box_center(min_lat, min_lon, max_lat, max_lon)
+            user_books = geo.within_box(user_books, min_lat, min_lon, max_lat, max_lon).annotate(
+                distance_km=geo.distance_km_expression(center_lat, center_lon)
+            ).order_by('distance_km', 'user_book_id')
+        else:
+            try:
+                lat, lon = geo.parse_location(f"{params.get('lat')},{params.get('lon')}")
+            except ValueError:
+                raise ValidationError({"error": "lat and lon (or bbox) are required"})
+            try:
+                radius_km = float(params.get('radius_km', 5))
+            except ValueError:
+                raise ValidationError({"radius_km": "Must be a number"})
+            if not 0 < radius_km <= max_radius:
+                raise ValidationError({"radius_km": f"Must be between 0 and {max_radius}"})
+            user_books = geo.nearby(user_books, lat, lon, radius_km)
 
-        if genres:
-            genre_list = [genre.strip() for genre in genres.split(',')]
-            books = books.filter(genres__name__in=genre_list).distinct()
+        return user_books.select_related('book_id').prefetch_related('book_id__genres')
 
-        if author:
-            books = books.filter(author__icontains=author)
+class RecommendationView(APIView):
+    permission_classes = [IsAuthenticated]
 
-        if not books.exists():
-            return UserBook.objects.none()
+    def get(self, request):
+        """
+        GET /api/books/recommendations/ - Доступные экземпляры книг, которые могут понравиться пользователю
+        GET /api/books/recommendations/?book_id=<id> - Доступные экземпляры книг, похожих на книгу
+        """
+        book_id = request.query_params.get('book_id')
+        try:
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= limit <= 100:
+            return Response({"error": "limit must be between 1 and 100"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if book_id is not None:
+            if not book_id.isdigit() or not Book.objects.filter(pk=book_id).exists():
+                return Response({"error": "Book not found"}, status=status.HTTP_404_NOT_FOUND)
+            top = BookRecommendation.objects.filter(pk=book_id).values_list('book_ids', 'scores').first()
+        else:
+            top = UserRecommendation.objects.filter(pk=request.user.pk).values_list('book_ids', 'scores').first()
+        book_ids, scores = top or ([], [])
 
-        return UserBook.objects.filter(
-            book_id__in=books,
-            status='available'
-        ).select_related('book_id').prefetch_related('book_id__genres', 'photo_set')
+        rows = serialize_user_book_rows(
+            user_book_rows(recommendations.available_copies(book_ids, request.user))[:limit]
+        )
+        scores = dict(zip(book_ids, scores))
+        for row in rows:
+            row['score'] = scores[row['book']['book_id']]
+        return Response({"results": rows}, status=status.HTTP_200_OK)
 
 class PhotoView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_scope = {'post': 'photo_uploads'}  # список фото — в общем бюджете
 
     def post(self, request):
+        """
+        POST /api/books/photos/ - Файл сохраняется на диск и загружается воркером (photo_worker)
+        """
         serializer = PhotoUploadSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
             file = serializer.validated_data['file']
             user_book = serializer.validated_data['user_book_id']
 
-            try:
-                upload_result = cloudinary.uploader.upload(
-                    file,
-                    folder=f"books/{user_book.user_book_id}",
-                    resource_type="image"
-                )
-                file_path = upload_result['secure_url']
-
-                photo = Photo.objects.create(
-                    user_book_id=user_book,
-                    file_path=file_path
-                )
-
-                photo_serializer = PhotoSerializer(photo)
-                return Response(photo_serializer.data, status=status.HTTP_201_CREATED)
-
-            except Exception as e:
-                return Response({"error": f"Failed to upload to Cloudinary: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            job = photo_jobs.enqueue_photo_upload(user_book, file)
+            return Response(PhotoJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -296,20 +586,14 @@ class PhotoDetailView(APIView):
         if not photo:
             return Response({"error": "Photo not found or access denied"}, status=status.HTTP_404_NOT_FOUND)
 
-        try:
-            public_id = photo.file_path.split('/')[-1].split('.')[0]
-            cloudinary.uploader.destroy(
-                f"books/{photo.user_book_id.user_book_id}/{public_id}",
-                resource_type="image"
-            )
-
-            photo.delete()
-            return Response({"message": "Photo deleted successfully"}, status=status.HTTP_204_NO_CONTENT)
-
-        except Exception as e:
-            return Response({"error": f"Failed to delete from Cloudinary: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # Файлы (все варианты) удаляются после коммита; сбой хранилища только пишется в лог
+        photo_jobs.delete_photo(photo)
+        return Response({"message": "Photo deleted successfully"}, status=status.HTTP_204_NO_CONTENT)
 
     def patch(self, request, photo_id):
+        """
+        PATCH /api/books/photos/<id>/ - Замена файла в фоне; старый файл доступен до окончания загрузки
+        """
         photo = self.get_object(photo_id, request.user)
         if not photo:
             return Response({"error": "Photo not found or access denied"}, status=status.HTTP_404_NOT_FOUND)
@@ -318,30 +602,25 @@ class PhotoDetailView(APIView):
         if serializer.is_valid():
             file = serializer.validated_data['file']
 
-            try:
-                public_id = photo.file_path.split('/')[-1].split('.')[0]
-                cloudinary.uploader.destroy(
-                    f"books/{photo.user_book_id.user_book_id}/{public_id}",
-                    resource_type="image"
-                )
-
-                upload_result = cloudinary.uploader.upload(
-                    file,
-                    folder=f"books/{photo.user_book_id.user_book_id}",
-                    resource_type="image"
-                )
-                new_file_path = upload_result['secure_url']
+            job = photo_jobs.enqueue_photo_upload(photo.user_book_id, file, photo=photo)
+            return Response(PhotoJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
 
-                photo.file_path = new_file_path
-                photo.save()
-
-                photo_serializer = PhotoSerializer(photo)
-                return Response(photo_serializer.data, status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-            except Exception as e:
-                return Response({"error": f"Failed to update photo in Cloudinary: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+class PhotoJobView(APIView):
+    permission_classes = [IsAuthenticated]
 
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    def get(self, request, job_id):
+        """
+        GET /api/books/photos/jobs/<job_id>/ - Статус фоновой загрузки фото
+        """
+        try:
+            job = PhotoJob.objects.select_related('photo__user_book_id').get(job_id=job_id)
+        except PhotoJob.DoesNotExist:
+            return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+        if not request.user.is_superuser and job.photo.user_book_id.user_id != request.user.id:
+            return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(PhotoJobSerializer(job).data, status=status.HTTP_200_OK)
 
 # Новые представления для обмена
 class ExchangeRequestView(APIView):
@@ -354,31 +633,16 @@ class ExchangeRequestView(APIView):
         user_book_id = request.data.get('user_book_id')
         if not user_book_id:
             return Response({"error": "user_book_id is required"}, status=status.HTTP_400_BAD_REQUEST)
-
         try:
-            user_book = UserBook.objects.get(user_book_id=user_book_id)
-        except UserBook.DoesNotExist:
-            return Response({"error": "Book not found"}, status=status.HTTP_404_NOT_FOUND)
-
-        # Проверка статуса книги
-        if user_book.status != 'available':
-            return Response({"error": "Book is not available for exchange"}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Нельзя запросить свою же книгу
-        if user_book.user == request.user:
-            return Response({"error": "You cannot request your own book"}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Создание запроса
-        exchange_request = ExchangeRequest.objects.create(
-            book=user_book,
-            requester=request.user,
-            owner=user_book.user,
-            status='pending'
-        )
+            user_book_id = int(user_book_id)
+        except (TypeError, ValueError):
+            return Response({"error": "user_book_id must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Обновление статуса книги
-        user_book.status = 'requested'
-        user_book.save()
+        # Проверка статуса и резервирование книги — одним условным UPDATE (books/exchanges.py)
+        try:
+            exchange_request = exchanges.create_request(user_book_id, request.user)
+        except exchanges.ExchangeError as e:
+            return Response({"error": str(e)}, status=e.status_code)
 
         serializer = ExchangeRequestSerializer(exchange_request)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -386,61 +650,213 @@ class ExchangeRequestView(APIView):
 class ExchangeRequestDetailView(APIView):
     permission_classes = [IsAuthenticated]
 
-    def get_object(self, exchange_request_id, user):
-        try:
-            exchange_request = ExchangeRequest.objects.get(exchange_request_id=exchange_request_id)
-            if not user.is_superuser and exchange_request.owner != user:
-                return None
-            return exchange_request
-        except ExchangeRequest.DoesNotExist:
-            return None
-
     def patch(self, request, exchange_request_id):
         """
         PATCH /api/exchange-requests/<id>/ - Принятие или отклонение запроса
         """
-        exchange_request = self.get_object(exchange_request_id, request.user)
-        if not exchange_request:
-            return Response({"error": "Request not found or access denied"}, status=status.HTTP_404_NOT_FOUND)
-
         action = request.data.get('action')  # 'accept' или 'reject'
         if not action:
             return Response({"error": "Action is required ('accept' or 'reject')"}, status=status.HTTP_400_BAD_REQUEST)
 
-        if exchange_request.status != 'pending':
-            return Response({"error": "Request is not in pending status"}, status=status.HTTP_400_BAD_REQUEST)
-
-        if action == 'accept':
-            exchange_request.status = 'accepted'
-            exchange_request.book.status = 'exchanged'
-            exchange_request.book.save()
-        elif action == 'reject':
-            exchange_request.status = 'rejected'
-            exchange_request.book.status = 'available'
-            exchange_request.book.save()
-        else:
-            return Response({"error": "Invalid action"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            exchange_request = exchanges.decide_request(exchange_request_id, request.user, action)
+        except exchanges.ExchangeError as e:
+            return Response({"error": str(e)}, status=e.status_code)
 
-        exchange_request.save()
         serializer = ExchangeRequestSerializer(exchange_request)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
-class UserExchangeListView(generics.ListAPIView):
+class UserExchangeListView(TaggedResponseCacheMixin, generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = ExchangeRequestSerializer
+    pagination_class = OptionalKeysetPagination
+    keyset_ordering = ('-created_at', '-exchange_request_id')
+    cache_per_user = True
+
+    def get_cache_tags(self):
+        return [user_tag(self.request.user.pk)]
+
+    def get_result_cache_tags(self, rows):
+        return user_book_result_tags(row['book'] for row in rows)
 
     def get_queryset(self):
-        # Книги, которые пользователь запросил (взял)
-        requested = ExchangeRequest.objects.filter(requester=self.request.user)
-        # Книги, которые пользователь отдал (его книги, которые запросили другие)
-        owned = ExchangeRequest.objects.filter(owner=self.request.user)
-        return requested.union(owned)
+        """
+        ?box=inbox — запросы на книги пользователя, ?box=outbox — его запросы,
+        без box — и те и другие; ?status=pending|accepted|rejected|completed.
+        """
+        user = self.request.user
+        box = self.request.query_params.get('box')
+        if box == 'inbox':
+            exchange_requests = ExchangeRequest.objects.filter(owner=user)
+        elif box == 'outbox':
+            exchange_requests = ExchangeRequest.objects.filter(requester=user)
+        elif box is None:
+            exchange_requests = ExchangeRequest.objects.filter(Q(owner=user) | Q(requester=user))
+        else:
+            raise ValidationError({"box": "Must be one of: inbox, outbox"})
+
+        request_status = self.request.query_params.get('status')
+        if request_status is not None:
+            statuses = dict(ExchangeRequest.REQUEST_STATUS_CHOICES)
+            if request_status not in statuses:
+                raise ValidationError({"status": f"Must be one of: {', '.join(statuses)}"})
+            exchange_requests = exchange_requests.filter(status=request_status)
+
+        return exchange_requests.select_related(
+            'book__book_id', 'requester', 'owner'
+        ).prefetch_related('book__book_id__genres').order_by(*self.keyset_ordering)
+
+class ExchangeEventStreamView(View):
+    """
+    GET /api/exchange-requests/events/ - Server-sent events об обменах пользователя
+    (exchange_request.pending/accepted/rejected) вместо опроса списка.
+    Асинхронное представление: работает только через ASGI (book_microservice.asgi).
+    """
+
+    @staticmethod
+    def authenticate(request):
+        # Те же классы, что у остального API (CachedJWTAuthentication — без запроса в БД)
+        drf_request = Request(request)
+        try:
+            for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+                authenticated = authentication_class().authenticate(drf_request)
+                if authenticated is not None:
+                    return authenticated
+            return None
+        finally:
+            # Поток событий живёт часами — соединение с БД на подписчика не держим
+            connection.close()
+
+    async def get(self, request):
+        if not isinstance(request, ASGIRequest):
+            # Под WSGI бесконечный поток занял бы sync-воркер навсегда и копился бы в памяти
+            return JsonResponse({"detail": "Event stream is only served by the ASGI application."},
+                                status=status.HTTP_501_NOT_IMPLEMENTED)
+        try:
+            authenticated = await sync_to_async(self.authenticate, thread_sensitive=False)(request)
+        except AuthenticationFailed as e:
+            return JsonResponse({"detail": str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+        if authenticated is None:
+            return JsonResponse({"detail": "Authentication credentials were not provided."},
+                                status=status.HTTP_401_UNAUTHORIZED)
+        user, _ = authenticated
+
+        response = StreamingHttpResponse(events.event_stream(user.pk), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # nginx не должен буферизовать поток
+        return response
+
+class MetricsView(View):
+    """
+    GET /metrics - метрики процесса в текстовом формате Prometheus (books.metrics).
+    Если задан METRICS_TOKEN, нужен заголовок Authorization: Bearer <token>;
+    иначе отвечаем только адресам из METRICS_ALLOWED_NETWORKS.
+    """
+
+    def get(self, request):
+        token = settings.METRICS_TOKEN
+        if token:
+            if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+                return JsonResponse({"detail": "Invalid metrics token."}, status=status.HTTP_401_UNAUTHORIZED)
+        elif not self.allowed_address(request.META.get('REMOTE_ADDR')):
+            return JsonResponse({"detail": "Metrics are not available from this address."},
+                                status=status.HTTP_403_FORBIDDEN)
+        return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    @staticmethod
+    def allowed_address(remote_addr):
+        try:
+            address = ipaddress.ip_address(remote_addr or '')
+        except ValueError:
+            return False
+        return any(address in ipaddress.ip_network(network.strip(), strict=False)
+                   for network in settings.METRICS_ALLOWED_NETWORKS if network.strip())
+
+
+class CatalogIngestView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        """
+        POST /api/books/ingest/ - Загрузка файла каталога (ids/json/csv) в фоне (ingest_worker)
+        """
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response({"error": "file is required"}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.data.get('format') or ingest.detect_format(upload.name)
+        if fmt not in ingest.FORMATS:
+            return Response({"error": f"format must be one of: {', '.join(ingest.FORMATS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        job = ingest.enqueue_ingest_job(upload, fmt)
+        return Response({"job_id": str(job.job_id), "format": fmt}, status=status.HTTP_202_ACCEPTED)
+
+
+class CatalogIngestStatusView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, job_id):
+        job = CatalogIngestJob.objects.filter(job_id=job_id).first()
+        if job is None:
+            return Response({"error": "Ingest job not found"}, status=status.HTTP_404_NOT_FOUND)
+        body = {"job_id": str(job.job_id), **job.stats, "state": job.status}
+        if job.last_error:
+            body["error"] = job.last_error
+        return Response(body, status=status.HTTP_200_OK)
+
+
+class ResponseCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        """
+        GET /api/books/cache-stats/ - Счётчики кэша ответов (hits/misses/invalidations)
+        и попадания кэша подсказок по уровням в этом воркере
+        """
+        return Response(dict(response_cache.stats(), suggestions=suggestion_cache.stats()), status=status.HTTP_200_OK)
+
 
 class UserBookOwnersView(APIView):
+    """
+    Внутренний пакетный lookup для соседних сервисов.
+    """
     permission_classes = [IsAuthenticated]
+    renderer_classes = [JSONRenderer, UserBookLookupRenderer]
+    lookup_fields = ('owner',)
 
     def post(self, request):
+        """
+        POST /api/books/owners/ - {user_book_id: owner_id} для пачки id
+        """
         user_book_ids = request.data.get("user_book_ids", [])
-        user_books = UserBook.objects.filter(user_book_id__in=user_book_ids).select_related('user')
-        result = {str(ub.user_book_id): ub.user.id for ub in user_books}
-        return Response(result, status=status.HTTP_200_OK)
\ No newline at end of file
+        fields = request.data.get("fields", ['owner'])
+        max_batch = settings.USER_BOOK_LOOKUP_MAX_BATCH
+        if not isinstance(user_book_ids, list) or not all(
+            isinstance(user_book_id, int) and not isinstance(user_book_id, bool) for user_book_id in user_book_ids
+        ):
+            return Response({"error": "user_book_ids must be a list of integers"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(user_book_ids) > max_batch:
+            return Response(
+                {"error": f"Too many user_book_ids, maximum is {max_batch}"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        if not isinstance(fields, list) or not fields or not set(fields) <= set(lookups.LOOKUP_FIELDS):
+            return Response(
+                {"error": f"fields must be a non-empty subset of {', '.join(lookups.LOOKUP_FIELDS)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        self.lookup_fields = tuple(dict.fromkeys(fields))
+
+        found = lookups.lookup_user_books(user_book_ids)
+        if isinstance(request.accepted_renderer, UserBookLookupRenderer):
+            return Response(found, status=status.HTTP_200_OK)
+        if self.lookup_fields == ('owner',):
+            # Прежний формат ответа: {"<id>": owner_id}
+            result = {str(user_book_id): values[0] for user_book_id, values in found.items()}
+        else:
+            result = {
+                str(user_book_id): {
+                    field: value for field, value in zip(lookups.LOOKUP_FIELDS, values) if field in self.lookup_fields
+                }
+                for user_book_id, values in found.items()
+            }
+        return Response(result, status=status.HTTP_200_OK)